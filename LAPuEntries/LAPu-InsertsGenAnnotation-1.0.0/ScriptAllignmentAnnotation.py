@@ -3,12 +3,65 @@
 
 #Import the neccesary python packages
 import pandas as pd
+import numpy as np
 import os
 import subprocess
 import argparse
 import re
 from Bio import SeqIO
 
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def build_annotation_index (starts, ends):
+    """
+    Function that creates the sorted arrays needed to find quickly which loci of the annotation contain a genome position
+
+    The loci are sorted by their Start and for each one of them we store the maximum End of all the loci that start before or at the same
+    position, that way overlapping loci (a gene inside another one, for example) are also taken in account
+    """
+    starts = np.asarray(starts, dtype = float)
+    ends = np.asarray(ends, dtype = float)
+
+    # Loci without Start or End can never be matched (the comparisons with nan are always False) so they are not indexed
+    valid_loci = np.flatnonzero(~np.isnan(starts) & ~np.isnan(ends))
+    order = valid_loci[np.argsort(starts[valid_loci], kind = "stable")]
+
+    return {"order":order,
+            "start":starts[order],
+            "end":ends[order],
+            "max_end":np.maximum.accumulate(ends[order])}
+
+def match_positions_to_loci (positions, annotation_index):
+    """
+    Function that returns every pair (position, locus) in which Start <= position <= End
+
+    Both elements of the pair are returned as the row number of the position in the positions given and the row number of the locus in the annotation
+    The pairs are sorted as a cross join between both tables would sort them: first by position and then by locus
+    The search costs O(log M) for each position plus the number of candidate loci, instead of comparing every position with every locus
+    """
+    positions = np.asarray(positions, dtype = float)
+
+    # Loci that start at the position or before it
+    last_candidate = np.searchsorted(annotation_index["start"], positions, side = "right")
+    # All the loci before the first one with a max_end >= position end before the position, so they are not candidates
+    first_candidate = np.searchsorted(annotation_index["max_end"], positions, side = "left")
+    number_candidates = np.clip(last_candidate - first_candidate, 0, None)
+
+    # Expand the candidate ranges to one element per (position, candidate locus) pair
+    position_rows = np.repeat(np.arange(len(positions)), number_candidates)
+    offset_candidates = np.arange(number_candidates.sum()) - np.repeat(np.cumsum(number_candidates) - number_candidates, number_candidates)
+    candidates = np.repeat(first_candidate, number_candidates) + offset_candidates
+
+    # Only keep the candidates that end at the position or after it
+    is_match = annotation_index["end"][candidates] >= positions[position_rows]
+    position_rows = position_rows[is_match]
+    locus_rows = annotation_index["order"][candidates[is_match]]
+
+    order_pairs = np.lexsort((locus_rows, position_rows))
+    return position_rows[order_pairs], locus_rows[order_pairs]
+
 description_message = """
 \t\t--------------------------------------------------------------------------------------------------------------------------
 \t\t--------------------------------------------------------------------------------------------------------------------------
@@ -474,22 +527,18 @@ final_table_name = final_directory+"/table_reads_genes_description.csv"
 
 table_seq = pd.read_table(file_magicblast,sep="\t") 
 
-#Create a cross join table from sequences alignment and annotation to select rows with matches
-
-#We create a column called key to be able to do a cross table (all possible combinations) with both tables
-table_seq['key'] = 1
-table_ann['key'] = 1
-
-table_cross = pd.merge(table_seq, table_ann, on ='key').drop("key", axis=1)
-#after doing this cross table we delete the column key
-
+#Index the annotation by the Start and End of the loci so we do not need to compare every alignment with every locus
+annotation_index = build_annotation_index(table_ann["Start"], table_ann["End"])
 
-#Filter rows by only taking the rows that the subject (reference genome in this case) starting position is between the annotated genes
-#this filtering is needed because there are lines in the table that the subject positions does not correspond to the annotated genes positions
-table_matches = table_cross[(table_cross["sstart"] >= table_cross["Start"]) & (table_cross["End"] >= table_cross["sstart"])]
+#Take the pairs alignment-locus in which the subject (reference genome in this case) starting position is between the Start and End of the annotated gene
+#a position can be in more than one locus if they overlap, in that case all of them are taken
+seq_rows, ann_rows = match_positions_to_loci(table_seq["sstart"], annotation_index)
 
-#filter columns saving only the ones that have been selected previously in columns_seq_alig and columns_ann 
-table_matches = table_matches[columns_seq_alig + columns_ann]
+#Create the table with the matches, saving only the columns that have been selected previously in columns_seq_alig and columns_ann
+#the rows are labeled as they would be in a cross join of both tables
+table_matches = pd.concat([table_seq.iloc[seq_rows][columns_seq_alig].reset_index(drop = True),
+                           table_ann.iloc[ann_rows][columns_ann].reset_index(drop = True)], axis = 1)
+table_matches.index = seq_rows*len(table_ann) + ann_rows
 
 
 #Create a table with allignments that have not been matched with any annoted genes
@@ -10,9 +10,11 @@
 # annotated genome with the entry of that BLAST allignment
 # Other outputs and adjustments can be done by giving the program more arguments like trimming the sequences based on quality, other representations
 # of the information cna be displayed, different columns can be provided in the final output and you can get more or less selective hits that come from the BLAST
+# The allignment can also be done without BLAST, with the seed-and-extend allignment engine written with numpy that this program has (-engine numpy)
+# or with Magic-BLAST (-engine magicblast), that maps short reads given in fastq or gzipped files directly
 
-# This prorgam has limitations like tracking the sequences to a map and some outputs are limited to 96-well plates sequenced plates and them having
-# the structure of rows A-H and columns 1-12
+# This prorgam has limitations like tracking the sequences to a map and some outputs are limited to the standard plate formats (24, 48, 96, 384 and 1536 wells)
+# and them having the structure of rows A-H and columns 1-12 in the case of 96-well plates, for example
 
 # This script has been tested with bacterial genomes, specifically, for Pseudomonas Putida
 
@@ -22,12 +24,1562 @@
 
 # Import the neccesary python packages
 import pandas as pd
+import numpy as np
 import os
 import subprocess
+import shlex
 import argparse
+import shutil
+import json
+import hashlib
+import tempfile
+import concurrent.futures
+import multiprocessing
+import io
+import sys
+import traceback
+import mmap
+import sqlite3
 import re
+import gzip
+import time
 from Bio import SeqIO
 
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def build_annotation_index (starts, ends):
+    """
+    Function that creates the sorted arrays needed to find quickly which loci of the annotation contain a genome position
+
+    The loci are sorted by their Start and for each one of them we store the maximum End of all the loci that start before or at the same
+    position, that way overlapping loci (a gene inside another one, for example) are also taken in account
+    """
+    starts = np.asarray(starts, dtype = float)
+    ends = np.asarray(ends, dtype = float)
+
+    # Loci without Start or End can never be matched (the comparisons with nan are always False) so they are not indexed
+    valid_loci = np.flatnonzero(~np.isnan(starts) & ~np.isnan(ends))
+    order = valid_loci[np.argsort(starts[valid_loci], kind = "stable")]
+
+    return {"order":order,
+            "start":starts[order],
+            "end":ends[order],
+            "max_end":np.maximum.accumulate(ends[order])}
+
+def match_spans_to_loci (starts, ends, annotation_index):
+    """
+    Function that returns every pair (span, locus) in which the span [start, end] and the locus [Start, End] overlap, Start <= end and start <= End
+
+    Both elements of the pair are returned as the row number of the span in the spans given and the row number of the locus in the annotation
+    The pairs are sorted as a cross join between both tables would sort them: first by span and then by locus
+    The search costs O(log M) for each span plus the number of candidate loci, instead of comparing every span with every locus
+    """
+    starts = np.asarray(starts, dtype = float)
+    ends = np.asarray(ends, dtype = float)
+
+    # Loci that start at the end of the span or before it
+    last_candidate = np.searchsorted(annotation_index["start"], ends, side = "right")
+    # All the loci before the first one with a max_end >= start of the span end before the span, so they are not candidates
+    first_candidate = np.searchsorted(annotation_index["max_end"], starts, side = "left")
+    number_candidates = np.clip(last_candidate - first_candidate, 0, None)
+
+    # Expand the candidate ranges to one element per (span, candidate locus) pair
+    span_rows = np.repeat(np.arange(len(starts)), number_candidates)
+    offset_candidates = np.arange(number_candidates.sum()) - np.repeat(np.cumsum(number_candidates) - number_candidates, number_candidates)
+    candidates = np.repeat(first_candidate, number_candidates) + offset_candidates
+
+    # Only keep the candidates that end at the start of the span or after it
+    is_match = annotation_index["end"][candidates] >= starts[span_rows]
+    span_rows = span_rows[is_match]
+    locus_rows = annotation_index["order"][candidates[is_match]]
+
+    order_pairs = np.lexsort((locus_rows, span_rows))
+    return span_rows[order_pairs], locus_rows[order_pairs]
+
+def match_positions_to_loci (positions, annotation_index):
+    """
+    Function that returns every pair (position, locus) in which Start <= position <= End, sorted first by position and then by locus
+    (see match_spans_to_loci, a position is a span of 1 nucleotide)
+    """
+    return match_spans_to_loci(positions, positions, annotation_index)
+
+# Types of the columns of the tabular output of BLAST when the hits are read to join them with the annotation, the rest of the columns are
+# read with the type that pandas finds in them. The types are the smallest ones that can have the values of BLAST: coordinates and counts in int32,
+# percentages in float32 and the names of queries and subjects, that are repeated in all their hits, as categories
+# evalue and bitscore are not given, the evalues can be lower than the ones of float32 and the bit scores are compared with the threshold as they are given
+blast_columns_types = {**{column:"int32" for column in ["qlen","slen","qstart","qend","sstart","send","length","nident","mismatch","positive","gapopen","gaps","score"]},
+                       **{column:"float32" for column in ["pident","ppos"]},
+                       **{column:"category" for column in ["qseqid","qacc","qaccver","sseqid","sallseqid","sacc","saccver","sallacc","sstrand","frames","stitle","salltitles"]},
+                       **{column:str for column in ["qseq","sseq","btop"]}}
+
+def group_query_hits (lines, index_query):
+    """
+    Function that groups the lines of a tabular output of BLAST (any iterable of lines, for example the standard output of blast_formatter)
+    by their query, that is in the column index_query. BLAST writes all the hits of a query one after the other, so only consecutive lines are grouped
+    and the lines are used while they are read, the output does not need to be finished
+
+    It yields the query and its lines
+    """
+    query_group, lines_group = None, []
+    for line in lines:
+        if not line.strip():
+            continue
+        query = line.rstrip("\n").split("\t", index_query+1)[index_query]
+        if query != query_group and len(lines_group) > 0:
+            yield query_group, lines_group
+            lines_group = []
+        query_group = query
+        lines_group.append(line)
+    if len(lines_group) > 0:
+        yield query_group, lines_group
+
+def read_hits_chunks (groups_hits, columns, file_tabular, size_chunk = 100000):
+    """
+    Function that reads the hits of groups_hits (query and its lines, see group_query_hits) in tables of size_chunk hits with the types
+    of blast_columns_types. The hits of a query are never split between two tables, so a table can have a few more hits
+    The lines are written in file_tabular, with the names of the columns in the first line, while they are read, so the tabular output is only written once,
+    and each table is read back from file_tabular, so the lines of the table are not copied in memory to read them
+    Only one table is in memory at the same time, this bounds the memory needed but the hits are not available before the program that writes them (for example
+    blast_formatter) gives them, the search itself is not streamed
+
+    It yields each table (one empty table if there are no hits)
+    """
+    types_columns = {column:blast_columns_types[column] for column in columns if column in blast_columns_types}
+    number_lines, number_chunks = 0, 0
+    with open(file_tabular, "w", buffering = 1024*1024) as outfile, open(file_tabular, "rb") as infile:
+        outfile.write("\t".join(columns)+"\n")
+        offset_chunk = outfile.tell()
+        for _, lines_query in groups_hits:
+            outfile.writelines(lines_query)
+            number_lines += len(lines_query)
+            if number_lines >= size_chunk:
+                outfile.flush()
+                infile.seek(offset_chunk)
+                yield pd.read_csv(infile, sep = "\t", header = None, names = columns, dtype = types_columns, nrows = number_lines)
+                offset_chunk = outfile.tell()
+                number_lines = 0
+                number_chunks += 1
+        if number_lines > 0 or number_chunks == 0:
+            outfile.flush()
+            infile.seek(offset_chunk)
+            yield pd.read_csv(infile, sep = "\t", header = None, names = columns, dtype = types_columns, nrows = number_lines)
+
+def hit_spans (table_seq, overlap = False):
+    """
+    Function that returns the first and last nucleotide of the genome of each hit of table_seq that is compared with the loci:
+    sstart for both if overlap is False and the span between sstart and send if it is True (in the hits of the minus strand sstart is higher than send)
+    """
+    starts = table_seq["sstart"].to_numpy(dtype = float)
+    if not overlap:
+        return starts, starts
+    ends = table_seq["send"].to_numpy(dtype = float)
+    return np.minimum(starts, ends), np.maximum(starts, ends)
+
+def filter_best_hits (table_seq, annotation_index, range_value, overlap = False):
+    """
+    Function that returns the hits of table_seq (all the hits of each query) that can be kept by join_hits_loci, the rest of hits are removed
+    before joining them with the annotation
+
+    The hits of a query with some hit in a locus (its sstart between the Start and End of a gene or, if overlap is True, any nucleotide of the
+    span between sstart and send) that are not in any locus are never in the final table,
+    and neither are the hits with a bit score lower than the best one of the hits that count (the ones in loci or, if there are none, all of them)
+    times 1-range_value. With the index of the annotation it is enough to know the maximum End of the loci that start before each position,
+    so it costs O(log M) for each hit and the pairs hit-locus are only made for the hits that are kept
+    """
+    starts, ends = hit_spans(table_seq, overlap)
+    last_candidate = np.searchsorted(annotation_index["start"], ends, side = "right")
+    if len(annotation_index["max_end"]) > 0:
+        is_in_locus = (last_candidate > 0) & (annotation_index["max_end"][np.maximum(last_candidate-1, 0)] >= starts)
+    else:
+        is_in_locus = np.zeros(len(starts), dtype = bool)
+
+    codes_query = pd.factorize(table_seq["qaccver"])[0]
+    has_locus = np.bincount(codes_query[is_in_locus], minlength = codes_query.max()+1 if len(codes_query) > 0 else 0) > 0
+    is_counted = is_in_locus | ~has_locus[codes_query]
+
+    # The same comparison of join_hits_loci, with the best bit score of the hits that count of each query
+    bitscores = table_seq["bitscore"].to_numpy()
+    highest_bitscore = pd.Series(np.where(is_counted, bitscores, -np.inf)).groupby(codes_query, sort = False).transform("max").to_numpy()
+    is_kept = is_counted & ~(bitscores < highest_bitscore*(1-range_value))
+    if is_kept.all():
+        return table_seq
+    return table_seq[is_kept]
+
+def join_hits_loci (table_seq, columns_seq_alig, table_ann, columns_ann, annotation_index, range_value, overlap = False):
+    """
+    Function that joins the hits of table_seq (all the hits of each query) with the loci of the annotation that contain their sstart position
+    and keeps only the best hit of each query, marking the queries with more than one hit within range_value of the best bit score
+
+    If overlap is True the loci are the ones that overlap any nucleotide of the whole span of the hit (sstart to send, in any strand) and the locus
+    of each hit is the one with the longest overlap. The table has 3 more columns: the overlap of the hit with its locus in nucleotides,
+    the orientation of the hit relative to the gene (sense if both are in the same strand, antisense if not) and all the loci overlapped by the hit
+
+    All the operations are done by query, so the hits can be given in several tables (see read_hits_chunks) and the results joined afterwards:
+    the rows are the ones of the queries matched with a locus and, after them, the ones of the queries without any locus, as in a cross join of
+    the hits and the annotation filtered by the positions
+    The pairs hit-locus and the filters are done with the row numbers of the hits and the loci, so only the rows that are kept are copied from the tables
+    The table is the one of the cross join of the previous versions of the script (see tests/test_interval_join.py) except in two cases: the cross join
+    removed the hits under the threshold by their row labels, that could be the same for a hit in a locus and a hit of a query without locus, so it
+    could remove hits that had to be kept, and the loci without Locus Tag are written as nan in the Rest of Locus Tag Associated and not as np.float64(nan)
+
+    It returns the table of the queries matched with some locus and the table of the queries not matched
+    """
+    # Take the pairs alignment-locus with the index of the annotation, so we do not need to compare every alignment with every locus
+    # These pairs are the ones in which the subject (reference genome in this case) starting position is between the Start and End of the annotated gene
+    # A position can be in more than one locus if they overlap, in that case all of them are taken
+    starts, ends = hit_spans(table_seq, overlap)
+    seq_rows, ann_rows = match_spans_to_loci(starts, ends, annotation_index)
+    if overlap:
+        # The pairs of each hit are sorted from the longest overlap to the shortest one, so the locus of the hit is the one with the longest overlap
+        overlap_length = (np.minimum(ends[seq_rows], table_ann["End"].to_numpy(dtype = float)[ann_rows]) -
+                          np.maximum(starts[seq_rows], table_ann["Start"].to_numpy(dtype = float)[ann_rows]) + 1).astype(np.int64)
+        order_pairs = np.lexsort((-overlap_length, seq_rows))
+        seq_rows, ann_rows, overlap_length = seq_rows[order_pairs], ann_rows[order_pairs], overlap_length[order_pairs]
+        # The strand of the hit is the one of the genome in which the read is alligned, minus if sstart is higher than send
+        is_minus = table_seq["sstart"].to_numpy()[seq_rows] > table_seq["send"].to_numpy()[seq_rows]
+        strand_gene = table_ann["Strand"].to_numpy(dtype = object)[ann_rows] if "Strand" in table_ann.columns else np.full(len(ann_rows), np.nan, dtype = object)
+        has_strand = (strand_gene == "+") | (strand_gene == "-")
+        orientation = np.full(len(ann_rows), np.nan, dtype = object)
+        orientation[has_strand] = np.where((strand_gene[has_strand] == "-") == is_minus[has_strand], "sense", "antisense")
+
+    # The allignments that have not been matched with any annoted genes are the ones of the queries without any pair
+    codes_query = pd.factorize(table_seq["qaccver"])[0]
+    not_matches_rows = np.flatnonzero(~np.isin(codes_query, codes_query[seq_rows]))
+
+    # The hits are the alignments matched with genes and, after them, the ones not matched with any annotated gene (they do not have locus, -1)
+    hits_rows = np.concatenate([seq_rows, not_matches_rows])
+    hits_ann_rows = np.concatenate([ann_rows, np.full(len(not_matches_rows), -1)])
+    hits_pairs = np.concatenate([np.arange(len(seq_rows)), np.full(len(not_matches_rows), -1)])
+    hits_codes = codes_query[hits_rows]
+    hits_bitscore = table_seq["bitscore"].to_numpy()[hits_rows]
+    is_matched = np.arange(len(hits_rows)) < len(seq_rows)
+
+    # We remove the allignments that are not within the threshold that we put so we discard these alignments according to the variable range_value
+    # We are comparing the score of each hit with the score of the best hit of that read and we delete the ones that are lower than score*threshold
+    highest_bitscore = pd.Series(hits_bitscore).groupby(hits_codes, sort = False).transform("max").to_numpy()
+    is_kept = ~(hits_bitscore < highest_bitscore*(1-range_value))
+    hits_rows, hits_ann_rows, hits_pairs, hits_codes, is_matched = hits_rows[is_kept], hits_ann_rows[is_kept], hits_pairs[is_kept], hits_codes[is_kept], is_matched[is_kept]
+
+    # We add the "warning" column in which we say if there are duplicates or not
+    is_multiple = pd.Series(hits_codes).duplicated(keep = False).to_numpy()
+
+    # Now we create the multiple locus column in case there are multiple allignments
+    # The loci of all the alignments of a query except the first one (the one that is kept) are grouped in a list, all queries at the same time
+    is_rest_allignment = pd.Series(hits_codes).duplicated(keep = "first").to_numpy()
+    # The hits not matched do not have locus (-1), so only the rows of the loci of the matched ones are taken from the annotation, that can be empty
+    locus_tags = table_ann["Locus Tag"].to_numpy()
+    locus_rest = np.full(len(hits_rows), np.nan, dtype = object)
+    locus_rest[is_matched] = locus_tags[hits_ann_rows[is_matched]]
+    locus_rest = locus_rest[is_rest_allignment]
+    locus_associated = pd.Series(locus_rest, dtype = object).groupby(hits_codes[is_rest_allignment], sort = False).agg(list)
+
+    # Now we drop the duplicates only keeping the best alignment
+    # Warning: duplicates will also be dropped for alignments with the same score or within the threshold
+    is_best = ~is_rest_allignment
+    hits_rows, hits_ann_rows, hits_pairs, hits_codes = hits_rows[is_best], hits_ann_rows[is_best], hits_pairs[is_best], hits_codes[is_best]
+    is_matched, is_multiple = is_matched[is_best], is_multiple[is_best]
+
+    # Create the table with the best hits, saving only the columns that have been selected previously in columns_seq_alig and columns_ann
+    positions_seq, positions_ann = table_seq.columns.get_indexer(columns_seq_alig), table_ann.columns.get_indexer(columns_ann)
+    table_matches = pd.concat([table_seq.iloc[hits_rows[is_matched], positions_seq].reset_index(drop = True),
+                               table_ann.iloc[hits_ann_rows[is_matched], positions_ann].reset_index(drop = True)], axis = 1)
+    table_hits = pd.concat([table_matches, table_seq.iloc[hits_rows[~is_matched], positions_seq]], sort = False, ignore_index = True)
+
+    # We add to the table the warning and the locus column, the queries with only 1 alignment do not have more loci associated
+    table_hits = table_hits.assign(**{"Multiple Allignments":is_multiple,
+                                      "Rest of Locus Tag Associated":pd.Series(hits_codes).map(locus_associated).fillna("-").to_numpy()})
+
+    if overlap:
+        # All the loci overlapped by the best hit of each query, with the overlap and the orientation, the first one is the locus of the row
+        is_pair_best = np.isin(seq_rows, hits_rows[is_matched])
+        labels_pairs = (pd.Series(locus_tags[ann_rows[is_pair_best]], dtype = object).astype(str)+" ("+pd.Series(overlap_length[is_pair_best]).astype(str)+
+                        " nt, "+pd.Series(orientation[is_pair_best]).fillna("unknown strand")+")")
+        loci_overlapped = labels_pairs.groupby(seq_rows[is_pair_best], sort = False).agg(list)
+        overlap_best = np.full(len(hits_rows), np.nan)
+        overlap_best[is_matched] = overlap_length[hits_pairs[is_matched]]
+        orientation_best = np.full(len(hits_rows), np.nan, dtype = object)
+        orientation_best[is_matched] = orientation[hits_pairs[is_matched]]
+        table_hits = table_hits.assign(**{"Overlap Length":overlap_best,
+                                          "Orientation":orientation_best,
+                                          "Loci Overlapped":pd.Series(hits_rows).map(loci_overlapped).where(is_matched, "-").to_numpy()})
+    return table_hits[is_matched], table_hits[~is_matched]
+
+def split_fasta_balanced (fasta_text, number_shards):
+    """
+    Function that splits the reads of a FASTA text in a maximum of number_shards FASTA texts with a similar size
+
+    The records are not reordered, each shard has consecutive records of the text, so if the outputs of the shards are joined
+    in the same order as the shards the result is the same as with the whole text
+    """
+    records = [">"+record for record in fasta_text.split(">")[1:]]
+    
+    # If there are no records there is nothing to split
+    if len(records) == 0:
+        return [fasta_text]
+    
+    # Each record goes to the shard that corresponds to the position where it starts in the file
+    total_size = sum(len(record) for record in records)
+    shards = [[] for _ in range(number_shards)]
+    position_file = 0
+    for record in records:
+        shards[min(number_shards-1, position_file*number_shards//total_size)].append(record)
+        position_file += len(record)
+    
+    return ["".join(shard) for shard in shards if len(shard) > 0]
+
+def run_commands_parallel (commands, number_processes, inputs = None):
+    """
+    Function that runs the given command line commands with a maximum of number_processes running at the same time
+
+    The commands are external programs (like blastn) given as lists of arguments, they are run without a shell so the paths do not need to be quoted
+    Every one of them is its own process, the threads only wait for them to finish
+    If inputs is given, each text of inputs is written in the standard input of its command (for example the reads for blastn -query -)
+    The exit codes are returned in the same order as the commands
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, number_processes)) as executor:
+        return list(executor.map(lambda command, text_input: subprocess.run(command, input = text_input, text = True).returncode,
+                                 commands, inputs if inputs != None else [None]*len(commands)))
+
+def check_exit_codes (commands, exit_codes):
+    """
+    Function that stops the program if any of the commands has not finished well (exit code different from 0), showing the first one of them
+    The outputs of a command that has failed are empty or incomplete, so they cannot be used as if the reads did not have hits
+    """
+    for command, exit_code in zip(commands, exit_codes):
+        if exit_code != 0:
+            raise Exception(f"The command exited with the code {exit_code}, its output is not complete: {shlex.join(command)}")
+
+def run_batch_entry (args_run, annotation, database_batch):
+    """
+    Function that annotates one run of -batch with annotate_run, with the standard output and error of the program and of the commands it runs
+    going to the log file next to the output directory of the run (args_run.out) and without standard input, so no question can stop it
+
+    It returns True if the run has finished well and False if it has stopped with an error, that is written in its log
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    descriptors_saved = [os.dup(descriptor) for descriptor in [0, 1, 2]]
+    file_log = os.open(os.path.abspath(args_run.out).rstrip(os.sep)+".log", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    file_null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(file_null, 0)
+    os.dup2(file_log, 1)
+    os.dup2(file_log, 2)
+    try:
+        annotate_run(args_run, annotation, database_batch)
+        run_finished = True
+    except (Exception, SystemExit): # The runs stopped before the end (SystemExit) have not finished well either
+        traceback.print_exc()
+        run_finished = False
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for descriptor, descriptor_saved in enumerate(descriptors_saved):
+            os.dup2(descriptor_saved, descriptor)
+            os.close(descriptor_saved)
+        os.close(file_log)
+        os.close(file_null)
+    return run_finished
+
+# Extensions with more than one dot that can be found in the directory of the reads
+compound_extensions = ["phd.1", "fastq.gz", "fq.gz", "fasta.gz", "fa.gz"]
+
+def index_directory_reads (directory_reads, extension_reads):
+    """
+    Function that goes through directory_reads only once and groups the files by their name without extension
+
+    The extensions in compound_extensions are taken as a whole (read.phd.1 is read with the extension phd.1), for the rest of the files
+    the extension is what is after the last dot
+
+    It returns a list with the names and paths of the reads (files with the extension extension_reads) in the order of the directory and a
+    dictionary name -> {extension:path} with all the files of the directory
+    """
+    files_reads = []
+    index_files = {}
+    with os.scandir(directory_reads) as entries:
+        for entry in entries:
+            for compound_extension in compound_extensions:
+                if entry.name.endswith("."+compound_extension):
+                    file_name, file_extension = entry.name[:-len(compound_extension)-1], compound_extension
+                    break
+            else:
+                file_name, file_extension = os.path.splitext(entry.name)
+                file_extension = file_extension[1:]
+            index_files.setdefault(file_name, {})[file_extension] = entry.path
+            if file_extension == extension_reads:
+                files_reads.append((file_name, entry.path))
+    return files_reads, index_files
+
+# Structure of the entries of the directory of an ABIF (ab1) file: tag name, tag number, element type, element size, number of elements,
+# data size, data offset (or the data itself if it is 4 bytes or less) and data handle
+abif_entry_type = np.dtype([("name", "S4"), ("number", ">i4"), ("element_type", ">i2"), ("element_size", ">i2"),
+                            ("number_elements", ">i4"), ("data_size", ">i4"), ("data_offset", ">i4"), ("data_handle", ">i4")])
+
+def read_abif_basecalls (file_abif):
+    """
+    Function that reads from an ABIF (ab1) file only the base calls (tag PBAS2), their qualities (tag PCON2) and the sample name (tag SMPL1)
+
+    The file is memory-mapped and only its directory and those tags are read, the traces and the rest of the tags are never decoded
+    The base calls and the qualities are uint8 arrays that point to the memory-mapped file (no copy is done), the file stays mapped until they are deleted
+
+    It returns the sample name (None if the file does not have it), the base calls and the qualities, or None if the file does not have base calls
+    or qualities (for example fsa files)
+    """
+    with open(file_abif, "rb") as infile:
+        data = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+    if data[:4] != b"ABIF":
+        raise ValueError(f"File {file_abif} should start with ABIF, not {data[:4]}")
+
+    # The header has the size and number of entries of the directory and where it is in the file
+    size_entry = int(np.frombuffer(data, dtype = ">i2", count = 1, offset = 16)[0])
+    number_entries, _, offset_directory = [int(value) for value in np.frombuffer(data, dtype = ">i4", count = 3, offset = 18)]
+    directory = np.ndarray(shape = (number_entries,), dtype = abif_entry_type, buffer = data, offset = offset_directory, strides = (size_entry,))
+
+    tags = {}
+    for name_tag in [(b"PBAS", 2), (b"PCON", 2), (b"SMPL", 1)]:
+        index_entry = np.flatnonzero((directory["name"] == name_tag[0]) & (directory["number"] == name_tag[1]))
+        if len(index_entry) == 0:
+            continue
+        entry = directory[index_entry[0]]
+        # The data of 4 bytes or less is stored in the directory entry itself
+        if entry["data_size"] <= 4:
+            offset_data = offset_directory+int(index_entry[0])*size_entry+20
+        else:
+            offset_data = int(entry["data_offset"])
+        tags[name_tag] = np.frombuffer(data, dtype = np.uint8, count = int(entry["data_size"]), offset = offset_data)
+
+    if (b"PBAS", 2) not in tags or (b"PCON", 2) not in tags:
+        return None
+    if (b"SMPL", 1) in tags: # The sample name is a pascal string, the first byte is its length
+        sample_name = tags[(b"SMPL", 1)][1:].tobytes().decode(errors = "replace")
+    else:
+        sample_name = None
+    return sample_name, tags[(b"PBAS", 2)], tags[(b"PCON", 2)]
+
+def read_quality_file (file_quality, format_quality, name_read, file_fastq = None):
+    """
+    Function that reads the sequence and qualities of 1 read from a quality file (ab1, fastq or qual) with name_read as the id of the read
+
+    If file_fastq is given, the read is also stored there in fastq format
+    Only the sequence, the qualities (phred, or solexa for solexa fastq files) and the read in fastq format are returned, so the rest of the
+    information of the file (for example the traces of ab1 files) does not need to be sent to other processes
+    The ab1 files are read with read_abif_basecalls, only the ones without base calls or qualities are read with SeqIO
+    """
+    if format_quality == "abi":
+        basecalls = read_abif_basecalls(file_quality)
+        if basecalls != None:
+            _, sequence, qualities = basecalls
+            sequence = sequence.tobytes().decode()
+            qualities = qualities.astype(np.int64)
+            del basecalls # The file is not mapped anymore
+            text_fastq = "@"+name_read+"\n"+sequence+"\n+\n"+(qualities+33).astype(np.uint8).tobytes().decode()+"\n"
+            if file_fastq != None:
+                with open(file_fastq, "w") as outfile:
+                    outfile.write(text_fastq)
+            return name_read, sequence, qualities, text_fastq
+
+    seq_quality = SeqIO.read(file_quality, format_quality)
+    # In case that the sequence id does not correspond to the file name, this will change it
+    seq_quality.id = name_read
+    if file_fastq != None:
+        SeqIO.write(seq_quality, file_fastq, "fastq")
+    text_fastq = io.StringIO()
+    SeqIO.write(seq_quality, text_fastq, "fastq")
+
+    if "phred_quality" in seq_quality.letter_annotations:
+        qualities = np.array(seq_quality.letter_annotations["phred_quality"], dtype = np.int64)
+    else: # Solexa qualities are used as they are, like sickle does
+        qualities = np.array(seq_quality.letter_annotations["solexa_quality"], dtype = np.int64)
+    return name_read, str(seq_quality.seq), qualities, text_fastq.getvalue()
+
+def read_quality_files (arguments_files, number_processes, size_batch = 256):
+    """
+    Function that reads the quality files with read_quality_file, each element of arguments_files are the arguments of 1 file
+
+    If number_processes is more than 1 the files are read by a pool of processes, they are sent in batches of size_batch files so the pool does not
+    decode more than one batch before its reads are taken, and the reads are returned in the same order as arguments_files
+    The reads are yielded one by one, the memory used by the reads that are kept is the one of the caller
+    The processes are created with fork because they need the functions of this script, that is not imported
+    """
+    if number_processes <= 1 or len(arguments_files) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        for arguments_file in arguments_files:
+            yield read_quality_file(*arguments_file)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = number_processes, mp_context = multiprocessing.get_context("fork")) as executor:
+        for start_batch in range(0, len(arguments_files), size_batch):
+            batch = arguments_files[start_batch:start_batch+size_batch]
+            yield from executor.map(read_quality_file, *zip(*batch), chunksize = max(1, len(batch)//(number_processes*4)))
+
+def merge_shard_files (shard_files, final_file, header_character = None):
+    """
+    Function that joins the outputs of the shards in one file in the order given
+
+    If header_character is given, the lines that start with it are only taken from the first shard (for example, the @ lines of a SAM file)
+    """
+    with open(final_file, "w") as outfile:
+        for index_shard, shard_file in enumerate(shard_files):
+            with open(shard_file, "r") as infile:
+                if header_character == None or index_shard == 0:
+                    shutil.copyfileobj(infile, outfile)
+                else:
+                    for line in infile:
+                        if not line.startswith(header_character):
+                            outfile.write(line)
+
+def hash_fasta_reads (fasta_text):
+    """
+    Function that returns the id (first word of the header) and the SHA-256 of the sequence of each read of a fasta text, in the same order
+    """
+    reads_hashes = []
+    with io.StringIO(fasta_text) as infile:
+        id_read = None
+        for line in infile:
+            if line.startswith(">"):
+                if id_read != None:
+                    reads_hashes.append((id_read, hash_sequence.hexdigest()))
+                id_read = line[1:].split(maxsplit = 1)[0] if line[1:].strip() else ""
+                hash_sequence = hashlib.sha256()
+            elif id_read != None:
+                hash_sequence.update(line.strip().encode())
+        if id_read != None:
+            reads_hashes.append((id_read, hash_sequence.hexdigest()))
+    return reads_hashes
+
+def select_fasta_reads (fasta_text, reads_selected):
+    """
+    Function that returns a fasta text with the reads of fasta_text whose id (first word of the header) is in reads_selected, in the same order
+    """
+    lines_selected = []
+    with io.StringIO(fasta_text) as infile:
+        is_selected = False
+        for line in infile:
+            if line.startswith(">"):
+                is_selected = (line[1:].split(maxsplit = 1)[0] if line[1:].strip() else "") in reads_selected
+            if is_selected:
+                lines_selected.append(line)
+    return "".join(lines_selected)
+
+def read_blast_hits (file_output, index_query, header_character = None, header_line = None):
+    """
+    Function that reads a tabular or SAM output of BLAST and groups its lines by the query, that is in the column index_query
+
+    The lines that start with header_character (for example the @ lines of a SAM file) and the line header_line (the names of the columns
+    of the tabular output) are returned apart. If the file does not exist, there are no lines
+
+    It returns the header lines and a dictionary query -> lines of that query
+    """
+    header_lines = []
+    hits_queries = {}
+    if not os.path.isfile(file_output):
+        return header_lines, hits_queries
+    with open(file_output, "r") as infile:
+        for line in infile:
+            if (header_character != None and line.startswith(header_character)) or (header_line != None and line.rstrip("\n") == header_line):
+                header_lines.append(line)
+            elif line.strip():
+                hits_queries.setdefault(line.rstrip("\n").split("\t")[index_query], []).append(line)
+    return header_lines, hits_queries
+
+def splice_known_hits (groups_new, reads, hits_known, reads_duplicated, index_query, hits_new, number_hits, store_all = True):
+    """
+    Function that puts the hits of the reads that have not been alligned in this run among the hits of the reads alligned (groups_new, query and its lines,
+    see group_query_hits), so all the hits are in the order of the reads (the list of ids reads) as if all of them had been alligned
+
+    The hits of a read are taken from hits_known (id -> lines) if it is there, from the read with the same sequence if it is in reads_duplicated
+    (id -> id of that read) and from groups_new in the rest of the cases, where the queries are in the same order as in the query file
+    The lines of the reads of groups_new are stored in hits_new (only the ones of the reads with other reads with the same sequence if store_all is False)
+    and the number of hits of every read in number_hits (id -> number)
+
+    It yields each read with hits and its lines
+    """
+    reads_source = set(reads_duplicated.values())
+    groups_new = iter(groups_new)
+    group_next = next(groups_new, None)
+    for id_read in reads:
+        if id_read in hits_known:
+            lines_read = hits_known[id_read]
+        elif id_read in reads_duplicated:
+            lines_read = replace_query_hits("".join(hits_new.get(reads_duplicated[id_read], [])), index_query, id_read)
+        elif group_next != None and group_next[0] == id_read:
+            lines_read = group_next[1]
+            if store_all or id_read in reads_source:
+                hits_new[id_read] = lines_read
+            group_next = next(groups_new, None)
+        else: # The read has no hits
+            lines_read = []
+        number_hits[id_read] = len(lines_read)
+        if len(lines_read) > 0:
+            yield id_read, lines_read
+    # The queries that are not in reads are not lost, they are given at the end
+    if group_next != None:
+        yield group_next
+        yield from groups_new
+
+def blastn_version ():
+    """
+    Function that returns the version of the blastn installed (the first line of blastn -version)
+
+    This function does not require arguments
+    """
+    return subprocess.run(["blastn", "-version"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, text = True).stdout.split("\n")[0].strip()
+
+def open_hit_cache (directory_cache):
+    """
+    Function that opens the SQLite database of BLAST hits stored in directory_cache, creating it if it is not there
+
+    Each row has the hits (tabular and SAM lines) of a read sequence, identified by the SHA-256 of the sequence, the hash of the genome sequence,
+    the BLAST version and options and the output columns, so the hits of a sequence are only used again if the search would give the same lines
+    The SAM header of each search is stored apart, it is the same for all the reads
+    """
+    os.makedirs(directory_cache, exist_ok = True)
+    connection = sqlite3.connect(os.path.join(directory_cache, "blast_hits.sqlite"), timeout = 60)
+    connection.execute("""CREATE TABLE IF NOT EXISTS hits (sequence TEXT, genome TEXT, parameters TEXT, columns TEXT, tabular TEXT, sam TEXT,
+                          PRIMARY KEY (sequence, genome, parameters, columns)) WITHOUT ROWID""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS headers (genome TEXT, parameters TEXT, columns TEXT, sam TEXT,
+                          PRIMARY KEY (genome, parameters, columns)) WITHOUT ROWID""")
+    connection.commit()
+    return connection
+
+def replace_query_hits (lines, index_field, id_read):
+    """
+    Function that returns the lines of the text lines (tabular or SAM hits of BLAST) with the column index_field changed to id_read
+    """
+    lines_read = []
+    for line in lines.splitlines():
+        fields = line.split("\t")
+        fields[index_field] = id_read
+        lines_read.append("\t".join(fields)+"\n")
+    return lines_read
+
+def lookup_hit_cache (connection, key_search, reads_hashes, index_query, with_SAM, size_batch = 500):
+    """
+    Function that looks for the reads (id and hash of the sequence, see hash_fasta_reads) in the hit cache opened with open_hit_cache
+
+    key_search is the hash of the genome, the BLAST version and options and the columns. The hits are stored with the id of the read that
+    was alligned, so the id (column index_query of the tabular lines and first column of the SAM lines) is changed to the one of each read
+    If with_SAM is True only the sequences that have the SAM lines stored are found, and none is found if the SAM header is not stored
+
+    It returns the SAM header lines (None if with_SAM is False) and a dictionary id -> (tabular lines, SAM lines) of the reads found
+    """
+    header_SAM = None
+    if with_SAM:
+        row = connection.execute("SELECT sam FROM headers WHERE genome = ? AND parameters = ? AND columns = ?", key_search).fetchone()
+        if row == None:
+            return None, {}
+        header_SAM = row[0].splitlines(keepends = True)
+
+    hashes = list(set(hash_read for _, hash_read in reads_hashes))
+    hits_stored = {}
+    for index_batch in range(0, len(hashes), size_batch): # SQLite limits the number of parameters of a query
+        batch = hashes[index_batch:index_batch+size_batch]
+        query = f"SELECT sequence, tabular, sam FROM hits WHERE genome = ? AND parameters = ? AND columns = ? AND sequence IN ({','.join('?'*len(batch))})"
+        for hash_read, tabular, sam in connection.execute(query, list(key_search)+batch):
+            if not with_SAM or sam != None:
+                hits_stored[hash_read] = (tabular, sam)
+
+    hits_found = {}
+    for id_read, hash_read in reads_hashes:
+        if hash_read in hits_stored:
+            tabular, sam = hits_stored[hash_read]
+            hits_found[id_read] = (replace_query_hits(tabular, index_query, id_read), replace_query_hits(sam, 0, id_read) if with_SAM else [])
+    return header_SAM, hits_found
+
+def store_hit_cache (connection, key_search, reads_hashes, hits_tabular, hits_SAM = None, header_SAM = None):
+    """
+    Function that stores in the hit cache opened with open_hit_cache the hits of the reads (id and hash of the sequence, see hash_fasta_reads)
+
+    hits_tabular and hits_SAM are dictionaries id -> lines (see read_blast_hits), the reads without lines are stored too because they have no hits
+    If hits_SAM is not given, the SAM lines of the sequences already stored are kept
+    """
+    rows = [(hash_read, *key_search, "".join(hits_tabular.get(id_read, [])), "".join(hits_SAM.get(id_read, [])) if hits_SAM != None else None) for id_read, hash_read in reads_hashes]
+    with connection:
+        if hits_SAM == None:
+            connection.executemany("INSERT OR IGNORE INTO hits VALUES (?, ?, ?, ?, ?, ?)", rows)
+        else:
+            connection.executemany("INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if header_SAM != None:
+            connection.execute("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)", (*key_search, "".join(header_SAM)))
+
+def hash_file (file_path):
+    """
+    Function that returns the SHA-256 of the content of a file, read in blocks so big files do not need to be loaded in memory
+    """
+    hash_content = hashlib.sha256()
+    with open(file_path, "rb") as infile:
+        for block in iter(lambda: infile.read(1024*1024), b""):
+            hash_content.update(block)
+    return hash_content.hexdigest()
+
+def make_temporal_directory (directory_parent):
+    """
+    Function that creates a temporal directory inside directory_parent with the same permissions as a directory created with os.makedirs
+
+    tempfile.mkdtemp creates the directories only readable by the user that runs the program, which does not work for a cache shared
+    between users once the directory is renamed to its final name
+    """
+    os.makedirs(directory_parent, exist_ok = True)
+    directory_temporal = tempfile.mkdtemp(dir = directory_parent)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(directory_temporal, 0o777 & ~umask)
+    return directory_temporal
+
+def save_annotation_cache (table_ann, annotation_index, directory_entry):
+    """
+    Function that stores the annotation table (with the types of compact_annotation_types) and its index in directory_entry as one .npy file per column
+    so they can be memory-mapped
+
+    The text columns are categories, they are stored as their codes and a json array with the texts of the categories (the missing values are the code -1),
+    that is smaller and faster to read than a fixed width unicode array
+    The entry is created in a temporal directory and renamed at the end, so other runs never find half written entries
+    If a column cannot be stored in this way (for example, it has text and numbers mixed), nothing is stored and False is returned
+    """
+    columns_info = []
+    arrays_entry = {}
+    categories_entry = {}
+    for index_column, column in enumerate(table_ann.columns):
+        values = table_ann[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories
+            if not all(isinstance(category, str) for category in categories):
+                return False
+            arrays_entry[f"column{index_column}.npy"] = values.cat.codes.to_numpy()
+            categories_entry[f"column{index_column}_categories.json"] = categories.tolist()
+            columns_info.append({"name":column, "dtype":str(categories.dtype), "text":True})
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            arrays_entry[f"column{index_column}.npy"] = values.to_numpy()
+            columns_info.append({"name":column, "dtype":str(values.dtype), "text":False})
+        else:
+            return False
+    for key, array in annotation_index.items():
+        arrays_entry[f"index_{key}.npy"] = array
+
+    directory_temporal = make_temporal_directory(os.path.dirname(directory_entry))
+    try:
+        for name_file, array in arrays_entry.items():
+            np.save(os.path.join(directory_temporal, name_file), array, allow_pickle = False)
+        for name_file, categories in categories_entry.items():
+            with open(os.path.join(directory_temporal, name_file), "w") as outfile:
+                json.dump(categories, outfile)
+        with open(os.path.join(directory_temporal, "columns.json"), "w") as outfile:
+            json.dump(columns_info, outfile)
+        os.rename(directory_temporal, directory_entry)
+    except OSError: # Another run has stored the same entry at the same time
+        shutil.rmtree(directory_temporal, ignore_errors = True)
+    return True
+
+def load_annotation_cache (directory_entry):
+    """
+    Function that loads the annotation table and its index stored by save_annotation_cache
+
+    The codes of the categories, the numeric columns and the index are memory-mapped and used without any conversion,
+    only the texts of the categories are read
+    """
+    with open(os.path.join(directory_entry, "columns.json"), "r") as infile:
+        columns_info = json.load(infile)
+
+    table_ann = {}
+    for index_column, column_info in enumerate(columns_info):
+        values = np.load(os.path.join(directory_entry, f"column{index_column}.npy"), mmap_mode = "r")
+        if column_info["text"]:
+            with open(os.path.join(directory_entry, f"column{index_column}_categories.json"), "r") as infile:
+                categories = pd.Index(json.load(infile), dtype = column_info["dtype"])
+            values = pd.Categorical.from_codes(values, categories = categories, validate = False)
+        table_ann[column_info["name"]] = values
+    table_ann = pd.DataFrame(table_ann, copy = False)
+
+    annotation_index = {key:np.load(os.path.join(directory_entry, f"index_{key}.npy"), mmap_mode = "r") for key in ["order", "start", "end", "max_end"]}
+    return table_ann, annotation_index
+
+def cached_blast_database (file_genome, directory_cache, verbose = False):
+    """
+    Function that returns the path of the BLAST database of file_genome stored in directory_cache, creating it if it is not there
+
+    The database is stored with the hash of the content of the genome file as name, so if the file changes a new database is created,
+    and it is created in a temporal directory that is renamed at the end, so other runs (of this or other users) never use a half created database
+    The second element returned is True if the database has been created in this call
+    A database of the cache that blastdbcmd cannot read is created again, and if the new one cannot be read either the program stops
+    """
+    directory_entry = os.path.join(directory_cache, "blastdb", hash_file(file_genome))
+    command_check = ["blastdbcmd", "-info", "-db", os.path.join(directory_entry, "genome")]
+    if os.path.isdir(directory_entry):
+        if subprocess.run(command_check, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL).returncode == 0:
+            return os.path.join(directory_entry, "genome"), False
+        shutil.rmtree(directory_entry, ignore_errors = True) # Damaged database, it is created again
+
+    directory_temporal = make_temporal_directory(os.path.dirname(directory_entry))
+    command_makeblastdb = ["makeblastdb", "-in", file_genome, "-dbtype", "nucl", "-out", os.path.join(directory_temporal, "genome")]
+    if subprocess.run(command_makeblastdb, stdout = None if verbose else subprocess.DEVNULL).returncode != 0:
+        shutil.rmtree(directory_temporal, ignore_errors = True)
+        raise Exception(f"The program 'makeblastdb' could not create the database for {file_genome}")
+    try:
+        os.rename(directory_temporal, directory_entry)
+    except OSError: # Another run has created the same database at the same time
+        shutil.rmtree(directory_temporal, ignore_errors = True)
+    if subprocess.run(command_check, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL).returncode != 0:
+        raise Exception(f"The BLAST database of {file_genome} in the cache {directory_entry} cannot be used by blastdbcmd")
+    return os.path.join(directory_entry, "genome"), True
+
+# Parameters of the numpy allignment engine (-engine numpy). The seeds are k-mers of kmer bases, but only the runs of seeds that make an exact match
+# of word bases are extended, like the words of megablast (the task of blastn by default). The k-mers found more than repeats times in the genome are not used
+# The scores are the ones of megablast (reward 1, penalty -2 and a linear gap cost of 2.5) multiplied by 2 so all of them are integers,
+# lambda and K are the Karlin-Altschul parameters of those scores and the hits with a higher E-value than evalue are not reported
+numpy_engine_parameters = {"kmer":16, "word":28, "band":32, "repeats":200, "match":2, "mismatch":-4, "gap":5, "lambda":1.28, "K":0.46, "evalue":10}
+
+# Columns of the BLAST tabular output that the numpy allignment engine can give
+numpy_engine_columns = ["qseqid","qacc","qaccver","qlen","sseqid","sacc","saccver","slen","qstart","qend","sstart","send","qseq","sseq","evalue","bitscore","score",
+                        "length","pident","nident","mismatch","positive","gapopen","gaps","sstrand","qcovhsp"]
+
+# Code of each character in the sequences of the numpy allignment engine: 0 A, 1 C, 2 G, 3 T and 4 any other character
+nucleotide_codes = np.full(256, 4, dtype = np.uint8)
+nucleotide_codes[np.frombuffer(b"ACGTacgt", dtype = np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+complement_nucleotides = str.maketrans("ACGTacgtNn", "TGCAtgcaNn")
+
+def kmer_codes (codes, length_kmer):
+    """
+    Function that returns the number that codes each k-mer of length_kmer (16 bases maximum) of a sequence coded with nucleotide_codes, 2 bits per base,
+    and if the k-mer is valid (it only has A, C, G and T)
+    """
+    number_kmers = len(codes)-length_kmer+1
+    if number_kmers <= 0:
+        return np.zeros(0, dtype = np.uint32), np.zeros(0, dtype = bool)
+    values = np.zeros(number_kmers, dtype = np.uint32)
+    for offset in range(length_kmer):
+        values = (values << np.uint32(2)) | (codes[offset:offset+number_kmers] & 3).astype(np.uint32)
+    not_valid = np.concatenate([[0], np.cumsum(codes == 4)])
+    return values, not_valid[length_kmer:] == not_valid[:number_kmers]
+
+def parse_fasta_records (lines):
+    """
+    Function that returns the id (first word of the header) and the sequence of each record of the lines of a fasta file or text, in the same order
+    """
+    records = []
+    for line in lines:
+        if line.startswith(">"):
+            records.append((line[1:].split(maxsplit = 1)[0] if line[1:].strip() else "", []))
+        elif len(records) > 0:
+            records[-1][1].append(line.strip())
+    return [(id_record, "".join(sequence)) for id_record, sequence in records]
+
+def read_fasta_records (fasta_file):
+    """
+    Function that returns the id (first word of the header) and the sequence of each record of a fasta file, in the same order (see parse_fasta_records)
+    """
+    with open(fasta_file, "r") as infile:
+        return parse_fasta_records(infile)
+
+def genome_index (file_genome, directory_index, length_kmer):
+    """
+    Function that creates, if it is not already there, the index of file_genome for the numpy allignment engine in directory_index
+
+    The index has the genome coded with nucleotide_codes (the records one after the other with a separation of N), all the k-mers of length_kmer
+    of the genome sorted and their positions, each one in a .npy file so they can be memory-mapped by load_genome_index
+    If the index is there but it was created for other content of file_genome or other length_kmer, it is created again
+    It is created in a temporal directory that is renamed at the end, so other runs never use a half created index
+    The second element returned is True if the index has been created in this call
+    """
+    hash_genome = hash_file(file_genome)
+    file_info = os.path.join(directory_index, "records.json")
+    if os.path.isfile(file_info):
+        with open(file_info, "r") as infile:
+            info = json.load(infile)
+        if info["genome"] == hash_genome and info["kmer"] == length_kmer:
+            return directory_index, False
+
+    records = read_fasta_records(file_genome)
+    separation = 64 # Long enough so no allignment goes from one record to the next one
+    starts, genome = [], []
+    position_genome = 0
+    for _, sequence in records:
+        starts.append(position_genome)
+        genome.append(nucleotide_codes[np.frombuffer(sequence.encode(), dtype = np.uint8)])
+        genome.append(np.full(separation, 4, dtype = np.uint8))
+        position_genome += len(sequence)+separation
+    genome = np.concatenate(genome) if len(genome) > 0 else np.zeros(0, dtype = np.uint8)
+
+    values, valid = kmer_codes(genome, length_kmer)
+    positions = np.nonzero(valid)[0].astype(np.uint32)
+    values = values[valid]
+    order = np.argsort(values, kind = "stable")
+
+    directory_temporal = make_temporal_directory(os.path.dirname(os.path.abspath(directory_index)))
+    np.save(os.path.join(directory_temporal, "genome.npy"), genome, allow_pickle = False)
+    np.save(os.path.join(directory_temporal, "kmers.npy"), values[order], allow_pickle = False)
+    np.save(os.path.join(directory_temporal, "positions.npy"), positions[order], allow_pickle = False)
+    with open(os.path.join(directory_temporal, "records.json"), "w") as outfile:
+        json.dump({"genome":hash_genome, "kmer":length_kmer, "names":[id_record for id_record, _ in records], "starts":starts,
+                   "lengths":[len(sequence) for _, sequence in records]}, outfile)
+    if os.path.isdir(directory_index): # Index of other content of the genome file
+        shutil.rmtree(directory_index, ignore_errors = True)
+    try:
+        os.rename(directory_temporal, directory_index)
+    except OSError: # Another run has created the same index at the same time
+        shutil.rmtree(directory_temporal, ignore_errors = True)
+    return directory_index, True
+
+def load_genome_index (directory_index):
+    """
+    Function that loads the index created by genome_index, the arrays are memory-mapped
+    """
+    with open(os.path.join(directory_index, "records.json"), "r") as infile:
+        index = json.load(infile)
+    for key in ["genome", "kmers", "positions"]:
+        index[key+"_codes" if key == "genome" else key] = np.load(os.path.join(directory_index, f"{key}.npy"), mmap_mode = "r")
+    index["starts"] = np.array(index["starts"], dtype = np.int64)
+    return index
+
+def find_seed_diagonals (codes_query, index, parameters):
+    """
+    Function that returns the diagonals (genome position - query position) in which the query has words (runs of k-mers of the index in consecutive
+    positions that make an exact match of parameters["word"] bases), grouped in ranges of diagonals that are closer than parameters["band"]
+
+    It returns a list of (first diagonal, last diagonal) of each group
+    """
+    values, valid = kmer_codes(codes_query, parameters["kmer"])
+    positions_query = np.nonzero(valid)[0]
+    values = values[valid]
+    left = np.searchsorted(index["kmers"], values, side = "left")
+    counts = np.searchsorted(index["kmers"], values, side = "right")-left
+    found = (counts > 0) & (counts <= parameters["repeats"])
+    positions_query, left, counts = positions_query[found], left[found], counts[found]
+    if len(counts) == 0:
+        return []
+
+    # Each k-mer of the query with each position of the genome where it is
+    seeds_query = np.repeat(positions_query, counts)
+    seeds_genome = index["positions"][np.repeat(left, counts)+np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)].astype(np.int64)
+    diagonals = seeds_genome-seeds_query
+
+    # Runs of seeds in the same diagonal and consecutive positions of the query
+    order = np.lexsort((seeds_query, diagonals))
+    diagonals, seeds_query = diagonals[order], seeds_query[order]
+    new_run = np.concatenate([[True], (diagonals[1:] != diagonals[:-1]) | (seeds_query[1:] != seeds_query[:-1]+1)])
+    starts_runs = np.nonzero(new_run)[0]
+    lengths_runs = np.diff(np.append(starts_runs, len(diagonals)))
+    diagonals_words = np.unique(diagonals[starts_runs[lengths_runs >= parameters["word"]-parameters["kmer"]+1]])
+    if len(diagonals_words) == 0:
+        return []
+
+    new_group = np.nonzero(np.diff(diagonals_words) > parameters["band"])[0]+1
+    return [(int(group[0]), int(group[-1])) for group in np.split(diagonals_words, new_group)]
+
+def align_banded (candidates, index, parameters, size_directions = 64*1024*1024):
+    """
+    Function that does the local allignment (Smith-Waterman with a linear gap cost) of each candidate with the genome in a band of diagonals
+
+    Each candidate is (query coded with nucleotide_codes, first diagonal, last diagonal) and the band goes parameters["band"] diagonals further on each side
+    All the candidates are alligned at the same time, one row of the query each time, and each one only uses the cells of its own band
+    so the allignment of a candidate is the same whatever the other candidates are
+
+    The directions of the traceback take one byte per cell of every candidate, so if they would need more than size_directions bytes the candidates
+    are alligned in batches of the same size (a candidate whose band is bigger than size_directions is alligned alone)
+
+    It returns, for each candidate, the score and the arrays of the query positions and the genome positions of the allignment, with -1 in the gaps
+    """
+    minimum = -10**8
+    number_candidates = len(candidates)
+    lengths_query = np.array([len(codes_query) for codes_query, _, _ in candidates], dtype = np.int64)
+    centers = np.array([(first+last)//2 for _, first, last in candidates], dtype = np.int64)
+    widths = np.array([(last-first+1)//2+parameters["band"] for _, first, last in candidates], dtype = np.int64)
+    width_max = int(widths.max())
+    size_batch = max(1, size_directions//(max(int(lengths_query.max()), 1)*(2*width_max+1)))
+    if number_candidates > size_batch:
+        return [allignment for start_batch in range(0, number_candidates, size_batch)
+                for allignment in align_banded(candidates[start_batch:start_batch+size_batch], index, parameters, size_directions)]
+    columns = np.arange(2*width_max+1, dtype = np.int64)
+    in_band = np.abs(columns[None, :]-width_max) <= widths[:, None]
+    offsets_genome = centers[:, None]+columns[None, :]-width_max # Genome position of each column in the row 0
+    length_max = int(lengths_query.max())
+    queries = np.full((number_candidates, length_max), 5, dtype = np.uint8)
+    for index_candidate, (codes_query, _, _) in enumerate(candidates):
+        queries[index_candidate, :len(codes_query)] = codes_query
+
+    genome = index["genome_codes"]
+    gap = parameters["gap"]
+    directions = np.zeros((number_candidates, length_max, len(columns)), dtype = np.uint8) # 0 start, 1 diagonal, 2 up (gap in genome), 3 left (gap in query)
+    previous = np.where(in_band, 0, minimum)
+    best_scores = np.zeros(number_candidates, dtype = np.int64)
+    best_cells = np.full((number_candidates, 2), -1, dtype = np.int64)
+    for row in range(length_max):
+        positions_genome = offsets_genome+row
+        bases_genome = np.where((positions_genome >= 0) & (positions_genome < len(genome)), genome[np.clip(positions_genome, 0, max(len(genome)-1, 0))], 4)
+        bases_query = queries[:, row][:, None]
+        scores = np.where((bases_query == bases_genome) & (bases_query < 4), parameters["match"], parameters["mismatch"])
+        valid = in_band & (row < lengths_query)[:, None]
+
+        diagonal = previous+scores
+        up = np.concatenate([previous[:, 1:], np.full((number_candidates, 1), minimum)], axis = 1)-gap
+        current = np.maximum(np.maximum(diagonal, up), 0)
+        current = np.where(valid, current, minimum)
+        # With a linear gap cost the moves from the left are the maximum of the cells on the left minus the gap cost of the distance
+        current = np.maximum(current, np.maximum.accumulate(current+gap*columns, axis = 1)-gap*columns)
+        current = np.where(valid, current, minimum)
+
+        left = np.concatenate([np.full((number_candidates, 1), minimum), current[:, :-1]], axis = 1)-gap
+        directions[:, row] = np.where(current <= 0, 0, np.where(current == diagonal, 1, np.where(current == up, 2, np.where(current == left, 3, 0))))
+        best_row = current.max(axis = 1)
+        improved = best_row > best_scores
+        best_scores[improved] = best_row[improved]
+        best_cells[improved, 0] = row
+        best_cells[improved, 1] = current.argmax(axis = 1)[improved]
+        previous = current
+
+    # The traceback goes through the bytes of the directions, it is much faster than taking the elements of the array one by one
+    allignments = []
+    for index_candidate in range(number_candidates):
+        row, column = int(best_cells[index_candidate, 0]), int(best_cells[index_candidate, 1])
+        steps = directions[index_candidate].tobytes()
+        offset_genome = int(offsets_genome[index_candidate, 0])
+        positions_query, positions_genome = [], []
+        while row >= 0 and steps[row*len(columns)+column] != 0:
+            direction = steps[row*len(columns)+column]
+            positions_query.append(row if direction != 3 else -1)
+            positions_genome.append(offset_genome+column+row if direction != 2 else -1)
+            if direction != 3:
+                row -= 1
+            if direction == 2:
+                column += 1
+            elif direction == 3:
+                column -= 1
+        allignments.append((int(best_scores[index_candidate]), np.array(positions_query[::-1], dtype = np.int64), np.array(positions_genome[::-1], dtype = np.int64)))
+    return allignments
+
+def format_evalue_blast (evalue):
+    """
+    Function that returns the E-value written as in the tabular output of BLAST
+    """
+    if evalue < 1.0e-180:
+        return "0.0"
+    elif evalue < 1.0e-99:
+        return f"{evalue:.0e}"
+    elif evalue < 0.0009:
+        return f"{evalue:.2e}"
+    elif evalue < 0.1:
+        return f"{evalue:.3f}"
+    elif evalue < 1.0:
+        return f"{evalue:.2f}"
+    elif evalue < 10.0:
+        return f"{evalue:.1f}"
+    return f"{evalue:.0f}"
+
+def format_bitscore_blast (bitscore):
+    """
+    Function that returns the bit score written as in the tabular output of BLAST
+    """
+    if bitscore > 99999:
+        return f"{bitscore:.3e}"
+    elif bitscore > 99.9:
+        return f"{bitscore:.0f}"
+    return f"{bitscore:.1f}"
+
+def align_reads_numpy (reads, directory_index, parameters):
+    """
+    Function that alligns the reads (list of id and sequence) with the genome of the index in directory_index (see genome_index) in both strands
+
+    The seeds are found with find_seed_diagonals and the groups of diagonals are alligned with align_banded. The allignments with the same
+    or smaller ranges of the query and the genome than a better one in the same strand are not reported, like in BLAST
+    The hits of each read are sorted from the best to the worst score
+
+    It returns, for each read, the list of its hits as dictionaries with the values of the columns in numpy_engine_columns and the values
+    needed for the SAM output (strand, record, cigar, sequence of the query in the strand of the genome and raw score)
+    """
+    index = load_genome_index(directory_index)
+    length_genome = sum(index["lengths"])
+    candidates, origin_candidates = [], []
+    for index_read, (_, sequence) in enumerate(reads):
+        codes_read = nucleotide_codes[np.frombuffer(sequence.encode(), dtype = np.uint8)]
+        codes_reverse = np.where(codes_read < 4, 3-codes_read, 4).astype(np.uint8)[::-1]
+        for strand, codes_query in [("plus", codes_read), ("minus", codes_reverse)]:
+            for first, last in find_seed_diagonals(codes_query, index, parameters):
+                candidates.append((codes_query, first, last))
+                origin_candidates.append((index_read, strand))
+
+    # The candidates are alligned in groups of similar length of the query, so the rows of short queries are not done for nothing
+    allignments = [None]*len(candidates)
+    order = sorted(range(len(candidates)), key = lambda index_candidate: len(candidates[index_candidate][0]))
+    for start_group in range(0, len(order), 256):
+        group = order[start_group:start_group+256]
+        for index_candidate, allignment in zip(group, align_banded([candidates[index_candidate] for index_candidate in group], index, parameters)):
+            allignments[index_candidate] = allignment
+
+    genome = index["genome_codes"]
+    letters = np.frombuffer(b"ACGTN", dtype = "S1")
+    hits_reads = [[] for _ in reads]
+    for (index_read, strand), (score, positions_query, positions_genome) in zip(origin_candidates, allignments):
+        if score <= 0:
+            continue
+        id_read, sequence = reads[index_read]
+        sequence_strand = sequence if strand == "plus" else sequence.translate(complement_nucleotides)[::-1]
+        in_query, in_genome = positions_query >= 0, positions_genome >= 0
+        bases_query = np.frombuffer(sequence_strand.encode(), dtype = "S1")[np.maximum(positions_query, 0)]
+        bases_genome = np.asarray(genome[np.maximum(positions_genome, 0)])
+        index_record = int(np.searchsorted(index["starts"], positions_genome[in_genome][0], side = "right"))-1
+        start_record = int(index["starts"][index_record])
+
+        aligned = int(np.count_nonzero(in_query & in_genome))
+        nident = int(np.count_nonzero(in_query & in_genome & (bases_genome < 4) & (nucleotide_codes[bases_query.view(np.uint8)] == bases_genome)))
+        operations = np.where(in_query & in_genome, b"M", np.where(in_genome, b"D", b"I")).tobytes().decode()
+        gaps = len(operations)-aligned
+        gapopen = len(re.findall(r"I+|D+", operations))
+        score_blast = score/2
+        bitscore = (parameters["lambda"]*score_blast-np.log(parameters["K"]))/np.log(2)
+        evalue = parameters["K"]*len(sequence)*length_genome*np.exp(-parameters["lambda"]*score_blast)
+        if evalue > parameters["evalue"]:
+            continue
+
+        # Coordinates in the read and in the record (1-based), in the minus strand the query goes backwards
+        start_strand, end_strand = int(positions_query[in_query][0])+1, int(positions_query[in_query][-1])+1
+        if strand == "plus":
+            qstart, qend = start_strand, end_strand
+        else:
+            qstart, qend = len(sequence)-end_strand+1, len(sequence)-start_strand+1
+        start_genome, end_genome = int(positions_genome[in_genome][0])-start_record+1, int(positions_genome[in_genome][-1])-start_record+1
+        qseq = np.where(in_query, bases_query, b"-").tobytes().decode()
+        sseq = np.where(in_genome, letters[np.minimum(bases_genome, 4)], b"-").tobytes().decode()
+        if strand == "minus":
+            qseq, sseq = qseq.translate(complement_nucleotides)[::-1], sseq.translate(complement_nucleotides)[::-1]
+
+        cigar = f"{start_strand-1}S" if start_strand > 1 else ""
+        for operation, run in ((group[0], len(group)) for group in re.findall(r"M+|I+|D+", operations)):
+            cigar += f"{run}{operation}"
+        cigar += f"{len(sequence)-end_strand}S" if end_strand < len(sequence) else ""
+
+        name_record = index["names"][index_record]
+        hits_reads[index_read].append({"qseqid":id_read, "qacc":id_read, "qaccver":id_read, "qlen":len(sequence), "sseqid":name_record, "sacc":name_record,
+                                       "saccver":name_record, "slen":index["lengths"][index_record], "qstart":qstart, "qend":qend,
+                                       "sstart":start_genome if strand == "plus" else end_genome, "send":end_genome if strand == "plus" else start_genome,
+                                       "qseq":qseq, "sseq":sseq, "evalue":format_evalue_blast(evalue), "bitscore":format_bitscore_blast(bitscore), "score":int(score_blast),
+                                       "length":len(operations), "pident":f"{100*nident/len(operations):.3f}", "nident":nident, "mismatch":aligned-nident, "positive":nident,
+                                       "gapopen":gapopen, "gaps":gaps, "sstrand":strand, "qcovhsp":round(100*(qend-qstart+1)/len(sequence)),
+                                       "record":name_record, "position":start_genome, "cigar":cigar, "sequence_strand":sequence_strand, "raw":score})
+
+    for index_read, hits_read in enumerate(hits_reads):
+        hits_read.sort(key = lambda hit: (-hit["raw"], hit["record"], hit["position"], hit["sstrand"]))
+        hits_kept = []
+        for hit in hits_read:
+            contained = any(hit["sstrand"] == hit_kept["sstrand"] and hit["record"] == hit_kept["record"] and
+                            hit_kept["qstart"] <= hit["qstart"] and hit["qend"] <= hit_kept["qend"] and
+                            min(hit_kept["sstart"], hit_kept["send"]) <= min(hit["sstart"], hit["send"]) and max(hit["sstart"], hit["send"]) <= max(hit_kept["sstart"], hit_kept["send"])
+                            for hit_kept in hits_kept)
+            if not contained:
+                hits_kept.append(hit)
+        hits_reads[index_read] = hits_kept
+    return hits_reads
+
+def align_reads_fasta_numpy (reads_fasta, directory_index, columns, file_SAM = None, number_processes = 1, size_batch = 256):
+    """
+    Function that alligns the reads of a fasta text with align_reads_numpy and gives the hits with the columns given (like the tabular output of BLAST)
+    and, if file_SAM is given, writes them in SAM format, in the same order of the reads
+
+    If number_processes is more than 1, the reads are alligned in batches of size_batch reads by a pool of processes created with fork
+    The reads are alligned while the lines are used, so the SAM file is complete when all the lines have been taken
+
+    It yields the lines of the tabular output
+    """
+    reads = parse_fasta_records(reads_fasta.splitlines())
+    batches = [reads[start_batch:start_batch+size_batch] for start_batch in range(0, len(reads), size_batch)]
+    if number_processes <= 1 or len(batches) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        hits_batches = (align_reads_numpy(batch, directory_index, numpy_engine_parameters) for batch in batches)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = number_processes, mp_context = multiprocessing.get_context("fork"))
+        hits_batches = executor.map(align_reads_numpy, batches, [directory_index]*len(batches), [numpy_engine_parameters]*len(batches))
+
+    index = load_genome_index(directory_index)
+    with open(file_SAM if file_SAM != None else os.devnull, "w", buffering = 1024*1024) as outfile_SAM:
+        outfile_SAM.write("@HD\tVN:1.2\tGO:query\n")
+        for name_record, length_record in zip(index["names"], index["lengths"]):
+            outfile_SAM.write(f"@SQ\tSN:{name_record}\tLN:{length_record}\n")
+        outfile_SAM.write("@PG\tID:0\tPN:ScriptAllignmentAnnotation_v200.py numpy engine\n")
+        for batch, hits_batch in zip(batches, hits_batches):
+            for (id_read, _), hits_read in zip(batch, hits_batch):
+                for index_hit, hit in enumerate(hits_read):
+                    yield "\t".join(str(hit[column]) for column in columns)+"\n"
+                    flag = (16 if hit["sstrand"] == "minus" else 0)+(256 if index_hit > 0 else 0)
+                    outfile_SAM.write(f"{id_read}\t{flag}\t{hit['record']}\t{hit['position']}\t255\t{hit['cigar']}\t*\t0\t0\t{hit['sequence_strand']}\t*\t"
+                                      f"AS:i:{hit['score']}\tEV:f:{hit['evalue']}\tNM:i:{hit['mismatch']+hit['gaps']}\tPI:f:{hit['pident']}\tBS:f:{hit['bitscore']}\n")
+    if executor != None:
+        executor.shutdown()
+
+# Columns of the BLAST tabular output that can be obtained from the SAM output of Magic-BLAST (-engine magicblast)
+magicblast_columns = ["qseqid","qacc","qaccver","qlen","sseqid","sacc","saccver","qstart","qend","sstart","send","evalue","bitscore","score",
+                      "length","pident","nident","mismatch","gapopen","gaps","sstrand"]
+
+# Karlin-Altschul parameters of the scores of Magic-BLAST by default (reward 1 and penalty -4), used to compute the E-value and the bit score of its hits
+magicblast_parameters = {"lambda":1.383, "K":0.738}
+
+def blast_database_length (database):
+    """
+    Function that returns the total number of bases of a BLAST nucleotide database, taken from blastdbcmd -info
+    """
+    info = subprocess.run(["blastdbcmd", "-info", "-db", database], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, text = True).stdout
+    match = re.search(r"([\d,]+) total bases", info)
+    if match == None:
+        raise Exception(f"The number of bases of the BLAST database {database} could not be obtained with blastdbcmd")
+    return int(match.group(1).replace(",", ""))
+
+def stream_reads_files (files_reads, outfile, size_block = 1024*1024):
+    """
+    Function that writes the content of the reads files one after the other in outfile (a binary file, for example the standard input of a program)
+    The files whose name ends with .gz are uncompressed while they are written, so the reads are never written uncompressed in the disk
+
+    It returns the number of lines and the number of fasta headers (lines that start with >) written
+    """
+    number_lines, number_headers = 0, 0
+    for file_read in files_reads:
+        with (gzip.open(file_read, "rb") if file_read.endswith(".gz") else open(file_read, "rb")) as infile:
+            end_block = b"\n"
+            for block in iter(lambda: infile.read(size_block), b""):
+                outfile.write(block)
+                number_lines += block.count(b"\n")
+                # The > of a header is always after a new line, also between two blocks
+                number_headers += block.count(b"\n>")+(block.startswith(b">") and end_block == b"\n")
+                end_block = block[-1:]
+            if end_block != b"\n": # The next file has to start in a new line
+                outfile.write(b"\n")
+                number_lines += 1
+    return number_lines, number_headers
+
+def run_magicblast (files_reads, database, format_reads, file_output, format_output = "sam", number_threads = 1):
+    """
+    Function that maps the reads of files_reads (fasta or fastq, format_reads, gzipped or not) against the BLAST database with Magic-BLAST
+
+    The reads are given to magicblast by its standard input with stream_reads_files, so there is no merged file of the reads
+    The reads without hits are not reported and the reads are not spliced, like in a genomic DNA search
+
+    It returns the number of reads given to magicblast, the number of reads mapped is the one of different queries in its output
+    """
+    command = ["magicblast", "-query", "-", "-db", database, "-infmt", format_reads, "-outfmt", format_output, "-out", file_output,
+               "-no_unaligned", "-splice", "F", "-num_threads", str(number_threads)]
+    process = subprocess.Popen(command, stdin = subprocess.PIPE)
+    try:
+        number_lines, number_headers = stream_reads_files(files_reads, process.stdin)
+        process.stdin.close()
+    except BrokenPipeError: # magicblast has stopped, the error is raised below with its exit code
+        number_lines, number_headers = 0, 0
+    if process.wait() != 0:
+        raise Exception(f"The program 'magicblast' exited with the code {process.returncode}: {' '.join(command)}")
+    return number_lines//4 if format_reads == "fastq" else number_headers
+
+def count_cigar (cigar):
+    """
+    Function that counts in the CIGAR of a SAM hit the bases of the query before and after the allignment (clipped), the bases of the query
+    and of the reference in the allignment, the gaps and the gap openings (runs of insertions or deletions)
+    The mismatches are not in the CIGAR of magicblast (M are matches or mismatches), they are counted from the edit distance (NM tag) of each hit
+
+    It returns the clipped bases at the start and at the end (in the direction of the reference), the length of the query, the bases of the reference
+    in the allignment, the length of the allignment, the gaps and the gap openings
+    """
+    operations = re.findall(r"(\d+)([MIDNSHP=X])", cigar)
+    clip_start, clip_end = 0, 0
+    for number, operation in operations[:2]: # Hard clips are always outside the soft clips
+        if operation not in "SH":
+            break
+        clip_start += int(number)
+    for number, operation in operations[::-1][:2]:
+        if operation not in "SH":
+            break
+        clip_end += int(number)
+    length_query, length_reference, length, gaps, gapopen = clip_start+clip_end, 0, 0, 0, 0
+    for number, operation in operations:
+        if operation in "M=XI":
+            length_query += int(number)
+        if operation in "M=XDN":
+            length_reference += int(number)
+        if operation in "M=XID":
+            length += int(number)
+        if operation in "ID":
+            gaps += int(number)
+            gapopen += 1
+    return clip_start, clip_end, length_query, length_reference, length, gaps, gapopen
+
+def convert_magicblast_sam (file_magicblast, columns, length_database):
+    """
+    Function that converts the hits of the SAM output of Magic-BLAST in file_magicblast to the columns given, like the tabular
+    output of BLAST, so they can be joined with the annotation in the same way as the hits of BLASTn
+
+    The positions, lengths and gaps are counted from the CIGAR of each hit with count_cigar, the mismatches from its edit distance (NM tag) and the score
+    is its AS tag. The strand of the hit is minus if the read is reverse complemented (flag 16), then sstart is bigger than send and qstart and qend
+    are counted from the end of the CIGAR, as in BLAST. The E-value and the bit score are computed from the score with magicblast_parameters
+    and length_database (the total number of bases of the database)
+    The short reads have few different CIGARs, scores and edit distances, so the values of each strand, CIGAR, score and edit distance are computed only once
+
+    It yields the lines of the hits with the columns given
+    """
+    values_hits = {}
+    with open(file_magicblast, "r") as infile:
+        for line in infile:
+            if line.startswith("@") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            flag = int(fields[1])
+            if flag & 4: # Unmapped read
+                continue
+            tags = [tag for tag in fields[11:] if tag.startswith("AS:") or tag.startswith("NM:")]
+
+            # The values that do not depend on the read, the reference and the position are the same for all the hits with the same strand, CIGAR, score and edit distance
+            key_hit = (flag & 16, fields[5], *sorted(tags))
+            if key_hit not in values_hits:
+                tags_hit = dict((tag[:2], tag[5:]) for tag in tags)
+                clip_start, clip_end, length_query, length_reference, length, gaps, gapopen = count_cigar(fields[5])
+                mismatch = int(tags_hit["NM"])-gaps
+                nident = length-gaps-mismatch
+                score = int(tags_hit["AS"])
+                evalue = magicblast_parameters["K"]*length_query*length_database*np.exp(-magicblast_parameters["lambda"]*score)
+                bitscore = (magicblast_parameters["lambda"]*score-np.log(magicblast_parameters["K"]))/np.log(2)
+                values_hits[key_hit] = {"qlen":length_query, "qstart":clip_end+1 if flag & 16 else clip_start+1, "qend":length_query-(clip_start if flag & 16 else clip_end),
+                                        "evalue":format_evalue_blast(evalue), "bitscore":format_bitscore_blast(bitscore), "score":score, "length":length,
+                                        "pident":f"{100*nident/length:.3f}" if length > 0 else "0.000", "nident":nident, "mismatch":mismatch, "gapopen":gapopen,
+                                        "gaps":gaps, "sstrand":"minus" if flag & 16 else "plus", "length_reference":length_reference}
+            values = values_hits[key_hit].copy()
+
+            query, reference = fields[0], fields[2]
+            start, end = int(fields[3]), int(fields[3])+values["length_reference"]-1
+            values["sstart"], values["send"] = (end, start) if flag & 16 else (start, end)
+            accession = reference.rsplit(".", 1)[0] if reference.rsplit(".", 1)[-1].isdigit() else reference
+            values.update({"qseqid":query, "qacc":query, "qaccver":query, "sseqid":reference, "sacc":accession, "saccver":reference})
+            yield "\t".join(str(values[column]) for column in columns)+"\n"
+
+def compact_annotation_types (table_ann):
+    """
+    Function that returns the annotation table with the text columns as categories and the integer columns as int32 if their values fit in it
+
+    The loci of the hits are copied from the annotation, with categories only the codes of the texts are copied
+    """
+    types_columns = {}
+    for column in table_ann.columns:
+        values = table_ann[column]
+        if pd.api.types.is_integer_dtype(values) and len(values) > 0 and np.iinfo(np.int32).min <= values.min() and values.max() <= np.iinfo(np.int32).max:
+            types_columns[column] = "int32"
+        elif not pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            types_columns[column] = "category"
+    return table_ann.astype(types_columns)
+
+def load_annotation (file_annotation, columns, directory_cache = None):
+    """
+    Function that returns the table of the annotation file, with only the columns given that are in it and the types of compact_annotation_types,
+    and its index (see build_annotation_index)
+
+    If directory_cache is given, the parsed annotation is stored there with the hash of the content of the file and of the columns as name, so the next runs
+    with the same annotation file and columns load it directly instead of parsing the csv again
+    The index is None if the annotation does not have the columns Start and End
+    """
+    if directory_cache != None:
+        key_entry = hash_file(file_annotation)+"\n"+"\n".join(sorted(set(columns)))
+        directory_entry = os.path.join(directory_cache, "annotation", hashlib.sha256(key_entry.encode()).hexdigest())
+        if os.path.isdir(directory_entry):
+            try:
+                return load_annotation_cache(directory_entry)
+            except (OSError, ValueError, KeyError): # Damaged entry, it is created again
+                shutil.rmtree(directory_entry, ignore_errors = True)
+
+    table_ann = compact_annotation_types(pd.read_csv(file_annotation, usecols = lambda column: column in columns))
+    if "Start" not in table_ann.columns or "End" not in table_ann.columns:
+        return table_ann, None
+    annotation_index = build_annotation_index(table_ann["Start"], table_ann["End"])
+
+    if directory_cache != None:
+        try:
+            save_annotation_cache(table_ann, annotation_index, directory_entry)
+        except OSError:
+            print(f" WARNING: The annotation could not be stored in the cache directory {directory_cache}\n")
+    return table_ann, annotation_index
+
+# Number of rows and columns of the plate formats that can be used
+plate_formats = {24:(4, 6), 48:(6, 8), 96:(8, 12), 384:(16, 24), 1536:(32, 48)}
+
+def plate_geometry (number_wells, numbering = "column"):
+    """
+    Function that creates the layout of a plate with number_wells wells and the tables to change the number of a well to its name and back
+
+    The rows are named with letters (A, B, ..., Z, AA, AB, ... for the plates with more than 26 rows) and the columns with numbers from 1
+    The wells can be numbered by columns, top to bottom and left to right (in a 96-well plate 1 is A1, 2 is B1 and 96 is H12), or by rows,
+    left to right and top to bottom (in a 96-well plate 1 is A1, 2 is A2 and 96 is H12)
+
+    It returns a dictionary with the names of the rows and the columns of the plate, the name, row and column of each well in the position number-1
+    and a table rows x columns with the number of each well
+    """
+    number_rows, number_columns = plate_formats[number_wells]
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    rows_plate = [letters[index_row] if index_row < 26 else letters[index_row//26-1]+letters[index_row%26] for index_row in range(number_rows)]
+    columns_plate = list(range(1, number_columns+1))
+
+    index_wells = np.arange(number_wells)
+    if numbering == "column":
+        index_rows, index_columns = index_wells%number_rows, index_wells//number_rows
+    else:
+        index_rows, index_columns = index_wells//number_columns, index_wells%number_columns
+
+    rows_wells = np.array(rows_plate, dtype = object)[index_rows]
+    columns_wells = index_columns+1
+    numbers_wells = np.zeros((number_rows, number_columns), dtype = int)
+    numbers_wells[index_rows, index_columns] = index_wells+1
+
+    return {"wells":number_wells,
+            "numbering":numbering,
+            "rows":rows_plate,
+            "columns":columns_plate,
+            "names":rows_wells+columns_wells.astype(str).astype(object),
+            "row":rows_wells,
+            "column":columns_wells.astype(float),
+            "number":numbers_wells}
+
+def find_well_positions (queries, regex_exp, geometry):
+    """
+    Function that finds in the name of each query the well of the plate in which it was sequenced
+
+    regex_exp needs 3 groups: the row and the column of the well (for example A01) or the number of the well (for example 2), where the
+    numbers are changed to wells with the tables of geometry (see plate_geometry). If there are several matches in a name, the last one is taken
+    All the names are searched at the same time
+
+    It returns a table with the columns PositionSeqPlate, Row and Column (nan when the well is not found), the names without matches
+    and the numbers that are not in the plate
+    """
+    queries = pd.Series(queries, dtype = object).reset_index(drop = True)
+    # With the .* before the expression the match found is the last one of the name
+    matches = queries.str.extract(r"^.*(?:"+regex_exp+")")
+
+    # Tables of number -> well, row and column of the plate
+    names_wells = geometry["names"]
+    rows_wells = geometry["row"]
+    columns_wells = geometry["column"]
+
+    is_well = (matches[0].notna() & matches[1].notna()).to_numpy()
+    numbers = pd.to_numeric(matches[2], errors = "coerce").to_numpy()
+    is_number = ~is_well & (numbers >= 1) & (numbers <= geometry["wells"])
+
+    position_plate = np.full(len(queries), np.nan, dtype = object)
+    row_plate = np.full(len(queries), np.nan, dtype = object)
+    column_plate = np.full(len(queries), np.nan, dtype = float)
+
+    position_plate[is_well] = (matches[0]+matches[1])[is_well].to_numpy(dtype = object)
+    row_plate[is_well] = matches[0][is_well].to_numpy(dtype = object)
+    column_plate[is_well] = matches[1][is_well].astype(int).to_numpy()
+
+    index_wells = numbers[is_number].astype(int)-1
+    position_plate[is_number] = names_wells[index_wells]
+    row_plate[is_number] = rows_wells[index_wells]
+    column_plate[is_number] = columns_wells[index_wells]
+
+    positions = pd.DataFrame({"PositionSeqPlate":position_plate, "Row":row_plate, "Column":column_plate})
+    queries_not_matched = list(queries[matches.isna().all(axis = 1).to_numpy()])
+    numbers_out_plate = list(matches[2][~is_well & ~is_number & matches[2].notna().to_numpy()])
+    return positions, queries_not_matched, numbers_out_plate
+
+def trim_reads_quality (qualities, threshold, length_threshold):
+    """
+    Function that finds where each read has to be trimmed with a sliding window of the Phred qualities, in the same way as sickle se does
+
+    The window is the 10% of the length of the read (or the whole read if it is shorter than 10 nucleotides). The 5' cut is the first position with
+    quality >= threshold of the first window with mean quality >= threshold, and the 3' cut is the first position with quality < threshold of the
+    first window after it with mean quality < threshold. The reads that have no 5' cut or that are shorter than length_threshold after the trimming are discarded
+    All the reads are processed at the same time with their qualities one after another in a single array
+
+    It returns 2 arrays with the start and end (not included) of the trimmed read, both are -1 for the discarded reads
+    """
+    lengths = np.array([len(quality) for quality in qualities], dtype = np.int64)
+    number_reads = len(lengths)
+    five_prime_cut = np.full(number_reads, -1, dtype = np.int64)
+    three_prime_cut = np.full(number_reads, -1, dtype = np.int64)
+    # Reads shorter than the length threshold (or empty) are discarded before trimming
+    is_valid = (lengths >= length_threshold) & (lengths > 0)
+    if not is_valid.any():
+        return five_prime_cut, three_prime_cut
+
+    lengths = lengths[is_valid]
+    quality_all = np.concatenate([np.asarray(quality, dtype = np.int64) for quality, valid in zip(qualities, is_valid) if valid])
+    starts_reads = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    windows = lengths//10
+    windows[windows == 0] = lengths[windows == 0]
+
+    # Sum of the qualities of every window of every read with the cumulative sum of the qualities
+    quality_cumulative = np.concatenate(([0], np.cumsum(quality_all)))
+    number_windows = lengths-windows+1
+    read_window = np.repeat(np.arange(len(lengths)), number_windows)
+    start_window = np.arange(number_windows.sum())-np.repeat(np.cumsum(number_windows)-number_windows, number_windows)
+    position_window = starts_reads[read_window]+start_window
+    sum_window = quality_cumulative[position_window+windows[read_window]]-quality_cumulative[position_window]
+    # Mean >= threshold is compared without divisions so there are no rounding problems
+    is_good_window = sum_window >= threshold*windows[read_window]
+
+    # First good window of each read and first bad window after it (number_windows if there is none)
+    first_windows = np.cumsum(number_windows)-number_windows
+    first_good = np.minimum.reduceat(np.where(is_good_window, start_window, number_windows[read_window]), first_windows)
+    is_bad_window = ~is_good_window & (start_window > first_good[read_window])
+    first_bad = np.minimum.reduceat(np.where(is_bad_window, start_window, number_windows[read_window]), first_windows)
+
+    # For each position, the next position (itself included) with good or bad quality, a window with good (bad) mean always has one inside
+    positions = np.arange(len(quality_all))
+    next_good = np.minimum.accumulate(np.where(quality_all >= threshold, positions, len(quality_all))[::-1])[::-1]
+    next_bad = np.minimum.accumulate(np.where(quality_all < threshold, positions, len(quality_all))[::-1])[::-1]
+
+    # The read is discarded if there is not any good window
+    has_five_prime = first_good < number_windows
+    five_prime = np.where(has_five_prime, next_good[starts_reads+np.minimum(first_good, number_windows-1)]-starts_reads, -1)
+    three_prime = np.where(first_bad < number_windows, next_bad[starts_reads+np.minimum(first_bad, number_windows-1)]-starts_reads, lengths)
+    is_kept = has_five_prime & (three_prime-five_prime >= length_threshold)
+
+    five_prime_cut[is_valid] = np.where(is_kept, five_prime, -1)
+    three_prime_cut[is_valid] = np.where(is_kept, three_prime, -1)
+    return five_prime_cut, three_prime_cut
+
+def quality_per_position (qualities):
+    """
+    Function that summarises the distribution of the qualities of all the reads in each position (first nucleotide is position 1)
+
+    The qualities of all the reads are counted at the same time in a table positions x quality values, so the memory needed does not depend
+    on the number of reads, and the percentiles of each position are obtained from that table
+
+    It returns a table with the columns Position, Reads (number of reads that reach that position), Mean and the percentiles 10, 25, 50, 75 and 90
+    """
+    lengths = np.array([len(quality) for quality in qualities], dtype = np.int64)
+    if lengths.sum() == 0:
+        return pd.DataFrame(columns = ["Position", "Reads", "Mean", "Percentile 10", "Percentile 25", "Percentile 50", "Percentile 75", "Percentile 90"])
+    quality_all = np.concatenate([np.asarray(quality, dtype = np.int64) for quality in qualities])
+    positions = np.arange(len(quality_all))-np.repeat(np.cumsum(lengths)-lengths, lengths)
+
+    minimum_quality = quality_all.min()
+    number_qualities = quality_all.max()-minimum_quality+1
+    counts = np.bincount(positions*number_qualities+quality_all-minimum_quality, minlength = lengths.max()*number_qualities).reshape(lengths.max(), number_qualities)
+    reads_position = counts.sum(axis = 1)
+    counts_cumulative = np.cumsum(counts, axis = 1)
+
+    distribution = {"Position":np.arange(1, lengths.max()+1),
+                    "Reads":reads_position,
+                    "Mean":np.bincount(positions, weights = quality_all)/reads_position}
+    for percentile in [10, 25, 50, 75, 90]:
+        # Lowest quality that has at least the percentile of the reads of that position with that quality or lower
+        distribution[f"Percentile {percentile}"] = (counts_cumulative*100 < percentile*reads_position[:, None]).sum(axis = 1)+minimum_quality
+    return pd.DataFrame(distribution)
+
+def choose_trimming_thresholds (qualities, retention, minimum_length = 20):
+    """
+    Function that chooses the quality and length thresholds of the trimming (see trim_reads_quality) so at least a fraction retention of the reads is kept
+
+    The quality thresholds are tried from the highest median quality of all positions down. For each one, the length threshold is the highest length
+    that at least the fraction retention of the trimmed reads have, and the first quality with a length threshold of at least minimum_length is chosen
+
+    It returns the quality and length thresholds and the fraction of the reads kept with them, or None if no quality threshold keeps enough reads
+    """
+    number_reads = len(qualities)
+    if number_reads == 0:
+        return None
+    distribution = quality_per_position(qualities)
+    if len(distribution) == 0:
+        return None
+
+    for threshold in range(int(distribution["Percentile 50"].max()), -1, -1):
+        five_prime_cuts, three_prime_cuts = trim_reads_quality(qualities, threshold, 0)
+        lengths_trimmed = np.sort(np.where(five_prime_cuts >= 0, three_prime_cuts-five_prime_cuts, 0))[::-1]
+        # Length that the best int(retention*number_reads) reads (rounded up) have at least
+        length_threshold = int(lengths_trimmed[max(int(np.ceil(retention*number_reads))-1, 0)])
+        if length_threshold >= minimum_length:
+            five_prime_cuts, _ = trim_reads_quality(qualities, threshold, length_threshold)
+            return threshold, length_threshold, (five_prime_cuts >= 0).sum()/number_reads
+    return None
+
 description_message = """
 \t\t--------------------------------------------------------------------------------------------------------------------------
 \t\t--------------------------------------------------------------------------------------------------------------------------
@@ -36,11 +1588,13 @@ description_message = """
 \t\t - Reads to allign with the genome
 \t\t - Genome sequence in fasta format
 \t\t - Genome annotation in csv format\n
-\t\tThe output of this program will be a directory which will contain max 4 files and 1 directory:
+\t\tThe output of this program will be a directory which will contain max 5 files and 1 directory:
+\t\t - BLAST archive (ASN.1) of the BLASTn search, from which the rest of BLAST outputs are created. It is not kept if the hits of some reads
+\t\t   are taken from a previous run (-inc) or from the hit cache (-hc), because it would not have all the reads
 \t\t - Alignments file that will be the output as tsv (tab separated values) file of a BLASTn allignment
 \t\t - SAM file that BLASTn gives as a possible output
 \t\t - Table with the input reads match with the annotated genes, if possible 
-\t\t - CSV file with a table with a 96-well plate layout and main Locus Tag hit for each position
+\t\t - CSV file with a table with the plate layout (96-well plate by default) and main Locus Tag hit for each position
 \t\t - Directory with the sequences transformed in fastq files
 \t\t--------------------------------------------------------------------------------------------------------------------------
 \t\t--------------------------------------------------------------------------------------------------------------------------"""
@@ -56,7 +1610,7 @@ epilog_message = """
 parser = argparse.ArgumentParser(description = description_message,
                                  epilog = epilog_message,
                                  formatter_class=argparse.RawTextHelpFormatter,
-                                 usage = "%(prog)s [-h] [-q | -v] [-sm] [-out PATH_OUTPUT] [-f {table,all}] [-t THRESHOLD_RANGE] [-identity MAP_PLATE_IDENTITIES] [-cb FILE_NAMES_COLUMNS_BLAST] [-ca FILE_NAMES_COLUMNS_ANNOTATION] [-quality [QUALITY_FILE_EXTENSION] [-seq]] [-seq [TYPE_SEQENCING]] directoryReads extensionReads genomeSequence genomeAnnotation")
+                                 usage = "%(prog)s [-h] [-q | -v] [-sm] [-out PATH_OUTPUT] [-f {table,all}] [-keep] [-t THRESHOLD_RANGE] [-mh MAX_HSPS] [-ov] [-identity MAP_PLATE_IDENTITIES] [-plate {24,48,96,384,1536}] [-numbering {column,row}] [-cb FILE_NAMES_COLUMNS_BLAST] [-archive BLAST_ARCHIVE [BLAST_ARCHIVE ...]] [-engine {blastn,numpy,magicblast}] [-p NUMBER_PROCESSES] [-cache PATH_CACHE | -nc] [-hc] [-warm] [-inc] [-batch MANIFEST_RUNS] [-bw NUMBER_RUNS] [-ca FILE_NAMES_COLUMNS_ANNOTATION] [-quality [QUALITY_FILE_EXTENSION] [-seq]] [-seq [TYPE_SEQENCING]] [-at [RETENTION]] [-atl MINIMUM_LENGTH] directoryReads extensionReads genomeSequence genomeAnnotation")
 
 group = parser.add_mutually_exclusive_group()
 # Positional arguments
@@ -69,6 +1623,7 @@ parser.add_argument("extensionReads",
 Extension that the reads files will have, the vary for one sequence bussiness to others but all of them should be FASTA format type
 In case the reads are not fasta extension, an additional directory will be provided with them in that format
 Make sure that ONLY your reads have that extension in the given directory in the 'directoryReads' argument
+With -engine magicblast the reads can also be FASTQ files (extension fastq or fq) and gzipped files (for example fastq.gz)
                     """)
 parser.add_argument("genomeSequence",
                     help = """
@@ -108,12 +1663,37 @@ Types of files that the program will give as an output:\n
  - table: csv file in which we will have the reads match with the annotated genes within other data of the BLAST allignment
  - all: (default value) both table and sam file will be th eoutput of the BLAST allignment
                     """)
+parser.add_argument("-keep","--keepIntermediates", action = "store_true",
+                    help = """
+Write in the output directory the intermediate files with the reads: all_reads_merged.fasta with all the reads and, with -quality,
+all_reads_merged_quality.fastq, all_reads_merged_trimmed.fasta and the fastq file of each read in reads_fastq (if the quality files are not fastq).
+By default they are not written, the reads are kept in memory and given to BLASTn by its standard input (blastn -query -), which is faster when the
+output directory is in a network drive. all_reads_merged_quality.fastq is always written when the trimming thresholds are chosen with FastQC (without -at)
+                    """)
 parser.add_argument("-t","--thresholdRange", default = 0.01, type = float, metavar = "THRESHOLD_RANGE",
                     help = """
 This range value is the proportion that the score can be lower than the best hit in the allignment that we allow as a "valid" allignment
 This variable affects which reads, inc ase of having multiple allignments or not and the locus that we take as a hit
 This variable is used when multiple allignments are obtained for 1 read input
 By default is %(default) so allignments with the bit score lower than (1-thresholdRange)*Best hit score will be not considered
+The hits out of this range are removed while the BLAST output is read, before joining them with the annotation
+                    """)
+parser.add_argument("-mh","--maxHsps", type = int, metavar = "MAX_HSPS",
+                    help = """
+Maximum number of hits (HSPs) of each read against each sequence of the genome given to BLASTn (-max_hsps), only the hits with the best scores are kept.
+It makes the search and its outputs smaller with repetitive genomes, where a read can have hundreds of hits with similar scores (transposons, rRNA operons).
+The number of hits within the -t range cannot be known before the search, so it is not given by default: with it the hits after the first MAX_HSPS
+of a read are not in the outputs and they are not taken in account for Multiple Allignments and Rest of Locus Tag Associated
+It is only used by BLASTn (-engine blastn) and it is not compatible with -archive
+                    """)
+parser.add_argument("-ov","--overlap", action = "store_true",
+                    help = """
+The loci of each allignment are the ones that overlap any nucleotide of the allignment in the genome (from sstart to send, in both strands),
+instead of only the ones that contain its sstart position, so the allignments that cross the boundaries of the genes or are at the end of a gene
+in the minus strand are also annotated. If there are several, the locus of the allignment is the one with the longest overlap.
+The final table has 3 more columns: Overlap Length (nucleotides of the allignment in its locus), Orientation (sense if the allignment is in the same
+strand as the gene, antisense if not, it needs the column Strand in the annotation file) and Loci Overlapped (all the loci overlapped by the allignment,
+with their overlap and orientation)
                     """)
 parser.add_argument("-identity", metavar = "MAP_PLATE_IDENTITIES",
                     help = """
@@ -121,8 +1701,22 @@ If the reads name has the name of the well between + and _ if it the files exten
 and the well in which the sequencing was you can provide an XLSX or CVS file in which the name of the sequenced sample is in the cell that corresponds to the well
 it has been sequenced from (the identifier between + and _ or _ _).
 Remeber to also put the name of the columns and the rows in the file
-In case the identifiers are numbers, only 96-well plates sequenced plates are allowed counting from 1 to 96 top to bottom and left to right, i.e, the identifier 1 will be A1,
-the identifier 2 will be B1 and the identifier 96 will be H12
+In case the identifiers are numbers, they are counted as set in -plate and -numbering, by default in a 96-well plate from 1 to 96 top to bottom and left to right,
+i.e, the identifier 1 will be A1, the identifier 2 will be B1 and the identifier 96 will be H12
+                    """)
+parser.add_argument("-plate", default = 96, type = int, choices = sorted(plate_formats), metavar = "{24,48,96,384,1536}",
+                    help = """
+Number of wells of the plate in which the reads were sequenced, it is used by -identity and -sm.
+The plates have 4x6 (24), 6x8 (48), 8x12 (96), 16x24 (384) or 32x48 (1536) rows x columns, the rows are named with letters (A-P in the 384-well plates and
+A-Z and AA-AF in the 1536-well plates) and the columns with numbers.
+By default is %(default)s
+                    """)
+parser.add_argument("-numbering", default = "column", choices = ["column", "row"],
+                    help = """
+Order in which the wells are numbered when the identifiers are numbers, it is used by -identity and -sm.
+ - column: top to bottom and left to right, so in a 96-well plate 1 = A1, 2 = B1 and 96 = H12
+ - row: left to right and top to bottom, so in a 96-well plate 1 = A1, 2 = A2 and 96 = H12
+By default is %(default)s
                     """)
 parser.add_argument("-cb","--columnsBLAST", metavar = "FILE_NAMES_COLUMNS_BLAST",
                help = """
@@ -144,10 +1738,10 @@ By default, 8 columns from the annotation file will be provided:
 parser.add_argument("-quality", metavar = "QUALITY_FILE_EXTENSION", choices = ["ab1","fastq","qual"], nargs ='?', const = "abi",
                    help = """
 Trimming of bad quality sequences or ends (3' nad 5') of those sequences.
-Uses the sickle FASTQ trimming program that only admits Sanger, Solexa and Illumina sequencing.
+The trimming is done with a sliding window of the qualities in the same way as the sickle FASTQ trimming program, so it only admits Sanger, Solexa and Illumina sequencing.
 These files will be searched in the same directory as the reads and they have to have the same name as the reads but with different extensions
 This program is only design to trim single-end reads and only fastq, ab1 (abi in the choices) and qual.
-When this argument is provided a file with all the read merged before and after the quality check and correspondent trimming will be created
+When this argument is provided a fastq file with all the read merged before the quality check and a fasta file with the reads after the correspondent trimming will be created
 and the sequence id of each read is going to be the name of the file without the extension.
                     """)
 parser.add_argument("-seq", metavar = "TYPE_SEQENCING", choices = ["solexa","sanger","illumina"], nargs ='?', const = "sanger",
@@ -156,16 +1750,130 @@ Type of sequencing which the single end reads have been obtained
 This program only accepts illumina, sanger y solexa sequencing
 By default the sequencing technique is set as sanger
                     """)
+parser.add_argument("-at","--autoTrim", metavar = "RETENTION", type = float, nargs = "?", const = 0.9,
+                    help = """
+The quality and length thresholds of the trimming are chosen automatically instead of asking for them after the FastQC analysis, which is not done.
+The highest quality threshold for which at least the fraction RETENTION of the reads are kept with a length threshold of -atl or more is chosen, and the
+length threshold is the highest length that keeps that fraction of the reads. If no quality threshold keeps it, Q 20 and length 20 are used and
+they are recorded as fallback (not automatic) in quality_trimming_thresholds.csv, with the fraction of the reads that is really kept.
+The distribution of the qualities in each position of the reads is stored in quality_per_position.csv in the output directory.
+By default, if the argument is given without value, the fraction of the reads kept is %(const)s
+This argument needs -quality
+                    """)
+parser.add_argument("-atl","--autoTrimLength", metavar = "MINIMUM_LENGTH", type = int, default = 100,
+                    help = """
+Minimum length threshold that can be chosen with -at, so the trimmed reads are still long enough to be alligned
+By default is %(default)s
+                    """)
+parser.add_argument("-archive", metavar = "BLAST_ARCHIVE", nargs = "+",
+                    help = """
+BLAST archive (ASN.1 format, BLASTn -outfmt 11) of a previous run of this program, stored as all_seq_aligned.asn in its output directory.
+If that run was done with more than one process, the archives are all_seq_aligned_shard1.asn, all_seq_aligned_shard2.asn, etc and all of them
+should be given in that order.
+If it is provided the BLASTn search is not performed again and the tabular and SAM outputs are created from the archive with blast_formatter,
+for example to obtain another set of columns with the -cb argument.
+The archive has to be from the same reads and genome sequence given in this run. The reads with the same sequence as a read before them
+are not in the archive, their hits are taken from that read
+                    """)
+parser.add_argument("-engine", choices = ["blastn","numpy","magicblast"], default = "blastn",
+                    help = """
+Program that alligns the reads with the genome sequence:
+ - blastn: (default value) BLASTn, the BLAST database of the genome sequence is created with makeblastdb
+ - numpy: allignment done by this program with numpy, it does not need BLAST. The genome sequence is indexed only once (in the cache directory
+   or, with -nc, in the directory genomeSequence.index next to the genome sequence) and the index is memory-mapped in the next runs.
+   The k-mers of the reads are searched in the index and the regions with exact matches of 28 or more bases are alligned with the scores of megablast
+   (the task of BLASTn by default) in both strands. It is meant for Sanger reads against bacterial genomes and the outputs have the same format
+   as the ones of BLASTn, but the E-values and bit scores are computed without the corrections of BLAST, so they can be a bit different.
+   The -cb columns can only be %(columns)s.
+   No BLAST archive is created, so this value is not compatible with -archive
+ - magicblast: Magic-BLAST, a mapper of short reads (Illumina) that uses the same BLAST database as BLASTn. The reads files (fasta or fastq, gzipped or not)
+   are given directly to magicblast, without the merged file of the reads, and it maps them with -p threads.
+   The reads without hits are not reported and the reads are not spliced. The reads are mapped only once, its SAM output (all_seq_aligned.sam with -f sam or all)
+   is converted to the -cb columns, that can only be %(columns_magicblast)s. The E-value and the bit score are computed from the score of magicblast (reward 1 and penalty -4).
+   The speed of the mapping is printed at the end in reads given to magicblast per second. The target is that this program is never what limits it: the gzipped fastq files
+   are given to magicblast at about 5*10^5 reads (150 bases) per second and its output is converted at more than 10^5 hits per second
+   (1 core, 10^6 reads), so the speed is the one of magicblast, that grows with the number of threads (-p).
+   It is not compatible with -quality, -archive and -inc
+                    """ % {"columns":", ".join(numpy_engine_columns), "columns_magicblast":", ".join(magicblast_columns)})
+parser.add_argument("-p", "--processes", default = 1, type = int, metavar = "NUMBER_PROCESSES",
+                    help = """
+Number of BLASTn processes that will be run at the same time.
+If it is more than 1 the reads are split in that number of files with a similar size, each one is searched against the genome
+with its own BLASTn and the results are joined in the same order of the reads, so the output is the same as with 1 process.
+This is also the number of processes that read the quality files when -quality is given and, with -engine numpy, the number of processes that allign the reads.
+With -engine magicblast it is the number of threads of magicblast.
+If it is 0 all the cores of the computer will be used
+By default is %(default)s
+                    """)
+parser.add_argument("-cache", default = os.path.join(os.path.expanduser("~"), ".cache", "LAPu-InsertsGenAnnotation"), metavar = "PATH_CACHE",
+                    help = """
+Directory where data that can be used again in other runs is stored: the BLAST database of the genome sequence, the genome annotation file already processed
+and, with -hc, the BLAST hits of each read sequence (blast_hits.sqlite).
+The data is stored with the hash of the content of the input file, so if the file changes it is processed again.
+The hits are stored with the hash of the sequence of the read, the genome sequence, the BLAST version and options and the columns of the output, so the reads
+with a sequence already alligned in any run (for example controls or repeated strains) are not alligned again if all of that is the same.
+The hits are not stored if several reads have the same name or the columns have qseqid, qgi or qacc.
+It can be a directory shared by several users of the same computer
+The cache is used by default, so the program writes in this directory, outside the output directory, unless -nc is given
+By default is %(default)s
+                    """)
+parser.add_argument("-nc","--noCache", action = "store_true",
+                    help = """
+If this argument is given, the cache directory (-cache argument) is not used nor created, all the reads are alligned
+and the BLAST database is created, if it does not exist, in the same directory as the genomeSequence
+                    """)
+parser.add_argument("-hc","--hitCache", action = "store_true",
+                    help = """
+Use the hits of the reads stored in the cache directory (hit cache, see -cache) and store there the hits of the reads alligned in this run.
+The reads whose hits are taken from the hit cache are not alligned, so the BLAST archive all_seq_aligned.asn is not kept (it would not have all the reads)
+and it cannot be used with -archive to create the outputs with other columns. Without this argument all the reads are alligned and the archive is kept.
+This argument is not compatible with -nc and -archive
+                    """)
+parser.add_argument("-warm","--warmCache", action = "store_true",
+                    help = """
+Only create, if they are not already there, the BLAST database of genomeSequence (or its index with -engine numpy) and the processed genomeAnnotation
+in the cache directory and exit.
+The reads are not used in this case, so directoryReads and extensionReads can be any value.
+This argument is not compatible with -nc
+                    """)
+parser.add_argument("-inc","--incremental", action = "store_true",
+                    help = """
+The content of each read (after the trimming, if -quality is given) and the number of hits it had are stored in reads_manifest.json in the output directory.
+If the output directory already has that file, it is updated instead of overwritten and only the reads that are new or have changed since that run are alligned
+with BLASTn, the hits of the rest of the reads are taken from the all_seq_aligned.tsv and all_seq_aligned.sam files of the output directory.
+All the reads are joined again with the annotation, so the final files are the same as doing the whole run again.
+If the genomeSequence, the BLAST columns or the -f argument are not the same as in that run, all the reads are alligned.
+When only part of the reads are alligned the BLAST archive is removed, because it would not have all the reads.
+This argument is not compatible with -archive
+                    """)
+parser.add_argument("-batch", metavar = "MANIFEST_RUNS",
+                    help = """
+CSV file with several runs that are annotated with the same genomeSequence, genomeAnnotation and the rest of the arguments given.
+The file needs the columns directoryReads and out (the directory of the reads and the output directory of each run) and it can have the column identity
+(the map of identities of each run, if it is empty or the column is not there the one given with -identity is used).
+The BLAST database and the annotation are loaded only once and each run is done with the same steps as running it alone,
+so the output of each run is the same. What the program shows of each run is stored in a file with the name of its output directory and the extension log.
+The output directories cannot exist and, if -quality is given, -at is needed, because nobody is going to answer the questions of the runs.
+The positional argument directoryReads is not used in this case, so it can be any value.
+This argument is not compatible with -nc, -warm and -archive
+                    """)
+parser.add_argument("-bw","--batchWorkers", default = 1, type = int, metavar = "NUMBER_RUNS",
+                    help = """
+Number of runs of -batch that are done at the same time, each one of them uses -p processes for BLASTn.
+The runs are done at the same time by a pool of processes created with fork, where fork is not available (Windows) they are done one after the other.
+If it is 0 all the cores of the computer will be used
+By default is %(default)s
+                    """)
 parser.add_argument("-sm","--summaryMap", action = "store_true",
                     help = """
 A map displaying the main locus tag of the best hit identified by BLAST will be created. If a sequence has multiple hits, only the best hit will be shown.
 Read/sequence names must follow specific formats based on the sequence type:
  - seq sequences: the well name or index should be between a plus sign (+) and an underscore (_). For example, read+A1_sequence or read+1_sequence indicates well A1.
  - other sequence: the well name should be between two underscores (_). For example, read_A1_sequence or read_1_sequence indicates well A1.
-If numeric identifiers are used instead of well names, numbers 1 to 96 correspond to wells in a 96-well plate, ordered top to bottom and left to right
-(e.g., 1 = A1, 2 = B1, 96 = H12). This expression will be looked for in the sequence ID of the read, not the file name. If the -quality argument is provided,
-the sequence ID will match the file name.
-This program supports reads from a 96-well plate, with columns numbered 1 to 12 and rows lettered A to H.
+If numeric identifiers are used instead of well names, numbers correspond to wells of the plate set in -plate, ordered as set in -numbering
+(by default in a 96-well plate top to bottom and left to right, e.g., 1 = A1, 2 = B1, 96 = H12). This expression will be looked for in the sequence ID of the read, not the file name.
+If the -quality argument is provided, the sequence ID will match the file name.
+The map has the layout of the plate set in -plate, by default a 96-well plate, with columns numbered 1 to 12 and rows lettered A to H.
 The final summary, including locus tag and well information, will be saved in the output directory specified by the -out argument.
                     """)
 
@@ -175,6 +1883,13 @@ args = parser.parse_args()
 # The quality argument and the seq one are one side by side, so if one is None it would come as an error
 if args.quality and not args.seq:
     parser.error("The following arguments are required if you want to use the quality files of the sequences: seq")
+if args.autoTrim != None:
+    if not args.quality:
+        parser.error("The following arguments are required if you want to choose automatically the trimming thresholds: quality")
+    if not 0 < args.autoTrim <= 1:
+        parser.error("argument -at/--autoTrim: the fraction of reads kept needs to be higher than 0 and lower or equal to 1")
+    if args.autoTrimLength < 1:
+        parser.error("argument -atl/--autoTrimLength: the minimum length needs to be 1 or higher")
 
 directory_files = args.directoryReads
 type_files = args.extensionReads
@@ -186,7 +1901,7 @@ final_directory = args.out
 # If something doesn't exist in the path given it will quit the program exactly
 # This is done previously to anything to check if every essencial part is there
 
-if not os.path.isdir(args.directoryReads):
+if not args.warmCache and not args.batch and not os.path.isdir(args.directoryReads):
     print(f"""------------------------------------------------------------------------------------------------------------------------------\n
  The directory {args.directoryReads} does not exist and it is neccessary for the program!
  Exiting program\n
@@ -207,163 +1922,88 @@ if not os.path.isfile(args.genomeAnnotation):
 ------------------------------------------------------------------------------------------------------------------------------""")
     raise SystemExit(0)
 
+if args.processes < 0:
+    print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The number of processes {args.processes} cannot be negative, 0 is to use all the cores of the computer
+ Exiting program\n
+------------------------------------------------------------------------------------------------------------------------------""")
+    raise SystemExit(0)
 
-#-----------------------------------
-# General input data 
-if args.verbose:
-    message = f"""
-------------------------------------------------------------------------------------------------------------------------------\n
-    GENERAL INFORMATION RUNNING PROGRAM\n
-        Reads file directory {args.directoryReads} with the {type_files} extension
-        The genome sequence and gene annotation will be extracted from {args.genomeSequence} and {args.genomeAnnotation}
-        The alignments final table will only consider hits that have {1-args.thresholdRange}*best hit score for each read
-        Output files will be stored at {args.out}
-        
-------------------------------------------------------------------------------------------------------------------------------
-    """
-    print(message)
-
-
-# Checking if the output directory is there so we do not overwrite a directory with the same name
-# Output folder is name results_script_blast
-if os.path.isdir(args.out):
-    txt = input("------------------------------------------------------------------------------------------------------------------------------\n\n The directory '"+args.out+"' is going to be overwrited, are you sure? [y/n]:  ")
-    if txt == "y":
-        os.system("rm -r "+args.out)
-        os.system("mkdir -p "+args.out)
-        # print("------------------------------------------------------------------------------------------------------------------------------")
-    elif txt == "n":
-        print("""\n------------------------------------------------------------------------------------------------------------------------------
- 
- Bye!
-
-------------------------------------------------------------------------------------------------------------------------------""")
-        quit() #We exit from the program in general
-    else:
-        print("""------------------------------------------------------------------------------------------------------------------------------
- Assumed NO, Exiting program
+if args.maxHsps != None:
+    if args.maxHsps < 1:
+        parser.error("argument -mh/--maxHsps: the maximum number of hits needs to be 1 or higher")
+    if args.engine != "blastn" or args.archive:
+        parser.error("argument -mh/--maxHsps: only allowed with -engine blastn and not allowed with argument -archive")
+if args.hitCache and (args.noCache or args.archive):
+    parser.error("argument -hc/--hitCache: not allowed with arguments -nc/--noCache or -archive")
+if args.archive and args.engine == "numpy":
+    parser.error("argument -engine: the value numpy is not allowed with argument -archive")
+if args.engine == "magicblast":
+    for argument_name, argument_value in [("-quality", args.quality), ("-archive", args.archive), ("-inc", args.incremental)]:
+        if argument_value:
+            parser.error(f"argument -engine: the value magicblast is not allowed with argument {argument_name}")
+for file_archive in (args.archive or []):
+    if not os.path.isfile(file_archive):
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The file {file_archive} does not exist or it is not found and it is neccessary for the -archive argument!
+ Exiting program\n
 ------------------------------------------------------------------------------------------------------------------------------""")
-        quit() #We exit from the program in general
-else:
-    os.system("mkdir "+args.out) #Directory in which we are going to store the results
+        raise SystemExit(0)
 
+    # The output directory can be overwritten, so the archive cannot be in it
+    if os.path.commonpath([os.path.abspath(file_archive), os.path.abspath(args.out)]) == os.path.abspath(args.out):
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The file {file_archive} is inside the output directory {args.out}, choose another output directory with the -out argument
+ Exiting program\n
+------------------------------------------------------------------------------------------------------------------------------""")
+        raise SystemExit(0)
 
-#-------------------------------------------
-# In this section we are going to create the merged fasta file
-
-# Lets set some variables that we need in case the quality is true
-if args.quality == "qual":
-    bioseq_file = "qual"
-elif args.quality == "fastq":
-    if args.seq == "solexa":
-        bioseq_file = "fastq-solexa"
-    elif args.seq == "sanger":
-        bioseq_file = "fastq"
-    elif args.seq == "illumina":
-        bioseq_file = "fastq-illumina"
-elif args.quality == "ab1":
-    bioseq_file = "abi"
-
-# Create the output file with the original fasta files
-outfile = open(os.path.join(args.out,"all_reads_merged.fasta"), "w") # The directory where we will store the results
-
-if args.quality: # Create the merged fastq file for its process in FastQC
-    outfile_quality = open(os.path.join(args.out,"all_reads_merged_quality.fastq"), "w")
-    if args.quality != "fastq": # If the quality is not fastq the fastq files will be created and could be used in posterior runs
-        os.mkdir(os.path.join(args.out,"reads_fastq"))
+#-------
+# The columns of the annotation are needed before loading it, only them are loaded and stored in the cache
+locus_tag, start, end = [True, True, True]
+if not args.columnsAnnotation:
+    columns_ann = ["Locus Tag","Feature Type","Start","End","Strand","Gene Name","Product Name","Subcellular Localization [Confidence Class]"]
+else:
+    # First we check that the file exists
+    if not os.path.isfile(args.columnsAnnotation):
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The file {args.columnsAnnotation} does not exist or it is not found and it is neccessary for the custom annotation .csv file columns in the final table
+ Exiting program\n
+    ------------------------------------------------------------------------------------------------------------------------------""")
+        raise SystemExit(0)
     
-for file in os.listdir(args.directoryReads): # We search throught the directory of reads
-    file_name, file_extension = os.path.splitext(file)
-    if file_extension[1:] == args.extensionReads: # We only take the files that are the reads becaus ethe directory could have more types of files
-        with open(os.path.join(args.directoryReads,file), "r") as infile: # This is going to create a file with all the reads together
-            outfile.write(infile.read().strip())
-            outfile.write("\n")
-            infile.close()
-        
-        if args.quality: # If we have the quality option as true
-            # We read the file
-            seq_quality = SeqIO.read(os.path.join(args.directoryReads, file_name+"."+args.quality), bioseq_file)
-            # In case that the sequence id does not correspond to the file name, this will change it
-            seq_quality.id = file_name
-            # If it is not a fastq file, we will create one and store it in reads_fastq
-            if args.quality != "fastq": # Esto ya estaba, simplemnet esto es que si no es fastqc simplemente se genera un fastqc en el que el id va a ser el nombre del archivo, no el ID que tiene en el read de secuenciacion
-                SeqIO.write(seq_quality, os.path.join(args.out,"reads_fastq",file_name+".fastq"), "fastq")
-
-            # We write the sequence in the merge file that will be use to analyze the quality
-            SeqIO.write(seq_quality, outfile_quality, "fastq")
-
-# Close files
-outfile.close()
-if args.quality:
-    outfile_quality.close()
-
-
-try: #We check if the database already exists, it works not only with the name of the db but also with the path to it
-    subprocess.check_call(["blastdbcmd", "-info", "-db", database], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
-    # check_call makes the expression in the list and checks if there is a exit code 0 (success) or other (error)
-    # stdout and stderr are th eoutput and error message to a file that is temporal and not stored
-    # If it is a success it means that the indexed genome works
-    if args.verbose:
-        print(f"""\n------------------------------------------------------------------------------------------------------------------------------\n
- Database {args.genomeSequence} already exists!
- Info of the DB:""")
-        os.system("blastdbcmd -info -db "+database)
-        print("""\n------------------------------------------------------------------------------------------------------------------------------""")
-    elif not args.quiet and not args.verbose:
-        print("""\n------------------------------------------------------------------------------------------------------------------------------
- 
- Database already exists!
- Procceding to do BLAST
- 
-------------------------------------------------------------------------------------------------------------------------------\n""")
-    # Gives the info for the database
-except:
-    if args.quiet:
-    # Create the index so blastn can do the alignment
-        os.system('makeblastdb -in '+database+' -dbtype nucl > /dev/null')
-    # In case that check_all gives and error it creates the dabatase from the file given
-    elif args.verbose:
-        print(f"------------------------------------------------------------------------------------------------------------------------------\n\n Creating Database with the program 'makeblastdb' for {database}")
-        os.system('makeblastdb -in '+database+' -dbtype nucl')
-        print("""------------------------------------------------------------------------------------------------------------------------------\n""")
-    elif not args.quiet and not args.verbose:
-        print(f"""\n------------------------------------------------------------------------------------------------------------------------------
- 
- Creating Database with the program 'makeblastdb' for {database}
- 
-------------------------------------------------------------------------------------------------------------------------------\n""")
-        os.system('makeblastdb -in '+database+' -dbtype nucl > /dev/null')
-        
-#-------------------------------------------
-#-------------------------------------------
-# In the case that we want to perform a quality check we will perform the following lines
-if args.quality:
-    # We do the fastqc analysis that will generate the analysis in a zip file and also html files
-    os.system(f"fastqc {os.path.join(args.out,'all_reads_merged_quality.fastq')}")
+    # Import the file
+    columns_raw_ann = open(args.columnsAnnotation).read().splitlines()
     
-    # Now we ask the user what threshold wants
-    print("------------------------------------------------------------------------------------------------------------------------------\nChech the FastQC file and decide the threshold for trimming!")
-    threshold = input("Enter the Q value for trimming (by default 20): ")
-    length_threshold = input("Enter the length (by default 20): ")
+    columns_ann = columns_raw_ann
+
+    if "Locus Tag" not in columns_raw_ann:
+        columns_ann.append("Locus Tag")
+        locus_tag = False
     
-    if threshold == '':
-        threshold = 20
-    if length_threshold == '':
-        length_threshold = 20
+    if "Start" not in columns_raw_ann:
+        columns_ann.append("Start")
+        start = False
     
-    # Now we trim with sickle
-    if args.quiet:
-        os.system(f"sickle se -f {os.path.join(args.out,'all_reads_merged_quality.fastq')} -t {args.seq} -o {os.path.join(args.out,'all_reads_merged_quality_trimmed.fastq')} -q {threshold} -l {length_threshold} --quiet")
+    if "End" not in columns_raw_ann:
+        columns_ann.append("End")
+        end = False
+
+# In case we only want to prepare the cache for other runs
+if args.warmCache:
+    if args.noCache:
+        parser.error("argument -warm/--warmCache: not allowed with argument -nc/--noCache")
+    if args.engine == "numpy":
+        database, database_created = genome_index(args.genomeSequence, os.path.join(args.cache, "genome_index", hash_file(args.genomeSequence)), numpy_engine_parameters["kmer"])
     else:
-        os.system(f"sickle se -f {os.path.join(args.out,'all_reads_merged_quality.fastq')} -t {args.seq} -o {os.path.join(args.out,'all_reads_merged_quality_trimmed.fastq')} -q {threshold} -l {length_threshold}")
-    
-    print("------------------------------------------------------------------------------------------------------------------------------\n")
-    
-    # Now we have to change that fastq trimmed to fasta reads so we can perform the allign
-    with open(os.path.join(args.out,'all_reads_merged_trimmed.fasta'), 'w') as ofile:
-        for record in SeqIO.parse(os.path.join(args.out,'all_reads_merged_quality_trimmed.fastq'), "fastq"):
-            sequence = str(record.seq)
-            ofile.write('>'+record.id+'\n'+sequence+'\n')
+        database, database_created = cached_blast_database(args.genomeSequence, args.cache, verbose = args.verbose)
+    load_annotation(file_annotation, columns_ann+["Strand"], args.cache)
+    if not args.quiet:
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ {'Index for the numpy allignment engine' if args.engine == 'numpy' else 'BLAST database'} of {args.genomeSequence} and annotation {args.genomeAnnotation} stored in the cache {args.cache}
+ Database: {database}\n
+------------------------------------------------------------------------------------------------------------------------------""")
+    raise SystemExit(0)
 
 #-------------------------------------------
 #-------------------------------------------
@@ -372,7 +2012,13 @@ if args.quality:
 
 possible_blast_columns = ["qseqid","qgi","qacc","qaccver","qlen","sseqid","sallseqid","sgi","sallgi","sacc","saccver","sallacc","slen","qstart","qend","sstart","send","qseq","sseq","evalue","bitscore","score","length","pident","nident","mismatch","positive","gapopen","gaps","ppos","frames",
                           "qframe","sframe","btop","staxid","ssciname","scomname","sblastname","sskingdom","staxids","sscinames","scomnames","sblastnames","sskingdoms","stitle","salltitles","sstrand","qcovs","qcovhsp","qcovus"]
-table_ann = pd.read_csv(file_annotation)
+# The annotation is loaded from the cache if it has already been processed in other run
+# It is loaded and the columns are checked before the runs of -batch are started, so a wrong column stops the program and not each one of its runs
+# The strand of the genes is only needed for the orientation of the hits (-ov)
+if args.noCache:
+    table_ann, annotation_index = load_annotation(file_annotation, columns_ann+["Strand"])
+else:
+    table_ann, annotation_index = load_annotation(file_annotation, columns_ann+["Strand"], args.cache)
 
 # Before doing the check of the columns in the annotation lets check that the columns Locus Tag, End and Start are in the annotation file
 if any(item_ann not in list(table_ann.columns) for item_ann in ["Start","End", "Locus Tag"]):
@@ -380,7 +2026,12 @@ if any(item_ann not in list(table_ann.columns) for item_ann in ["Start","End", "
           \nThe annotation file needs to have the columns Locus Tag, End and Start to run the program\nExiting program\n""")
     raise SystemExit(0)
 
-qacc, bitscore, sstart = [True, True, True]
+# Check that all columns of the annotation are in the file
+if args.columnsAnnotation and all(item in table_ann.columns for item in columns_ann) == False:
+    print("\nSome column or columns are not in the annotation file of the genome\nExiting program\n")
+    raise SystemExit(0)
+
+qacc, bitscore, sstart, send = [True, True, True, True]
 if not args.columnsBLAST:
     columns_seq_alig = ["qaccver", "saccver", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "sstrand"]
         
@@ -415,215 +2066,636 @@ else:
     if "sstart" not in columns_raw:
         columns_seq_alig.append("sstart")
         sstart = False
+
+    if "send" not in columns_raw and args.overlap:
+        columns_seq_alig.append("send")
+        send = False
     
 # Now we create the header of the output of BLAST and the needed addition to the BLAST command
 header_output_blast = "\t".join(columns_seq_alig)
-    
 
-#-------
-locus_tag, start, end = [True, True, True]
-if not args.columnsAnnotation:
-    columns_ann = ["Locus Tag","Feature Type","Start","End","Strand","Gene Name","Product Name","Subcellular Localization [Confidence Class]"]
-else:
-    # First we check that the file exists
-    if not os.path.isfile(args.columnsAnnotation):
-        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
- The file {args.columnsAnnotation} does not exist or it is not found and it is neccessary for the custom annotation .csv file columns in the final table
+# The numpy allignment engine and magicblast only give some of the columns of BLAST
+engine_columns = {"numpy":numpy_engine_columns, "magicblast":magicblast_columns}.get(args.engine, possible_blast_columns)
+if any(column not in engine_columns for column in columns_seq_alig):
+    print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The column(s) {', '.join(column for column in columns_seq_alig if column not in engine_columns)} cannot be obtained with -engine {args.engine}
+ The columns that can be used with it are {', '.join(engine_columns)}
  Exiting program\n
-    ------------------------------------------------------------------------------------------------------------------------------""")
-        raise SystemExit(0)
-    
-    # Import the file
-    columns_raw_ann = open(args.columnsAnnotation).read().splitlines()
-    
-    columns_ann = columns_raw_ann
-    # Check that all columns of the annotation are in the file
-    if all(item in table_ann.columns for item in columns_raw_ann) == False:
-        print("\nSome column or columns are not in the annotation file of the genome\nExiting program\n")
-        raise SystemExit(0)
-
-    if "Locus Tag" not in columns_raw_ann:
-        columns_ann.append("Locus Tag")
-        locus_tag = False
-    
-    if "Start" not in columns_raw_ann:
-        columns_ann.append("Start")
-        start = False
+------------------------------------------------------------------------------------------------------------------------------""")
+    raise SystemExit(0)
     
-    if "End" not in columns_raw_ann:
-        columns_ann.append("End")
-        end = False
-
-
-range_value = args.thresholdRange # This is a variable we can set to identify significant alignments, score has been assesed according to our experimental results
-# This range value is the proportion that the score can be lower than the best hit in the allignment that we allow as a "valid" allignment
-# This variable affects which reads have multiple allignments or not and the locus that we take as a hit
 
-    
-# Perform BLASTn
-if args.verbose:
-    print(" BLAST command (s) that are going to be performed:")
-    
-if args.quality:
-    reads_file = os.path.join(args.out,"all_reads_merged_trimmed.fasta")
-else:
-    reads_file = os.path.join(args.out,"all_reads_merged.fasta")
-command_blastn_tabular_output = f"blastn -query {reads_file} -db {args.genomeSequence} -out {os.path.join(args.out, 'all_seq_aligned.tsv')} -outfmt '6 {' '.join(columns_seq_alig)}'"
-if args.filesOut == "sam" or args.filesOut == "all":
-    command_blastn_SAM_output = f"blastn -query {reads_file} -db {args.genomeSequence} -out {os.path.join(args.out, 'all_seq_aligned.sam')} -outfmt '17 {' '.join(columns_seq_alig)}'"
-    os.system(command_blastn_SAM_output)
-    if args.verbose:
-        print(f"""\t- SAM output command
-\t\t{command_blastn_SAM_output}""")
-if args.verbose:
-    print(f"""\t- Tabular output command
-\t\t{command_blastn_tabular_output}
-\n Final Headers that we are going to obtain in the tabular output:
-\t{header_output_blast}\n""")
-    
-# It is possible to adjust with other arguments these expressions (check blastn manual)
-# The way of changing the output is -outfmt "6 std" for the standard output, other example  -outfmt "6 std staxid" this will give us the standard output and the tax id of the subject
-# It will give the output in the order of naming but without repetitions (if we put std score it will only print std)
 
-if not args.verbose and not args.quiet:
-    print(f" Making BLAST between {args.directoryReads} and {args.genomeSequence}\n")
-os.system(command_blastn_tabular_output)
-# os.system("rm all_reads_merged.fna") #We remove the file all_reads_merged but we can keep it deleting this command (or commenting)
 
+#-----------------------------------
+# Annotation of a run
+# Everything from here is done once for each run: the arguments and the checks of the program, the columns and the annotation are the same for all of them
+def annotate_run (args, annotation, database_batch = None):
+    """
+    Function that alligns the reads of args.directoryReads against the genome sequence and annotates the hits, writing the outputs in args.out
 
-# ----------------------------------
-if not args.quiet and not args.verbose:
-        print("""------------------------------------------------------------------------------------------------------------------------------
+    annotation is the table of the annotation and its index (see load_annotation), loaded and checked only once for all the runs
+    database_batch is the BLAST database (or the index of the numpy engine) of the genome sequence if it has already been created for all the
+    runs of -batch, if it is None it is created or taken from the cache in this run
+    """
+    directory_files = args.directoryReads
+    type_files = args.extensionReads
+    database = args.genomeSequence
+    final_directory = args.out
+    table_ann, annotation_index = annotation
 
- Creating reads alignment - gene annotation Table
+    # General input data 
+    if args.verbose:
+        message = f"""
+------------------------------------------------------------------------------------------------------------------------------\n
+    GENERAL INFORMATION RUNNING PROGRAM\n
+        Reads file directory {args.directoryReads} with the {type_files} extension
+        The genome sequence and gene annotation will be extracted from {args.genomeSequence} and {args.genomeAnnotation}
+        The alignments final table will only consider hits that have {1-args.thresholdRange}*best hit score for each read
+        Output files will be stored at {args.out}
+        
+------------------------------------------------------------------------------------------------------------------------------
+    """
+        print(message)
+
+
+    # In incremental mode an output directory of a previous run is updated, its manifest is removed until this run finishes
+    # so if this run is stopped the next one does not take the reads as already alligned
+    manifest_previous = None
+    if args.archive and args.incremental:
+        parser.error("argument -inc/--incremental: not allowed with argument -archive")
+    if args.incremental and os.path.isfile(os.path.join(args.out, "reads_manifest.json")):
+        with open(os.path.join(args.out, "reads_manifest.json"), "r") as infile:
+            manifest_previous = json.load(infile)
+        os.remove(os.path.join(args.out, "reads_manifest.json"))
+        if not args.quiet:
+            print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ The output directory {args.out} of a previous run is going to be updated
+\n------------------------------------------------------------------------------------------------------------------------------""")
+
+    # Checking if the output directory is there so we do not overwrite a directory with the same name
+    # Output folder is name results_script_blast
+    if manifest_previous != None:
+        pass
+    elif os.path.isdir(args.out):
+        txt = input("------------------------------------------------------------------------------------------------------------------------------\n\n The directory '"+args.out+"' is going to be overwrited, are you sure? [y/n]:  ")
+        if txt == "y":
+            os.system("rm -r "+args.out)
+            os.system("mkdir -p "+args.out)
+            # print("------------------------------------------------------------------------------------------------------------------------------")
+        elif txt == "n":
+            print("""\n------------------------------------------------------------------------------------------------------------------------------
  
-------------------------------------------------------------------------------------------------------------------------------\n""")
-# Formatting of blastn output file 
-command_add_header_txt = "echo '"+header_output_blast+"' | cat - "+final_directory+"/all_seq_aligned.tsv > temp && mv temp "+final_directory+"/all_seq_aligned.tsv"
-os.system(command_add_header_txt)
-
-# Add the header expression to the output of blastn
-
-#state the files of blast, genome annotation file and the final table
-file_magicblast = final_directory+"/all_seq_aligned.tsv"
-final_table_name = final_directory+"/table_reads_genes_description.csv"
-
-# Store the name of the summaryMpa in case that the user has asked for it
-if args.summaryMap:
-    file_map_summary_name = final_directory+"/summary_locus_grid_map.csv"
-
-# Load tables as pandas dataframes
-# table_ann has already been loaded
-table_seq = pd.read_table(file_magicblast,sep="\t") 
-
-# We create a column called key to be able to do a cross table (all possible combinations) with both tables
-table_seq['key'] = 1
-table_ann['key'] = 1
-
-# Create a cross join table from sequences alignment and annotation to select rows with matches
-table_cross = pd.merge(table_seq, table_ann, on ='key').drop("key", axis=1) # After doing this cross table we delete the column key
-
-# Filter rows by only taking the rows that the subject (reference genome in this case) starting position is between the annotated genes
-# this filtering is needed because there are lines in the table that the subject positions does not correspond to the annotated genes positions
-table_matches = table_cross[(table_cross["sstart"] >= table_cross["Start"]) & (table_cross["End"] >= table_cross["sstart"])]
-
-# Filter columns saving only the ones that have been selected previously in columns_seq_alig and columns_ann 
-table_matches = table_matches[columns_seq_alig + columns_ann]
-
+ Bye!
 
-# Create a table with allignments that have not been matched with any annoted genes
-table_not_matches = table_seq[~table_seq["qaccver"].isin(table_matches["qaccver"])][columns_seq_alig]
+------------------------------------------------------------------------------------------------------------------------------""")
+            quit() #We exit from the program in general
+        else:
+            print("""------------------------------------------------------------------------------------------------------------------------------
+ Assumed NO, Exiting program
+------------------------------------------------------------------------------------------------------------------------------""")
+            quit() #We exit from the program in general
+    else:
+        os.system("mkdir "+args.out) #Directory in which we are going to store the results
 
-# Create the final table that is the alignments matched with genes with the ones not matched with any annotated gene
-final_table = pd.concat([table_matches, table_not_matches], sort = False)
 
-#------------------------------------------------------------
+    #-------------------------------------------
+    # In this section we are going to create the merged fasta file
 
-# We remove the allignments that are not within the threshold that we put so we discard these alignments according to the variable range_value
-# We are adding a column with the score of the best hit of that read and then we delete the ones that are lower than score*threshold
-final_table["Highest bit score"] = final_table.groupby('qaccver', sort=False)['bitscore'].transform('max')
-final_table.drop(final_table[final_table["bitscore"] < final_table["Highest bit score"]*(1-range_value)].index, inplace=True)
+    if args.processes == 0:
+        number_processes = os.cpu_count()
+    else:
+        number_processes = args.processes
+
+    # Lets set some variables that we need in case the quality is true
+    if args.quality == "qual":
+        bioseq_file = "qual"
+    elif args.quality == "fastq":
+        if args.seq == "solexa":
+            bioseq_file = "fastq-solexa"
+        elif args.seq == "sanger":
+            bioseq_file = "fastq"
+        elif args.seq == "illumina":
+            bioseq_file = "fastq-illumina"
+    elif args.quality == "ab1":
+        bioseq_file = "abi"
+
+    # The directory of the reads is indexed only once, the reads and their quality files are taken from that index
+    files_reads, index_files = index_directory_reads(args.directoryReads, args.extensionReads)
+
+    # All the reads are merged in memory, they are only written in the output directory with -keep
+    # With -engine magicblast the reads files are given directly to magicblast, so they are not merged
+    reads_merged = []
+
+    if args.quality: # Create the merged fastq file for its process in FastQC, it is only needed when FastQC is run (without -at)
+        outfile_quality = open(os.path.join(args.out,"all_reads_merged_quality.fastq") if args.keepIntermediates or args.autoTrim == None else os.devnull, "w", buffering = 1024*1024)
+        # The names, sequences and qualities of the reads are kept to trim them without reading the fastq file again
+        reads_quality_names = []
+        reads_quality_sequences = []
+        reads_quality_scores = []
+        if args.quality != "fastq" and args.keepIntermediates: # If the quality is not fastq the fastq files will be created and could be used in posterior runs
+            os.makedirs(os.path.join(args.out,"reads_fastq"), exist_ok = True)
+        arguments_quality = []
+
+    # This is going to create a file with all the reads together, only the files that are the reads are taken becaus ethe directory could have more types of files
+    for _, file_read in (files_reads if args.engine != "magicblast" else []):
+        with open(file_read, "r") as infile:
+            reads_merged.append(infile.read().strip()+"\n")
+    reads_merged = "".join(reads_merged)
+    if args.keepIntermediates and args.engine != "magicblast":
+        with open(os.path.join(args.out,"all_reads_merged.fasta"), "w") as outfile:
+            outfile.write(reads_merged)
+
+    if args.quality: # If we have the quality option as true
+        for file_name, _ in files_reads:
+            if args.quality not in index_files[file_name]:
+                raise Exception(f"File {file_name}.{args.quality} with the qualities of the read {file_name} not found in {args.directoryReads}")
+            # If it is not a fastq file, we will create one and store it in reads_fastq
+            if args.quality != "fastq" and args.keepIntermediates: # Esto ya estaba, simplemnet esto es que si no es fastqc simplemente se genera un fastqc en el que el id va a ser el nombre del archivo, no el ID que tiene en el read de secuenciacion
+                file_fastq = os.path.join(args.out,"reads_fastq",file_name+".fastq")
+            else:
+                file_fastq = None
+            arguments_quality.append((index_files[file_name][args.quality], bioseq_file, file_name, file_fastq))
 
-# Now we can erase this column because it has already served its purpose
-del final_table["Highest bit score"]
+    if args.quality: # The quality files are read by several processes at the same time, the reads come back in the same order as the files
+        # The fastq text of each read is written when it arrives, but the sequences and qualities of all the reads are kept
+        # because the trimming thresholds (chosen automatically or by the user after FastQC) depend on all of them
+        for name_read, sequence, qualities, text_fastq in read_quality_files(arguments_quality, number_processes):
+            # We write the sequence in the merge file that will be use to analyze the quality
+            outfile_quality.write(text_fastq)
+
+            reads_quality_names.append(name_read)
+            reads_quality_sequences.append(sequence)
+            reads_quality_scores.append(qualities)
+
+    # Close files
+    if args.quality:
+        outfile_quality.close()
+
+    # If the cache is used, the database is created in the cache directory (only the first time for each genome sequence) instead of next to the genome sequence
+    # so a genome sequence that changes never uses an old database and the directory of the genome sequence can be read-only
+    # With -engine numpy there is no BLAST database, the genome sequence is indexed by this program only the first time, in the cache directory
+    # or next to the genome sequence, and the index is memory-mapped in the next runs
+    if args.engine == "numpy":
+        if database_batch != None: # The index has already been created for all the runs of -batch
+            database, database_created = database_batch, False
+        elif not args.noCache:
+            database, database_created = genome_index(args.genomeSequence, os.path.join(args.cache, "genome_index", hash_file(args.genomeSequence)), numpy_engine_parameters["kmer"])
+        else:
+            database, database_created = genome_index(args.genomeSequence, args.genomeSequence+".index", numpy_engine_parameters["kmer"])
+        if not args.quiet:
+            print(f"""\n------------------------------------------------------------------------------------------------------------------------------
+ 
+ Index of {args.genomeSequence} for the numpy allignment engine {'created' if database_created else 'already exists'}: {database}
+ 
+------------------------------------------------------------------------------------------------------------------------------\n""")
+    else:
+        if database_batch != None: # The database has already been created for all the runs of -batch
+            database, database_created = database_batch, False
+        elif not args.noCache:
+            database, database_created = cached_blast_database(args.genomeSequence, args.cache, verbose = args.verbose)
+            if database_created and not args.quiet:
+                print(f"""\n------------------------------------------------------------------------------------------------------------------------------
+ 
+ Database created with the program 'makeblastdb' for {args.genomeSequence} in the cache {args.cache}
+ 
+------------------------------------------------------------------------------------------------------------------------------\n""")
 
-# We add the "warning" column in which we say if there are duplicates or not
-final_table["Multiple Allignments"] = final_table.duplicated(subset = ["qaccver"], keep = False)
+        else:
+            # The database of the cache (or of -batch) is checked by cached_blast_database, only the database next to the genome sequence (-nc)
+            # is checked here and created with makeblastdb if it is not there
+            try: #We check if the database already exists, it works not only with the name of the db but also with the path to it
+                subprocess.check_call(["blastdbcmd", "-info", "-db", database], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+                # check_call makes the expression in the list and checks if there is a exit code 0 (success) or other (error)
+                # stdout and stderr are th eoutput and error message to a file that is temporal and not stored
+                # If it is a success it means that the indexed genome works
+                if args.verbose:
+                    print(f"""\n------------------------------------------------------------------------------------------------------------------------------\n
+ Database {args.genomeSequence} already exists!
+ Info of the DB:""")
+                    os.system("blastdbcmd -info -db "+database)
+                    print("""\n------------------------------------------------------------------------------------------------------------------------------""")
+                elif not args.quiet and not args.verbose:
+                    print("""\n------------------------------------------------------------------------------------------------------------------------------
+ 
+ Database already exists!
+ Procceding to do BLAST
+ 
+------------------------------------------------------------------------------------------------------------------------------\n""")
+                # Gives the info for the database
+            except:
+                if args.quiet:
+                # Create the index so blastn can do the alignment
+                    os.system('makeblastdb -in '+database+' -dbtype nucl > /dev/null')
+                # In case that check_all gives and error it creates the dabatase from the file given
+                elif args.verbose:
+                    print(f"------------------------------------------------------------------------------------------------------------------------------\n\n Creating Database with the program 'makeblastdb' for {database}")
+                    os.system('makeblastdb -in '+database+' -dbtype nucl')
+                    print("""------------------------------------------------------------------------------------------------------------------------------\n""")
+                elif not args.quiet and not args.verbose:
+                    print(f"""\n------------------------------------------------------------------------------------------------------------------------------
+ 
+ Creating Database with the program 'makeblastdb' for {database}
+ 
+------------------------------------------------------------------------------------------------------------------------------\n""")
+                    os.system('makeblastdb -in '+database+' -dbtype nucl > /dev/null')
+
+    #-------------------------------------------
+    #-------------------------------------------
+    # In the case that we want to perform a quality check we will perform the following lines
+    if args.quality and args.autoTrim != None:
+        # The thresholds are chosen from the qualities of the reads, so nobody needs to be at the keyboard
+        quality_per_position(reads_quality_scores).to_csv(os.path.join(args.out,"quality_per_position.csv"), index = False)
+        thresholds_chosen = choose_trimming_thresholds(reads_quality_scores, args.autoTrim, args.autoTrimLength)
+        if not args.quiet:
+            print("------------------------------------------------------------------------------------------------------------------------------\n")
+        if thresholds_chosen == None:
+            # The default thresholds do not keep the fraction asked, so they are recorded as a fallback and not as chosen automatically
+            threshold, length_threshold = 20, 20
+            selection_thresholds = "fallback"
+            print(f" WARNING: No quality threshold keeps {args.autoTrim} of the reads with a length of {args.autoTrimLength} or more, the default thresholds Q 20 and length 20 are used\n")
+        else:
+            threshold, length_threshold, _ = thresholds_chosen
+            selection_thresholds = "automatic"
+            if not args.quiet:
+                print(f" Thresholds chosen automatically to keep at least {args.autoTrim} of the reads: Q {threshold} and length {length_threshold}")
+    elif args.quality:
+        # We do the fastqc analysis that will generate the analysis in a zip file and also html files
+        os.system(f"fastqc {os.path.join(args.out,'all_reads_merged_quality.fastq')}")
+
+        # Now we ask the user what threshold wants
+        print("------------------------------------------------------------------------------------------------------------------------------\nChech the FastQC file and decide the threshold for trimming!")
+        threshold = input("Enter the Q value for trimming (by default 20): ")
+        length_threshold = input("Enter the length (by default 20): ")
+
+        if threshold == '':
+            threshold = 20
+        if length_threshold == '':
+            length_threshold = 20
+        threshold = int(threshold)
+        length_threshold = int(length_threshold)
+        selection_thresholds = "manual"
+
+    if args.quality:
+        # Now we trim all the reads at the same time and write directly the trimmed reads as fasta so we can perform the allign
+        five_prime_cuts, three_prime_cuts = trim_reads_quality(reads_quality_scores, threshold, length_threshold)
+        reads_trimmed = "".join('>'+name_read+'\n'+sequence[five_prime_cut:three_prime_cut]+'\n'
+                                for name_read, sequence, five_prime_cut, three_prime_cut in zip(reads_quality_names, reads_quality_sequences, five_prime_cuts, three_prime_cuts)
+                                if five_prime_cut >= 0)
+        if args.keepIntermediates:
+            with open(os.path.join(args.out,'all_reads_merged_trimmed.fasta'), 'w') as ofile:
+                ofile.write(reads_trimmed)
+
+        # The thresholds used are stored so the run can be repeated with the same trimming
+        number_kept = int((five_prime_cuts >= 0).sum())
+        pd.DataFrame({"Selection":[selection_thresholds],
+                      "Retention":[args.autoTrim],
+                      "Minimum Length":[args.autoTrimLength if args.autoTrim != None else None],
+                      "Q":[threshold],
+                      "Length":[length_threshold],
+                      "Reads":[len(five_prime_cuts)],
+                      "Reads Kept":[number_kept],
+                      "Fraction Kept":[round(number_kept/len(five_prime_cuts), 4) if len(five_prime_cuts) > 0 else 0]}).to_csv(os.path.join(args.out,"quality_trimming_thresholds.csv"), index = False)
+
+        if not args.quiet:
+            print(f"\n Reads trimmed with Q {threshold} and length {length_threshold}: {number_kept} kept and {len(five_prime_cuts)-number_kept} discarded")
+            print("------------------------------------------------------------------------------------------------------------------------------\n")
+
+
+    range_value = args.thresholdRange # This is a variable we can set to identify significant alignments, score has been assesed according to our experimental results
+    # This range value is the proportion that the score can be lower than the best hit in the allignment that we allow as a "valid" allignment
+    # This variable affects which reads have multiple allignments or not and the locus that we take as a hit
+
+
+    # Perform BLASTn
+    if args.verbose:
+        print(" BLAST command (s) that are going to be performed:")
 
-# Now we create the multiple locus column in case there are multiple allignments
-locus_associated = [] 
-for group_q_acc in final_table.groupby('qaccver', sort = False): # We group by query acc.
-    locus_associated_query = list(final_table[final_table["qaccver"] == group_q_acc[0]]["Locus Tag"].values) #list of the locuses attached to the query read
-    if len(locus_associated_query) > 1:
-        locus_associated_query = locus_associated_query[1:]
+    # The reads that are alligned, they are given to BLASTn by its standard input
+    if args.quality:
+        reads_query = reads_trimmed
     else:
-        locus_associated_query = "-"
-    locus_associated.append(locus_associated_query)
+        reads_query = reads_merged
+
+    # Options of the BLASTn search, they are part of the key of the hit cache, so the hits stored with other options are not used
+    blastn_search_options = ["-outfmt", "11"]
+    if args.maxHsps != None:
+        blastn_search_options += ["-max_hsps", str(args.maxHsps)]
+
+    # The reads whose hits are already known are not alligned again and are not written in the query file of BLASTn:
+    #   - In incremental mode, the reads that have the same sequence as in the previous run (and the same number of hits in its output)
+    #     if it was done with the same key of the search (genome sequence, engine, BLAST version and options and columns)
+    #   - If the hit cache is used (-hc), the reads whose sequence has already been alligned in any run (of any project) against the same genome sequence
+    #     with the same BLAST version, options and columns (hit cache)
+    # Besides, only the first read of each sequence is alligned, the hits of the other reads with the same sequence are the same with their own id
+    # Columns with the id of the query other than qaccver cannot be changed, so with them the hit cache is not used and all the reads are alligned
+    search_needed = True
+    hits_known_tabular, hits_known_SAM = {}, {}
+    header_SAM_known = None
+    reads_duplicated = {} # Id of a read -> id of the first read with the same sequence, that is the one alligned
+    query_replaceable = not any(column in columns_seq_alig for column in ["qseqid", "qgi", "qacc"]) and args.engine != "magicblast" # magicblast does not have a merged file of the reads
+    use_hit_cache = args.hitCache and query_replaceable
+    if args.incremental or query_replaceable:
+        reads_hashes = hash_fasta_reads(reads_query)
+        if args.incremental or use_hit_cache:
+            # Key of the search: the genome sequence, the engine with its version and options and the columns of the output
+            # The hits of the previous run (-inc) and of the hit cache are only used if they have been found with the same key
+            genome_hash = hash_file(args.genomeSequence)
+            if args.engine == "numpy":
+                key_search = (genome_hash, f"numpy {json.dumps(numpy_engine_parameters, sort_keys = True)}", " ".join(columns_seq_alig))
+            else:
+                key_search = (genome_hash, f"{blastn_version()} {' '.join(blastn_search_options)}", " ".join(columns_seq_alig))
+        index_query = columns_seq_alig.index("qaccver")
+        # If several reads have the same id their hits cannot be told apart, so all the reads are alligned
+        reads_repeated = len(set(id_read for id_read, _ in reads_hashes)) < len(reads_hashes)
+
+    if args.incremental:
+        manifest_reads = {"search":list(key_search), "sam":args.filesOut == "all"}
+        if manifest_previous != None and not reads_repeated and all(manifest_previous.get(key) == value for key, value in manifest_reads.items()):
+            # The hits of the previous run are read before its files are overwritten
+            _, hits_tabular_previous = read_blast_hits(os.path.join(args.out, 'all_seq_aligned.tsv'), index_query, header_line = header_output_blast)
+            header_SAM_known, hits_SAM_previous = read_blast_hits(os.path.join(args.out, 'all_seq_aligned.sam'), 0, header_character = "@")
+            for id_read, hash_read in reads_hashes:
+                read_previous = manifest_previous["reads"].get(id_read)
+                if read_previous != None and read_previous["hash"] == hash_read and len(hits_tabular_previous.get(id_read, [])) == read_previous["hits"]:
+                    hits_known_tabular[id_read] = hits_tabular_previous.get(id_read, [])
+                    hits_known_SAM[id_read] = hits_SAM_previous.get(id_read, [])
+        if manifest_previous != None: # The BLAST files of the previous run are not valid anymore, the ones of this run are created again
+            # The merged reads of the previous run are not the reads of this one either, they are only written again with -keep
+            for file_previous in os.listdir(args.out):
+                if (file_previous.startswith("all_seq_aligned") and file_previous.endswith(".asn")) or file_previous == "all_seq_aligned.sam" or \
+                   (file_previous.startswith("all_reads_merged") and not args.keepIntermediates):
+                    os.remove(os.path.join(args.out, file_previous))
+    number_reads_previous = len(hits_known_tabular)
+
+    if use_hit_cache:
+        try:
+            cache_hits = open_hit_cache(args.cache)
+            if not reads_repeated:
+                header_SAM_cache, hits_cache = lookup_hit_cache(cache_hits, key_search, [(id_read, hash_read) for id_read, hash_read in reads_hashes if id_read not in hits_known_tabular],
+                                                                index_query, args.filesOut == "all")
+                for id_read, (lines_tabular, lines_SAM) in hits_cache.items():
+                    hits_known_tabular[id_read] = lines_tabular
+                    hits_known_SAM[id_read] = lines_SAM
+                if header_SAM_known == None:
+                    header_SAM_known = header_SAM_cache
+        except sqlite3.Error:
+            print(f" WARNING: The hit cache in the cache directory {args.cache} could not be used, all the reads are alligned\n")
+            use_hit_cache = False
+
+    if args.incremental or query_replaceable:
+        # With -archive the same reads are taken as the first of each sequence, so the archive of a run with duplicated reads has all the hits needed
+        reads_first = {}
+        for id_read, hash_read in reads_hashes:
+            if id_read not in hits_known_tabular and not reads_repeated and query_replaceable:
+                if reads_first.setdefault(hash_read, id_read) != id_read:
+                    reads_duplicated[id_read] = reads_first[hash_read]
+        reads_search = set(id_read for id_read, _ in reads_hashes if id_read not in hits_known_tabular and id_read not in reads_duplicated)
+        search_needed = len(reads_search) > 0 or len(hits_known_tabular) == 0
+        if (len(hits_known_tabular) > 0 or len(reads_duplicated) > 0) and not args.archive:
+            reads_query = select_fasta_reads(reads_query, reads_search)
+        if not args.quiet and (args.incremental or len(hits_known_tabular) > 0 or len(reads_duplicated) > 0):
+            print(f""" {len(reads_search)} read(s) are going to be alligned, the hits of {number_reads_previous} read(s) are taken from the previous run, the hits of {len(hits_known_tabular)-number_reads_previous} read(s) from the hit cache
+ and the hits of {len(reads_duplicated)} read(s) from other read(s) with the same sequence\n""")
+
+    # The search is done only once and stored in a BLAST archive (ASN.1), all the outputs (tabular and SAM) are obtained from that archive with blast_formatter
+    # In case the user gives an archive of a previous run, the search is not done again and the outputs are obtained from it
+    # With -engine numpy the reads are alligned by this program and the outputs are written directly, without archive
+    directory_shards = os.path.join(args.out, "blast_shards") # Temporal directory for the files of each BLASTn process
+
+    if args.engine == "numpy":
+        files_blast_archive = []
+        if args.verbose:
+            print(f"\t- Allignment with the numpy engine and the index {database}, {number_processes} process(es) at the same time")
+    elif args.engine == "magicblast":
+        files_blast_archive = []
+        # The format of the reads for magicblast is taken from their extension, without the .gz of the gzipped files
+        format_magicblast = "fastq" if args.extensionReads.split(".")[0] in ["fastq", "fq"] else "fasta"
+        if args.verbose:
+            print(f"\t- Mapping with magicblast of the {format_magicblast} files {args.directoryReads}/*.{args.extensionReads} against the database {database} with {number_processes} thread(s)")
+    elif args.archive:
+        files_blast_archive = args.archive
+    else:
+        # If there is more than 1 process the reads are split and each part is searched with its own BLASTn, the reads of each part are given to it by its standard input
+        if number_processes > 1:
+            shard_queries = split_fasta_balanced(reads_query, number_processes)
+        else:
+            shard_queries = [reads_query]
+
+        if len(shard_queries) == 1:
+            files_blast_archive = [os.path.join(args.out, 'all_seq_aligned.asn')]
+        else:
+            files_blast_archive = [os.path.join(args.out, f'all_seq_aligned_shard{index_shard+1}.asn') for index_shard in range(len(shard_queries))]
+
+        commands_blastn_archive_output = [["blastn", "-query", "-", "-db", database, "-out", file_blast_archive]+blastn_search_options for file_blast_archive in files_blast_archive]
+        if args.verbose:
+            print(f"\t- Search command(s) (BLAST archive), {min(number_processes, len(commands_blastn_archive_output))} at the same time")
+            for command in commands_blastn_archive_output:
+                print(f"\t\t{shlex.join(command)}")
+
+    if args.engine == "blastn":
+        # The tabular output of each archive is read from the standard output of blast_formatter while it is written, in the order of the archives
+        # In case there are more than 1 archive, the SAM output of each one is formatted in its own file and they are joined afterwards
+        if len(files_blast_archive) == 1:
+            files_SAM_output = [os.path.join(args.out, 'all_seq_aligned.sam')]
+        else:
+            os.makedirs(directory_shards, exist_ok = True)
+            files_SAM_output = [os.path.join(directory_shards, f"shard{index_shard+1}.sam") for index_shard in range(len(files_blast_archive))]
+
+        commands_blastn_tabular_output = [["blast_formatter", "-archive", file_blast_archive, "-outfmt", f"6 {' '.join(columns_seq_alig)}"] for file_blast_archive in files_blast_archive]
+        if args.filesOut == "sam" or args.filesOut == "all":
+            commands_blastn_SAM_output = [["blast_formatter", "-archive", file_blast_archive, "-out", file_output, "-outfmt", f"17 {' '.join(columns_seq_alig)}"]
+                                          for file_blast_archive, file_output in zip(files_blast_archive, files_SAM_output)]
+            if args.verbose:
+                print("\t- SAM output command(s)")
+                for command in commands_blastn_SAM_output:
+                    print(f"\t\t{shlex.join(command)}")
+        if args.verbose:
+            print("\t- Tabular output command(s), read while they are written")
+            for command in commands_blastn_tabular_output:
+                print(f"\t\t{shlex.join(command)}")
+    if args.verbose:
+        print(f"""\n Final Headers that we are going to obtain in the tabular output:
+\t{header_output_blast}\n""")
 
-# Now we drop the duplicates only keeping the best alignment
-# Warning: duplicates will also be dropped for alignments with the same score or within the threshold
-final_table.drop_duplicates(subset ="qaccver", inplace=True, keep = "first")
-# This is the moment in which we only keep the best hit for the allignment
+    # It is possible to adjust with other arguments these expressions (check blastn manual)
+    # The way of changing the output is -outfmt "6 std" for the standard output, other example  -outfmt "6 std staxid" this will give us the standard output and the tax id of the subject
+    # It will give the output in the order of naming but without repetitions (if we put std score it will only print std)
+
+    # Lines of the tabular output of the reads alligned in this run, they are read when the hits are joined with the annotation
+    lines_tabular_new = []
+    processes_tabular = []
+    search_completed = False
+    if not search_needed:
+        pass
+    elif args.engine == "numpy":
+        if not args.verbose and not args.quiet:
+            print(f" Making the allignment between {args.directoryReads} and {args.genomeSequence} with the numpy engine\n")
+        lines_tabular_new = align_reads_fasta_numpy(reads_query, database, columns_seq_alig,
+                                                    os.path.join(args.out, 'all_seq_aligned.sam') if args.filesOut == "sam" or args.filesOut == "all" else None, number_processes)
+    elif args.engine == "magicblast":
+        if not args.verbose and not args.quiet:
+            print(f" Mapping the reads of {args.directoryReads} to {args.genomeSequence} with magicblast\n")
+        # magicblast maps the reads only once, its SAM output is the SAM file of -f sam or all and the hits of the final table are converted from it
+        file_magicblast_output = os.path.join(args.out, 'all_seq_aligned.sam' if args.filesOut == "sam" or args.filesOut == "all" else 'all_seq_aligned.magicblast.sam')
+        time_start = time.perf_counter()
+        number_reads_searched = run_magicblast([file_read for _, file_read in files_reads], database, format_magicblast, file_magicblast_output, number_threads = number_processes)
+        time_mapping = time.perf_counter()-time_start
+        lines_tabular_new = convert_magicblast_sam(file_magicblast_output, columns_seq_alig, blast_database_length(database))
+        if not args.quiet:
+            print(f" {number_reads_searched} reads given to magicblast in {time_mapping:.1f} s ({number_reads_searched/max(time_mapping, 1e-9):.0f} reads per second)\n")
+    elif not args.archive:
+        if not args.verbose and not args.quiet:
+            print(f" Making BLAST between {args.directoryReads} and {args.genomeSequence}\n")
+        check_exit_codes(commands_blastn_archive_output, run_commands_parallel(commands_blastn_archive_output, number_processes, shard_queries))
+    elif not args.quiet:
+        print(f" Using the BLAST search stored in {' '.join(args.archive)}\n")
+
+    executor_SAM, future_SAM = None, None
+    if search_needed and args.engine == "blastn":
+        if args.filesOut == "sam" or args.filesOut == "all":
+            # The SAM outputs are formatted in the background while the tabular outputs are read and joined with the annotation, they are checked after the join
+            executor_SAM = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+            future_SAM = executor_SAM.submit(run_commands_parallel, commands_blastn_SAM_output, number_processes)
+        # The formatters of all the archives are started at the same time, each one waits while its output is not read
+        processes_tabular = [subprocess.Popen(command, stdout = subprocess.PIPE, text = True) for command in commands_blastn_tabular_output]
+        lines_tabular_new = (line for process in processes_tabular for line in process.stdout)
+
+    # The hits are grouped by read while they are read. The hits of the reads that have not been alligned are put back among them, so all the hits are
+    # in the same order of the reads as if all of them had been alligned, and the hits of the reads alligned are kept for the hit cache
+    groups_hits = group_query_hits(lines_tabular_new, columns_seq_alig.index("qaccver"))
+    hits_tabular_new, number_hits_reads = {}, {}
+    if args.incremental or query_replaceable:
+        groups_hits = splice_known_hits(groups_hits, [id_read for id_read, _ in reads_hashes], hits_known_tabular, reads_duplicated, index_query,
+                                        hits_tabular_new, number_hits_reads, store_all = use_hit_cache)
+    # os.system("rm all_reads_merged.fna") #We remove the file all_reads_merged but we can keep it deleting this command (or commenting)
+
+    # ----------------------------------
+    if not args.quiet and not args.verbose:
+            print("""------------------------------------------------------------------------------------------------------------------------------
 
-# We add to the table the locus column
-final_table["Rest of Locus Tag Associated"] = locus_associated
+ Creating reads alignment - gene annotation Table
+ 
+------------------------------------------------------------------------------------------------------------------------------\n""")
 
-# Create the summary map dataframe to fill, we create it empty
-if args.summaryMap:
-    # Creamos el table entero sin nada dentro
-    summary_map = pd.DataFrame(index = ["A", "B", "C", "D", "E", "F", "G", "H"], columns = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+    #state the files of blast, genome annotation file and the final table
+    file_tabular_output = final_directory+"/all_seq_aligned.tsv"
+    final_table_name = final_directory+"/table_reads_genes_description.csv"
 
-# Let's add the columns of the identity if the argument is there
-if args.identity != None:
-    if not args.quiet and not args.verbose:
-        print(" Adding Identity Columns to table\n")
-    if args.verbose:
-        print(f"""\n------------------------------------------------------------------------------------------------------------------------------
-\n Adding Identity Columns to table with the information in {args.identity}""")
-    # Let's check if the file exists and import it in case it does
-    # We read in a different way the map in case it is a csv or an excel file
-    _, extension = os.path.splitext(args.identity)
-    if extension == ".csv":
+    # Store the name of the summaryMpa in case that the user has asked for it
+    if args.summaryMap:
+        file_map_summary_name = final_directory+"/summary_locus_grid_map.csv"
+
+    # The tabular output is read in chunks while it is written (by blast_formatter or the allignment engine) and it is stored in file_tabular_output
+    # with its header. The hits of each chunk that cannot be in the final table are removed (see filter_best_hits), the rest are joined with the annotation
+    # (table_ann has already been loaded) and only the best hit of each query is kept, so the memory needed does not grow with the number of hits
+    # With blastn the search has already finished here, only the formatting of its archive is done at the same time as the join (and as the SAM formatting),
+    # so the time saved is the one of the formatting, the search takes the same time
+    tables_matches, tables_not_matches = [], []
+    queries_chunks = set()
+    columns_float = set()
+    query_split = False
+    for table_seq in read_hits_chunks(groups_hits, columns_seq_alig, file_tabular_output):
+        # The hits of a query are split between chunks only if several reads have the same name and they are not consecutive
+        query_split = query_split or table_seq["qaccver"].isin(queries_chunks).any()
+        queries_chunks.update(table_seq["qaccver"])
+        columns_float.update(column for column in table_seq.columns if table_seq[column].dtype == float)
+        table_seq = filter_best_hits(table_seq, annotation_index, range_value, args.overlap)
+        table_matches, table_not_matches = join_hits_loci(table_seq, columns_seq_alig, table_ann, columns_ann, annotation_index, range_value, args.overlap)
+        tables_matches.append(table_matches)
+        tables_not_matches.append(table_not_matches)
+    # If a formatter has failed its output is empty or incomplete, so its reads would be in the final table as if they did not have hits
+    check_exit_codes(commands_blastn_tabular_output if len(processes_tabular) > 0 else [], [process.wait() for process in processes_tabular])
+    if future_SAM != None:
+        check_exit_codes(commands_blastn_SAM_output, future_SAM.result())
+        executor_SAM.shutdown()
+    # Join the SAM outputs of the shards in the same order of the reads, the SAM header is the same in all of them so it is only taken once
+    if len(files_blast_archive) > 1 and search_needed and (args.filesOut == "sam" or args.filesOut == "all"):
+        merge_shard_files(files_SAM_output, os.path.join(args.out, 'all_seq_aligned.sam'), header_character = "@")
+    if os.path.isdir(directory_shards):
+        shutil.rmtree(directory_shards)
+    # All the programs of the search have finished well (the engines and check_exit_codes stop the program if not), only then the hits are stored in the hit cache
+    # The reads without lines are stored as reads without hits, so the hits of a failed search would be taken as no hits in all the next runs
+    search_completed = True
+    if args.engine == "magicblast" and search_needed and not (args.filesOut == "sam" or args.filesOut == "all"):
+        os.remove(file_magicblast_output)
+
+    if query_split: # The whole tabular output is joined at the same time
+        table_seq = pd.read_csv(file_tabular_output, sep = "\t", dtype = {column:blast_columns_types[column] for column in columns_seq_alig if column in blast_columns_types})
+        columns_float = set()
+        table_seq = filter_best_hits(table_seq, annotation_index, range_value, args.overlap)
+        tables_matches, tables_not_matches = [[table] for table in join_hits_loci(table_seq, columns_seq_alig, table_ann, columns_ann, annotation_index, range_value, args.overlap)]
+
+    # The queries matched with some locus go before the ones without locus, as if the whole tabular output had been joined at the same time
+    final_table = pd.concat([table for table in tables_matches+tables_not_matches if len(table) > 0] or tables_matches[:1], ignore_index = True)
+    # A column is read as float in all the table if it is float in any chunk
+    for column in columns_float:
+        if final_table[column].dtype.kind in "iu":
+            final_table[column] = final_table[column].astype(float)
+    # The categories are only used to join the hits, the final table has the texts (it has one row per query, so they are not repeated)
+    for column in final_table.columns:
+        if isinstance(final_table[column].dtype, pd.CategoricalDtype):
+            final_table[column] = final_table[column].astype(final_table[column].cat.categories.dtype)
+
+    # The SAM output of the reads that have not been alligned is put back, the hits of the reads alligned are stored in the hit cache and,
+    # in incremental mode, the manifest of this run is stored
+    if args.incremental or query_replaceable:
+        header_SAM_new, hits_SAM_new = read_blast_hits(os.path.join(args.out, 'all_seq_aligned.sam'), 0, header_character = "@") if search_needed and args.filesOut == "all" else ([], {})
+        if len(hits_known_tabular) > 0 or len(reads_duplicated) > 0:
+            if args.filesOut == "all":
+                with open(os.path.join(args.out, 'all_seq_aligned.sam'), "w") as outfile:
+                    outfile.writelines(header_SAM_new if search_needed else header_SAM_known)
+                    for id_read, _ in reads_hashes:
+                        if id_read in hits_known_SAM:
+                            outfile.writelines(hits_known_SAM[id_read])
+                        elif id_read in reads_duplicated:
+                            outfile.writelines(replace_query_hits("".join(hits_SAM_new.get(reads_duplicated[id_read], [])), 0, id_read))
+                        else:
+                            outfile.writelines(hits_SAM_new.get(id_read, []))
+            # The archive only has the reads that have been alligned in this run, it can be used with -archive if all the other reads have the same sequence as one of them
+            if len(hits_known_tabular) > 0:
+                for file_blast_archive in files_blast_archive+[os.path.join(args.out, 'all_seq_aligned.asn')]:
+                    if os.path.isfile(file_blast_archive):
+                        os.remove(file_blast_archive)
+
+        if use_hit_cache:
             try:
-                map_identities = pd.read_csv(args.identity, header = 0)
-            except:
-                raise Exception("File "+args.identity+" not found")
-    elif extension == ".xlsx":
-        try:
-            map_identities = pd.read_excel(args.identity, engine = "openpyxl")
-        except:
-            raise Exception("File "+args.identity+" not found")
-    else:
-        raise Exception(f"-identity map file {args.identity} extension is {extension} and only csv and xlsx files are accepted for this argument") 
+                if search_needed and search_completed and not reads_repeated:
+                    store_hit_cache(cache_hits, key_search, [(id_read, hash_read) for id_read, hash_read in reads_hashes if id_read in reads_search],
+                                    hits_tabular_new, hits_SAM_new if args.filesOut == "all" else None, header_SAM_new if args.filesOut == "all" else None)
+            except sqlite3.Error:
+                print(f" WARNING: The hits could not be stored in the hit cache in the cache directory {args.cache}\n")
+            cache_hits.close()
+
+        if args.incremental:
+            # The reads with the same id as other reads are not stored, so they are always alligned
+            count_reads = pd.Series([id_read for id_read, _ in reads_hashes], dtype = object).value_counts()
+            manifest_reads["reads"] = {id_read:{"hash":hash_read, "hits":number_hits_reads.get(id_read, 0)} for id_read, hash_read in reads_hashes if count_reads[id_read] == 1}
+            with open(os.path.join(args.out, "reads_manifest.json"), "w") as outfile:
+                json.dump(manifest_reads, outfile)
+
+    # Layout of the plate in which the reads were sequenced
+    geometry = plate_geometry(args.plate, args.numbering)
+
+    # Create the summary map dataframe to fill, we create it empty
+    if args.summaryMap:
+        # Creamos el table entero sin nada dentro
+        summary_map = pd.DataFrame(index = geometry["rows"], columns = geometry["columns"])
+
+    # Find the well of the plate in which each query was sequenced, it is needed for the identity columns and for the summary map
+    if args.identity != None or args.summaryMap:
+        # Establish the regex expression we are going to search the plate sequencing well
+        if args.extensionReads == "seq":
+            regex_exp = r"\+([a-zA-Z]+)(\d+)_|\+(\d+)_"
+        else:
+            regex_exp = r"_([a-zA-Z]+)(\d+)(?=_)|_(\d+)(?=_)"
 
-    
-    # Prepare the column we are going to analyze and create the others that we are going to add
-    position_plate_seq = []
-    identity_sample = []
-    list_queries = list(final_table["qaccver"])
-    list_locus = list(final_table["Locus Tag"]) #  We establish this valye in case summarymap is defined
-    
-    # Establish the regex expression we are going to search the plate sequencing well
-    if args.extensionReads == "seq":
-        regex_exp = r"\+([a-zA-Z]+)(\d+)_|\+(\d+)_"
-    else:
-        regex_exp = r"_([a-zA-Z]+)(\d+)(?=_)|_(\d+)(?=_)"
-        
-    # We create the identifiers between an index and the wells in case the position of the sequences are numbers
-    rows = "ABCDEFGH"
-    well_info = []
-    for col in range (1,13):
-        for row in rows:
-            well_info.append((f"{row}{col}", row, col))
-    dictionary_number_well = {i+1:well_info[i] for i in range(96)}
-
-    # Run over the list of queries
-    for query, locus in zip(list_queries, list_locus):
-        everything_good = True
-        matches = re.findall(regex_exp, query) # Vamos a coger todas los matches del patron
-        if len(matches) == 0: # Aqui no tenemos un match en general, ni de numeros ni de letras mas numeros
+        positions_plate, queries_not_matched, numbers_out_plate = find_well_positions(final_table["qaccver"], regex_exp, geometry)
+
+        if len(queries_not_matched) > 0:
             print(f"""
- WARNING: No matches for the regexs used for well was found in {query}
+ WARNING: No matches for the regexs used for well was found in {len(queries_not_matched)} sequence(s):
+          {", ".join(queries_not_matched)}
           For seq files the well name or number should be the last group of characters between a + and a _ (+A01_ or +2_ for example)
           For all other types of files, including txt, the well identity should be the last element surronded by _ (_A01_ or _2_ for example)
           You can have both well identifier or number in a sequence name but, in that case, the final match is going to be the ONLY one taken in account.
@@ -631,141 +2703,111 @@ if args.identity != None:
           Take in account that we are searching for one or more letters followed by a number or just a number between a plus and an underscore in seq files
           or between 2 underscores in other files extensions
                       """)
-            position_plate_seq.append(float("nan"))
-            everything_good = False
-        else: # There is a match, maybe a well or maybe a number, but there is a match that will have 3 possible elements: well row, well column, number. There cant be a match that has all 3
-            final_match = matches[-1]
-            if final_match[0] and final_match[1]: # If it has the 2 first elements it is a well position
-                position_plate_seq.append(final_match[0]+final_match[1])
-                row_position = final_match[0]
-                column_position = final_match[1]
-            else: # If there is not the first and second element but the third, it is a number position
-                if int(final_match[2]) < 1 or int(final_match[2]) > 96: # It cant fit in a 96-well plate
-                    print(f" WARNING: We have found an identifier that corresponds to a number, {final_match[2]} but it is not between 1 and 96, which is incompatible with the current program that only can handle 96-well plates\n")
-                    everything_good = False
-                    position_plate_seq.append(float('nan'))
-                else:
-                    position_plate_seq.append(dictionary_number_well[int(final_match[2])][0])
-                    row_position = dictionary_number_well[int(final_match[2])][1]
-                    column_position = dictionary_number_well[int(final_match[2])][2]
-
-        if everything_good: # If the identifier of this query is all good we add to the column the name of that cell
+        if len(numbers_out_plate) > 0:
+            print(f" WARNING: We have found identifiers that correspond to a number, {', '.join(numbers_out_plate)}, but they are not between 1 and {geometry['wells']}, which is incompatible with the {geometry['wells']}-well plate set in -plate\n")
+
+    # Let's add the columns of the identity if the argument is there
+    if args.identity != None:
+        if not args.quiet and not args.verbose:
+            print(" Adding Identity Columns to table\n")
+        if args.verbose:
+            print(f"""\n------------------------------------------------------------------------------------------------------------------------------
+\n Adding Identity Columns to table with the information in {args.identity}""")
+        # Let's check if the file exists and import it in case it does
+        # We read in a different way the map in case it is a csv or an excel file
+        _, extension = os.path.splitext(args.identity)
+        if extension == ".csv":
+                try:
+                    map_identities = pd.read_csv(args.identity, header = 0)
+                except:
+                    raise Exception("File "+args.identity+" not found")
+        elif extension == ".xlsx":
             try:
-                identity_sample.append(map_identities[map_identities["Row/Column"]==row_position][str(int(column_position))].values[0])
+                map_identities = pd.read_excel(args.identity, engine = "openpyxl")
             except:
-                print(f" WARNING: The sequence well position {row_position+str(int(column_position))} was not found in {args.identity}\n")
-                identity_sample.append(float('nan'))
-            
-            if args.summaryMap: # In case the summary map argument is given, the position in the final map will be filled with the locus
-                if row_position not in summary_map.index or int(column_position) not in summary_map.columns:
-                    print(f" The sequence well position {row_position+str(int(column_position))} cannot be placed in a table with 1-12 columns and A-H rows so it wont be included in the final summary map of locus-well\n")
-                else:
-                    summary_map.at[row_position, int(column_position)] = locus
+                raise Exception("File "+args.identity+" not found")
         else:
-            identity_sample.append(float('nan'))
-    
-    # Insert in the final table the new columns
-    final_table.insert(1, "PositionSeqPlate", position_plate_seq)
-    final_table.insert(2, "IdentitySample", identity_sample)
+            raise Exception(f"-identity map file {args.identity} extension is {extension} and only csv and xlsx files are accepted for this argument")
 
-    # Export the final summary map
-    if args.summaryMap:
+        # The map is changed to a table with one row per well (row, column and identity) so all the queries can be joined with it at the same time
+        if "Row/Column" in map_identities.columns:
+            identities_wells = map_identities.melt(id_vars = "Row/Column", var_name = "Column", value_name = "IdentitySample")
+        else:
+            print(f" WARNING: The column Row/Column with the name of the rows was not found in {args.identity}\n")
+            identities_wells = pd.DataFrame(columns = ["Row/Column", "Column", "IdentitySample"])
+        identities_wells["Column"] = identities_wells["Column"].astype(str)
+        identities_wells = identities_wells.drop_duplicates(subset = ["Row/Column", "Column"], keep = "first") # In case a row is repeated, the first one is taken
+
+        wells_queries = pd.DataFrame({"Row/Column":positions_plate["Row"],
+                                      "Column":positions_plate["Column"].astype("Int64").astype(str).where(positions_plate["Column"].notna())})
+        identity_sample = wells_queries.merge(identities_wells, how = "left", on = ["Row/Column", "Column"], indicator = True)
+
+        wells_not_found = positions_plate["PositionSeqPlate"][(identity_sample["_merge"] == "left_only").to_numpy() & positions_plate["Column"].notna().to_numpy()]
+        if len(wells_not_found) > 0:
+            print(f" WARNING: The sequence well position(s) {', '.join(wells_not_found.unique())} were not found in {args.identity}\n")
+
+        # Insert in the final table the new columns
+        final_table.insert(1, "PositionSeqPlate", positions_plate["PositionSeqPlate"].values)
+        final_table.insert(2, "IdentitySample", identity_sample["IdentitySample"].values)
+
+        everything_good = positions_plate["PositionSeqPlate"].notna().all()
+
+    if args.summaryMap: # In case the summary map argument is given, the position in the final map will be filled with the locus
+        loci_wells = pd.DataFrame({"Row":positions_plate["Row"].values,
+                                   "Column":positions_plate["Column"].values,
+                                   "Locus Tag":final_table["Locus Tag"].values}).dropna(subset = ["Column"]) # The queries without well are not in the map
+        is_in_map = loci_wells["Row"].isin(summary_map.index) & loci_wells["Column"].isin(summary_map.columns)
+        if not is_in_map.all():
+            wells_out_map = loci_wells["Row"][~is_in_map]+loci_wells["Column"][~is_in_map].astype(int).astype(str)
+            print(f" The sequence well position(s) {', '.join(wells_out_map.unique())} cannot be placed in a table with 1-{geometry['columns'][-1]} columns and {geometry['rows'][0]}-{geometry['rows'][-1]} rows so they wont be included in the final summary map of locus-well\n")
+
+        # If there are several queries in the same well, the last one is the one in the map
+        loci_wells = loci_wells[is_in_map].drop_duplicates(subset = ["Row", "Column"], keep = "last")
+        loci_wells["Column"] = loci_wells["Column"].astype(int)
+        summary_map = loci_wells.pivot(index = "Row", columns = "Column", values = "Locus Tag").reindex(index = summary_map.index, columns = summary_map.columns).rename_axis(index = None, columns = None)
+
+        # Export the final summary map
         summary_map.to_csv(file_map_summary_name)
 
-    if not args.quiet:
-        print(" Volumes set in -identity are going to be introduced and, in case the argument -sm is set, the map is also created and filled")
-        print("\n------------------------------------------------------------------------------------------------------------------------------\n")
+    if args.identity != None:
+        if not args.quiet:
+            print(" Volumes set in -identity are going to be introduced and, in case the argument -sm is set, the map is also created and filled")
+            print("\n------------------------------------------------------------------------------------------------------------------------------\n")
+    elif args.summaryMap:
+        if not args.quiet:
+            print(" The map of locus hit - map is created and filled")
+            print("\n------------------------------------------------------------------------------------------------------------------------------\n")
+
+    #------------------
+    # Now we delete the columns that we havent put in the -cb or -ca arguments but were needed in the course of the script
+    if not qacc:
+        del final_table["qaccver"]
+    if not bitscore:
+        del final_table["bitscore"]
+    if not sstart:
+        del final_table["sstart"]
+    if not send:
+        del final_table["send"]
+    if not locus_tag:
+        del final_table["Locus Tag"]
+    if not start:
+        del final_table["Start"]
+    if not end:
+        del final_table["End"]
+
+    #------------------
+
+    #We export the table that we have created as final_table_name.csv
+    if args.filesOut == "table" or args.filesOut == "all":
+        final_table.to_csv(final_table_name, index = False)
 
-elif args.summaryMap and args.identity == None: # We dont need or want the columns that track identity with a map
-    # Get the queries
-    list_queries = list(final_table["qaccver"])
-    # Get the main hits
-    list_locus = list(final_table["Locus Tag"])
-    
-    # Establish the regex expression we are going to search the plate sequencing well
-    if args.extensionReads == "seq":
-        regex_exp = r"\+([a-zA-Z]+)(\d+)_|\+(\d+)_"
-    else:
-        regex_exp = r"_([a-zA-Z]+)(\d+)(?=_)|_(\d+)(?=_)"
-        
-    # Create the identifiers index-well in case the position is a number and not a well
-    rows = "ABCDEFGH"
-    well_info = []
-    for col in range (1,13):
-        for row in rows:
-            well_info.append((f"{row}{col}", row, col))
-    dictionary_number_well = {i+1:well_info[i] for i in range(96)}
-
-    # Run over the list of queries
-    for query, locus in zip(list_queries, list_locus):
-        everything_good = True
-        matches = re.findall(regex_exp, query)
-
-        if len(matches) == 0:
-            print(f""" 
- WARNING: No matches for the regexs used for well was found in {query}
-          For seq files the well name or number should be the last group of characters between a + and a _ (+A01_ or +2_ for example)
-          For all other types of files, including txt, the well identity should be the last element surronded by _ (_A01_ or _2_ for example)
-          You can have both well identifier or number in a sequence name but, in that case, the final match is going to be the ONLY one taken in account.
-          For example, if you have both _A01_ and _13_ in a sequence and 13 is the last match, the identifier for this sequence is going to be 13, not A01
-          Take in account that we are searching for one or more letters followed by a number or just a number between a plus and an underscore in seq files
-          or between 2 underscores in other files extensions
-                      """)
-            continue
+    if args.verbose:
+        number_reads_multialign = final_table["Multiple Allignments"].value_counts()[True]
+        if args.identity and everything_good:
+            mode_identity = True
         else:
-            final_match = matches[-1]
-            if final_match[0] and final_match[1]:
-                row_position = final_match[0]
-                column_position = int(final_match[1])
-            else:
-                if int(final_match[2]) > 96:
-                    print(f" WARNING: We have found an identifier that corresponds to a number, {final_match[2]} but it is superior than 96, which is incompatible with the current program that only can handle 96-well plates")
-                    continue
-                else:
-                    row_position = dictionary_number_well[int(final_match[2])][1]
-                    column_position = dictionary_number_well[int(final_match[2])][2]
-
-            if row_position not in summary_map.index or column_position not in summary_map.columns:
-                print(f" The sequence well position {row_position+str(int(column_position))} cannot be placed in a table with 1-12 columns and A-H rows so it wont be included in the final summary map of locus-well")
-            else:
-                summary_map.at[row_position, int(column_position)] = locus
-
-
-    # Export the map
-    summary_map.to_csv(file_map_summary_name)
-
-    if not args.quiet:
-        print(" The map of locus hit - map is created and filled")
-        print("\n------------------------------------------------------------------------------------------------------------------------------\n")
-
-#------------------
-# Now we delete the columns that we havent put in the -cb or -ca arguments but were needed in the course of the script
-if not qacc:
-    del final_table["qaccver"]
-if not bitscore:
-    del final_table["bitscore"]
-if not sstart:
-    del final_table["sstart"]
-if not locus_tag:
-    del final_table["Locus Tag"]
-if not start:
-    del final_table["Start"]
-if not end:
-    del final_table["End"]
-
-#------------------
-
-#We export the table that we have created as final_table_name.csv
-if args.filesOut == "table" or args.filesOut == "all":
-    final_table.to_csv(final_table_name, index = False)
-
-if args.verbose:
-    number_reads_multialign = final_table["Multiple Allignments"].value_counts()[True]
-    if args.identity and everything_good:
-        mode_identity = True
-    else:
-        mode_identity = False
-    print(f"""\tFINAL ALIGNMENT-ANNOTATION TABLE GENERAL INFORMATION\n
+            mode_identity = False
+        print(f"""\tFINAL ALIGNMENT-ANNOTATION TABLE GENERAL INFORMATION\n
         \tDimension                                                                 {final_table.shape[1]} Columns and {final_table.shape[0]} Rows
         \tNumber of reads with multiallignments (within the threshold established)  {number_reads_multialign}
         \tPositionSeqPlate - Identity                                               {mode_identity}
@@ -773,8 +2815,88 @@ if args.verbose:
     """)
 
 
-#------------------
-#Final encouraging message
-if not args.quiet:
-    print(" Program Done :)")
-#------------------
\ No newline at end of file
+    #------------------
+    #Final encouraging message
+    if not args.quiet:
+        print(" Program Done :)")
+    #------------------
+
+
+# In case we want to annotate several runs, the database is loaded here and annotate_run is done for each run with its arguments
+# If not, annotate_run is done only once with the arguments given
+database_batch = None
+if args.batch:
+    if args.noCache or args.warmCache or args.archive:
+        parser.error("argument -batch: not allowed with arguments -nc/--noCache, -warm/--warmCache or -archive")
+    if args.quality and args.autoTrim == None:
+        parser.error("argument -batch: the trimming thresholds of the runs need to be chosen automatically, the argument -at is required with -quality")
+    if args.batchWorkers < 0:
+        parser.error("argument -bw/--batchWorkers: the number of runs at the same time cannot be negative")
+
+    try:
+        runs = pd.read_csv(args.batch, dtype = str, keep_default_na = False)
+    except:
+        raise Exception("File "+args.batch+" not found")
+    if "directoryReads" not in runs.columns or "out" not in runs.columns:
+        raise Exception(f"-batch manifest {args.batch} needs the columns directoryReads and out")
+    if "identity" not in runs.columns:
+        runs["identity"] = ""
+    # Reads directory, output directory and map of identities of each run
+    runs = [(directory_reads, directory_out, file_identity if file_identity != "" else args.identity) for directory_reads, directory_out, file_identity in zip(runs["directoryReads"], runs["out"], runs["identity"])]
+
+    # Every run is checked before starting any of them
+    for directory_reads, directory_out, file_identity in runs:
+        if not os.path.isdir(directory_reads):
+            message_error = f"The directory {directory_reads} does not exist and it is neccessary for the program!"
+        elif file_identity != None and not os.path.isfile(file_identity):
+            message_error = f"The file {file_identity} does not exist or it is not found and it is neccessary for the -identity argument!"
+        elif os.path.exists(directory_out) and not (args.incremental and os.path.isfile(os.path.join(directory_out, "reads_manifest.json"))):
+            message_error = f"The output directory {directory_out} already exists and the runs of -batch cannot overwrite it"
+        else:
+            continue
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ {message_error}
+ Exiting program\n
+------------------------------------------------------------------------------------------------------------------------------""")
+        raise SystemExit(0)
+    if len(set(os.path.abspath(directory_out) for _, directory_out, _ in runs)) < len(runs):
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ Several runs of {args.batch} have the same output directory
+ Exiting program\n
+------------------------------------------------------------------------------------------------------------------------------""")
+        raise SystemExit(0)
+
+    if args.engine == "numpy":
+        database_batch, _ = genome_index(args.genomeSequence, os.path.join(args.cache, "genome_index", hash_file(args.genomeSequence)), numpy_engine_parameters["kmer"])
+    else:
+        database_batch, _ = cached_blast_database(args.genomeSequence, args.cache, verbose = args.verbose)
+
+    if args.batchWorkers == 0:
+        number_workers = os.cpu_count()
+    else:
+        number_workers = args.batchWorkers
+    if not args.quiet:
+        print(f"""------------------------------------------------------------------------------------------------------------------------------\n
+ Annotating {len(runs)} runs of {args.batch}, {number_workers} at the same time
+\n------------------------------------------------------------------------------------------------------------------------------""")
+
+    # Each run is done by annotate_run with its own arguments, in a pool of processes created with fork (they need the functions and the data
+    # of this script, that is not imported) or one after the other if there is only one at the same time or fork cannot be used (Windows)
+    runs_args = [argparse.Namespace(**{**vars(args), "directoryReads":directory_reads, "out":directory_out, "identity":file_identity})
+                 for directory_reads, directory_out, file_identity in runs]
+    annotation = (table_ann, annotation_index)
+    if number_workers <= 1 or len(runs) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        runs_finished = [run_batch_entry(args_run, annotation, database_batch) for args_run in runs_args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = min(number_workers, len(runs)), mp_context = multiprocessing.get_context("fork")) as executor:
+            runs_finished = list(executor.map(run_batch_entry, runs_args, [annotation]*len(runs), [database_batch]*len(runs)))
+
+    runs_failed = [directory_out for (_, directory_out, _), run_finished in zip(runs, runs_finished) if not run_finished]
+    if len(runs_failed) > 0:
+        print(f" WARNING: The runs with the output directories {', '.join(runs_failed)} have failed, check their log files\n")
+        raise SystemExit(1)
+    if not args.quiet:
+        print(f" All the runs of {args.batch} are done, the log of each run is next to its output directory")
+        print("\n------------------------------------------------------------------------------------------------------------------------------\n")
+else:
+    annotate_run(args, (table_ann, annotation_index))
@@ -0,0 +1,79 @@
+# Benchmark of the ABIF reader of LAPu-InsertsGenAnnotation-2.0.0
+
+# Python program that compares the time needed to read the base calls and qualities of the ab1 files of a directory with the function
+# read_abif_basecalls of ScriptAllignmentAnnotation_v200.py and with SeqIO.read(..., "abi") of biopython, and checks that both give the same reads
+# By default the traces in input/sequencing_results are used
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import numpy as np
+import os
+import argparse
+import ast
+import mmap
+import time
+from Bio import SeqIO
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def load_script_functions (file_script, names):
+    """
+    Function that loads the functions and variables in names of the script without running it, the script does everything when it is imported
+    """
+    with open(file_script, "r") as infile:
+        tree = ast.parse(infile.read())
+    namespace = {"np":np, "mmap":mmap}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in names:
+            exec(compile(ast.Module([node], []), file_script, "exec"), namespace)
+        elif isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id in names for target in node.targets):
+            exec(compile(ast.Module([node], []), file_script, "exec"), namespace)
+    return namespace
+
+def time_reader (function_reader, files_abif, repetitions):
+    """
+    Function that returns the best time of repetitions readings of all files_abif with function_reader
+    """
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for file_abif in files_abif:
+            function_reader(file_abif)
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+directory_script = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description = "Benchmark of read_abif_basecalls against SeqIO.read(..., 'abi')")
+parser.add_argument("directoryTraces", nargs = "?", default = os.path.join(directory_script, "input", "sequencing_results"),
+                    help = "Directory with the ab1 files, by default %(default)s")
+parser.add_argument("-r", "--repetitions", default = 5, type = int,
+                    help = "Number of times that all the files are read, the best time is shown. By default %(default)s")
+args = parser.parse_args()
+
+namespace = load_script_functions(os.path.join(directory_script, "ScriptAllignmentAnnotation_v200.py"), ["abif_entry_type", "read_abif_basecalls"])
+read_abif_basecalls = namespace["read_abif_basecalls"]
+
+files_abif = sorted(os.path.join(args.directoryTraces, file) for file in os.listdir(args.directoryTraces) if file.endswith(".ab1"))
+if len(files_abif) == 0:
+    print(f" There are no ab1 files in {args.directoryTraces}")
+    raise SystemExit(0)
+
+# Both readers have to give the same base calls and qualities
+for file_abif in files_abif:
+    record = SeqIO.read(file_abif, "abi")
+    _, sequence, qualities = read_abif_basecalls(file_abif)
+    if sequence.tobytes().decode() != str(record.seq) or qualities.tolist() != record.letter_annotations["phred_quality"]:
+        raise Exception(f"The reads of {file_abif} are different with read_abif_basecalls and SeqIO")
+
+time_seqio = time_reader(lambda file_abif: SeqIO.read(file_abif, "abi"), files_abif, args.repetitions)
+time_mmap = time_reader(read_abif_basecalls, files_abif, args.repetitions)
+
+print(f"""
+ {len(files_abif)} ab1 files in {args.directoryTraces} (best of {args.repetitions})
+\tSeqIO.read(..., "abi"):  {time_seqio*1000:.1f} ms ({time_seqio/len(files_abif)*1000:.2f} ms per file)
+\tread_abif_basecalls:     {time_mmap*1000:.1f} ms ({time_mmap/len(files_abif)*1000:.2f} ms per file)
+\tSpeedup:                 {time_seqio/time_mmap:.1f}x
+""")
@@ -0,0 +1,162 @@
+# Benchmark of the memory of the join of the hits with the annotation of LAPu-InsertsGenAnnotation-2.0.0
+
+# Python program that measures the peak memory and the time needed to read the tabular output of BLAST in chunks and join it with the annotation,
+# as ScriptAllignmentAnnotation_v200.py does it, with the compact types of the script (categories, int32 and float32) and with the types that pandas
+# gives by default (object, int64 and float64), and checks that both give the same final table
+# It also measures the join of the previous versions of the script (baseline): the whole tabular output read with the default types and a cross join
+# of all the hits with all the loci of the annotation. The cross join has hits x loci rows, so it is only done with up to -bh hits
+# The hits are made up with several hits per read in random positions of the genome of the annotation, by default 1k, 10k, 100k and 1M hits are used
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import pandas as pd
+import numpy as np
+import os
+import io
+import argparse
+import ast
+import tempfile
+import time
+import tracemalloc
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def load_script_functions (file_script, names):
+    """
+    Function that loads the functions and variables in names of the script without running it, the script does everything when it is imported
+    """
+    with open(file_script, "r") as infile:
+        tree = ast.parse(infile.read())
+    namespace = {"np":np, "pd":pd, "io":io}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in names:
+            exec(compile(ast.Module([node], []), file_script, "exec"), namespace)
+        elif isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id in names for target in node.targets):
+            exec(compile(ast.Module([node], []), file_script, "exec"), namespace)
+    return namespace
+
+def made_up_hits (number_hits, hits_read, length_genome, seed = 0):
+    """
+    Function that returns the lines of a tabular output of BLAST (default columns of the script) with number_hits hits, hits_read for each read,
+    in random positions and strands of a genome of length_genome nucleotides
+    """
+    generator = np.random.default_rng(seed)
+    reads = np.arange(number_hits)//hits_read
+    lengths = generator.integers(300, 1000, number_hits)
+    starts = generator.integers(1, length_genome-1000, number_hits)
+    is_minus = generator.random(number_hits) < 0.5
+    identities = generator.uniform(90, 100, number_hits)
+    bitscores = lengths*identities/55
+    return [f"read_{read:07d}_A01_\tNC_002947.4\t{identity:.3f}\t{length}\t{int(length*(100-identity)/100)}\t0\t1\t{length}\t"
+            f"{start+length-1 if minus else start}\t{start if minus else start+length-1}\t{'0.0' if bitscore > 400 else '1e-200'}\t{bitscore:.1f}\t{'minus' if minus else 'plus'}\n"
+            for read, length, start, minus, identity, bitscore in zip(reads, lengths, starts, is_minus, identities, bitscores)]
+
+def measure_join (namespace, lines, columns, table_ann, columns_ann, annotation_index):
+    """
+    Function that reads and joins lines with the functions of the script in namespace and returns the final table, the peak memory in bytes,
+    the memory in bytes of the largest table of hits read and the time in seconds
+    """
+    directory_temporal = tempfile.mkdtemp()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tables = []
+    size_hits = 0
+    groups_hits = namespace["group_query_hits"](iter(lines), columns.index("qaccver"))
+    for table_seq in namespace["read_hits_chunks"](groups_hits, columns, os.path.join(directory_temporal, "all_seq_aligned.tsv")):
+        size_hits = max(size_hits, table_seq.memory_usage(deep = True).sum())
+        tables.extend(namespace["join_hits_loci"](table_seq, columns, table_ann, columns_ann, annotation_index, 0.1))
+    final_table = pd.concat([table for table in tables[0::2]+tables[1::2] if len(table) > 0] or tables[:1], ignore_index = True)
+    _, peak = tracemalloc.get_traced_memory()
+    time_join = time.perf_counter()-start
+    tracemalloc.stop()
+    os.remove(os.path.join(directory_temporal, "all_seq_aligned.tsv"))
+    os.rmdir(directory_temporal)
+    return final_table, peak, size_hits, time_join
+
+def measure_join_baseline (lines, columns, table_ann, columns_ann, range_value):
+    """
+    Function that reads and joins lines as the previous versions of the script did (the whole tabular output with the types of pandas and a cross join
+    with the annotation) and returns the final table, the peak memory in bytes and the time in seconds
+    """
+    directory_temporal = tempfile.mkdtemp()
+    file_tabular = os.path.join(directory_temporal, "all_seq_aligned.tsv")
+    with open(file_tabular, "w") as outfile:
+        outfile.write("\t".join(columns)+"\n")
+        outfile.writelines(lines)
+    table_ann = table_ann.copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    table_seq = pd.read_table(file_tabular, sep = "\t")
+    table_seq["key"] = 1
+    table_ann["key"] = 1
+    table_cross = pd.merge(table_seq, table_ann, on = "key").drop("key", axis = 1)
+    table_matches = table_cross[(table_cross["sstart"] >= table_cross["Start"]) & (table_cross["End"] >= table_cross["sstart"])]
+    table_matches = table_matches[columns+columns_ann]
+    del table_cross
+    table_not_matches = table_seq[~table_seq["qaccver"].isin(table_matches["qaccver"])][columns]
+    final_table = pd.concat([table_matches, table_not_matches], sort = False)
+    final_table["Highest bit score"] = final_table.groupby("qaccver", sort = False)["bitscore"].transform("max")
+    final_table = final_table[final_table["bitscore"] >= final_table["Highest bit score"]*(1-range_value)].drop(columns = "Highest bit score")
+    _, peak = tracemalloc.get_traced_memory()
+    time_join = time.perf_counter()-start
+    tracemalloc.stop()
+    os.remove(file_tabular)
+    os.rmdir(directory_temporal)
+    return final_table, peak, time_join
+
+directory_script = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description = "Benchmark of the memory of the join of the BLAST hits with the annotation with compact and default types and with the cross join")
+parser.add_argument("annotation", nargs = "?", default = os.path.join(directory_script, "input", "Pseudomonas_putida_KT2440_110.csv"),
+                    help = "Annotation file of the genome, by default %(default)s")
+parser.add_argument("-n", "--hits", nargs = "+", default = [1000, 10000, 100000, 1000000], type = int,
+                    help = "Numbers of hits of the tabular outputs, by default %(default)s")
+parser.add_argument("-hr", "--hitsRead", default = 10, type = int,
+                    help = "Number of hits of each read, by default %(default)s")
+parser.add_argument("-bh", "--baselineHits", default = 1000, type = int,
+                    help = "Maximum number of hits joined with the cross join of the previous versions (baseline), it needs hits x loci rows (about 1.6 GiB for 1000 hits with the annotation of P. putida). By default %(default)s")
+args = parser.parse_args()
+
+namespace = load_script_functions(os.path.join(directory_script, "ScriptAllignmentAnnotation_v200.py"),
+                                  ["build_annotation_index", "match_spans_to_loci", "match_positions_to_loci", "hit_spans", "blast_columns_types",
+                                   "group_query_hits", "read_hits_chunks", "join_hits_loci", "compact_annotation_types"])
+types_compact = namespace["blast_columns_types"]
+# The types that pandas gives to the columns when they are not given
+types_default = {column:{"int32":"int64", "float32":"float64"}.get(kind, str) for column, kind in types_compact.items()}
+
+columns = ["qaccver", "saccver", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "sstrand"]
+columns_ann = ["Locus Tag", "Feature Type", "Start", "End", "Strand", "Gene Name", "Product Name", "Subcellular Localization [Confidence Class]"]
+table_ann_default = pd.read_csv(args.annotation)
+table_ann_compact = namespace["compact_annotation_types"](table_ann_default)
+annotation_index = namespace["build_annotation_index"](table_ann_default["Start"], table_ann_default["End"])
+
+print(f"""
+ Annotation {args.annotation}: {table_ann_default.memory_usage(deep = True).sum()/2**20:.1f} MiB with default types, {table_ann_compact.memory_usage(deep = True).sum()/2**20:.1f} MiB with compact types
+ {args.hitsRead} hits per read, peak memory of reading and joining the hits (time) and memory of the largest table of hits read
+ Baseline is the cross join of the previous versions (only up to {args.baselineHits} hits), the reductions are of the compact types against the default types and the baseline
+\t{'Hits':>10} {'Baseline (cross join)':>26} {'Default types':>34} {'Compact types':>34} {'Reduction':>16} {'Baseline':>8}""")
+for number_hits in args.hits:
+    lines = made_up_hits(number_hits, args.hitsRead, int(table_ann_default["End"].max()))
+
+    if number_hits <= args.baselineHits:
+        _, peak_baseline, time_baseline = measure_join_baseline(lines, columns, table_ann_default, columns_ann, 0.1)
+        text_baseline = f"{peak_baseline/2**20:>10.1f} MiB ({time_baseline:6.2f} s)"
+    else:
+        peak_baseline = None
+        text_baseline = f"{'-':>26}"
+
+    namespace["blast_columns_types"] = types_default
+    final_default, peak_default, size_default, time_default = measure_join(namespace, lines, columns, table_ann_default, columns_ann, annotation_index)
+    namespace["blast_columns_types"] = types_compact
+    final_compact, peak_compact, size_compact, time_compact = measure_join(namespace, lines, columns, table_ann_compact, columns_ann, annotation_index)
+
+    # Both types have to give the same final table
+    if final_default.to_csv(index = False) != final_compact.to_csv(index = False):
+        raise Exception(f"The final tables of {number_hits} hits are different with the default and the compact types")
+
+    print(f"\t{number_hits:>10} {text_baseline} {peak_default/2**20:>8.1f} MiB ({time_default:5.2f} s) {size_default/2**20:>7.1f} MiB "
+          f"{peak_compact/2**20:>8.1f} MiB ({time_compact:5.2f} s) {size_compact/2**20:>7.1f} MiB {peak_default/peak_compact:>7.1f}x {size_default/size_compact:>7.1f}x "
+          f"{f'{peak_baseline/peak_compact:.1f}x' if peak_baseline != None else '-':>8}")
+print()
@@ -0,0 +1,45 @@
+# Fixtures of the tests of LAPu-InsertsGenAnnotation-2.0.0
+
+# The script does everything when it is imported (it reads its arguments and runs the annotation), so its functions are loaded from its code
+# without running it: only the imports, the functions and the variables written before the arguments are read are executed
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import ast
+import os
+import types
+import pytest
+
+directory_entry = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+file_script = os.path.join(directory_entry, "ScriptAllignmentAnnotation_v200.py")
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def load_script (file_script):
+    """
+    Function that executes the code of the script before the parser of its arguments is created and returns its functions and variables
+    """
+    with open(file_script, "r") as infile:
+        tree = ast.parse(infile.read())
+    nodes = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "parser" for target in node.targets):
+            break
+        nodes.append(node)
+    namespace = {"__name__":"ScriptAllignmentAnnotation_v200"}
+    exec(compile(ast.Module(nodes, []), file_script, "exec"), namespace)
+    return types.SimpleNamespace(**namespace)
+
+@pytest.fixture(scope = "session")
+def script ():
+    return load_script(file_script)
+
+@pytest.fixture(scope = "session")
+def directory_input ():
+    return os.path.join(directory_entry, "input")
+
+@pytest.fixture(scope = "session")
+def directory_output ():
+    return os.path.join(directory_entry, "output")
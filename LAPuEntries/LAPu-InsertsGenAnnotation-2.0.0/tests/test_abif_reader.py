@@ -0,0 +1,74 @@
+# Tests of the reader of the ABIF (ab1) files (read_abif_basecalls and read_quality_file)
+
+# The reference is SeqIO.read(..., "abi") of biopython with the traces of input/sequencing_results
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import os
+import struct
+import numpy as np
+import pytest
+from Bio import SeqIO
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+@pytest.fixture(scope = "module")
+def files_abif (directory_input):
+    directory_traces = os.path.join(directory_input, "sequencing_results")
+    return sorted(os.path.join(directory_traces, file) for file in os.listdir(directory_traces) if file.endswith(".ab1"))
+
+def write_abif (file_abif, tags):
+    """
+    Function that writes an ABIF file with the tags given (name, number and data), with the header and the directory at the end of the file
+    """
+    data_tags, entries = b"", b""
+    offset_data = 34 # The header is 6 bytes and the entry of the directory in the header 28 bytes
+    for name_tag, number_tag, data in tags:
+        # The data of 4 bytes or less is stored in the entry itself, padded with zeros
+        offset = int.from_bytes(data.ljust(4, b"\0"), "big") if len(data) <= 4 else offset_data+len(data_tags)
+        entries += struct.pack(">4sihhiiii", name_tag, number_tag, 2, 1, len(data), len(data), offset, 0)
+        data_tags += data if len(data) > 4 else b""
+    header = b"ABIF"+struct.pack(">h", 101)+struct.pack(">4sihhiiii", b"tdir", 1, 1023, 28, len(tags), len(entries), offset_data+len(data_tags), 0)
+    with open(file_abif, "wb") as outfile:
+        outfile.write(header+data_tags+entries)
+
+def test_same_reads_as_seqio (script, files_abif):
+    assert len(files_abif) > 0
+    for file_abif in files_abif:
+        record = SeqIO.read(file_abif, "abi")
+        sample_name, sequence, qualities = script.read_abif_basecalls(file_abif)
+        assert sample_name == record.id
+        assert sequence.tobytes().decode() == str(record.seq)
+        assert qualities.tolist() == record.letter_annotations["phred_quality"]
+
+def test_fastq_of_quality_file (script, files_abif, directory_output):
+    # The fastq text of each read is the one of the merged fastq of the example, with the file name as id
+    reads_example = {record.id:record.format("fastq") for record in SeqIO.parse(os.path.join(directory_output, "all_reads_merged_quality.fastq"), "fastq")}
+    for file_abif in files_abif:
+        name_read = os.path.basename(file_abif)[:-len(".ab1")]
+        _, sequence, qualities, text_fastq = script.read_quality_file(file_abif, "abi", name_read)
+        assert text_fastq == reads_example[name_read]
+        assert len(sequence) == len(qualities)
+
+def test_small_tags_in_directory (script, tmp_path):
+    # The base calls and qualities of 4 bytes or less are stored in the entry of the directory
+    file_abif = os.path.join(tmp_path, "short.ab1")
+    write_abif(file_abif, [(b"PBAS", 2, b"ACG"), (b"PCON", 2, bytes([30, 20, 10])), (b"SMPL", 1, b"\x06sample")])
+    sample_name, sequence, qualities = script.read_abif_basecalls(file_abif)
+    assert sample_name == "sample"
+    assert sequence.tobytes() == b"ACG"
+    assert qualities.tolist() == [30, 20, 10]
+
+def test_file_without_basecalls (script, tmp_path):
+    file_abif = os.path.join(tmp_path, "no_basecalls.fsa")
+    write_abif(file_abif, [(b"SMPL", 1, b"\x06sample"), (b"DATA", 1, bytes(100))])
+    assert script.read_abif_basecalls(file_abif) == None
+
+def test_not_abif_file (script, tmp_path):
+    file_fasta = os.path.join(tmp_path, "read.ab1")
+    with open(file_fasta, "w") as outfile:
+        outfile.write(">read\nACGT\n")
+    with pytest.raises(ValueError):
+        script.read_abif_basecalls(file_fasta)
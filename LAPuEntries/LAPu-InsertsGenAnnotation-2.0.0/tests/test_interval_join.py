@@ -0,0 +1,123 @@
+# Tests of the join of the hits with the loci of the annotation (match_spans_to_loci and join_hits_loci)
+
+# The reference is the cross join of all the hits with all the loci that the previous versions of the script did, filtered by the positions
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import os
+import numpy as np
+import pandas as pd
+
+columns_ann = ["Locus Tag","Feature Type","Start","End","Strand","Gene Name","Product Name","Subcellular Localization [Confidence Class]"]
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def cross_join_pairs (starts, ends, table_ann):
+    """
+    Function that returns the pairs (span, locus) in which Start <= end and start <= End with a cross join of the spans and the annotation,
+    as row numbers of the spans and of the annotation in the order of the cross join
+    """
+    table_spans = pd.DataFrame({"start":starts, "end":ends, "span_row":np.arange(len(starts)), "key":1})
+    table_loci = pd.DataFrame({"Start":table_ann["Start"], "End":table_ann["End"], "locus_row":np.arange(len(table_ann)), "key":1})
+    table_cross = pd.merge(table_spans, table_loci, on = "key")
+    table_cross = table_cross[(table_cross["Start"] <= table_cross["end"]) & (table_cross["start"] <= table_cross["End"])]
+    return table_cross["span_row"].to_numpy(), table_cross["locus_row"].to_numpy()
+
+def cross_join_table (table_seq, columns_seq_alig, table_ann, range_value):
+    """
+    Function that returns the final table of the hits joined with the annotation as the previous versions of the script did it, with a cross join
+    """
+    table_seq, table_ann = table_seq.copy(), table_ann.copy()
+    table_seq["key"] = 1
+    table_ann["key"] = 1
+    table_cross = pd.merge(table_seq, table_ann, on = "key").drop("key", axis = 1)
+    table_matches = table_cross[(table_cross["sstart"] >= table_cross["Start"]) & (table_cross["End"] >= table_cross["sstart"])]
+    table_matches = table_matches[columns_seq_alig+columns_ann]
+    table_not_matches = table_seq[~table_seq["qaccver"].isin(table_matches["qaccver"])][columns_seq_alig]
+    final_table = pd.concat([table_matches, table_not_matches], sort = False)
+
+    final_table["Highest bit score"] = final_table.groupby("qaccver", sort = False)["bitscore"].transform("max")
+    final_table.drop(final_table[final_table["bitscore"] < final_table["Highest bit score"]*(1-range_value)].index, inplace = True)
+    del final_table["Highest bit score"]
+    final_table["Multiple Allignments"] = final_table.duplicated(subset = ["qaccver"], keep = False)
+    locus_associated = []
+    for query, _ in final_table.groupby("qaccver", sort = False):
+        locus_associated_query = list(final_table[final_table["qaccver"] == query]["Locus Tag"].values)
+        locus_associated.append(locus_associated_query[1:] if len(locus_associated_query) > 1 else "-")
+    final_table.drop_duplicates(subset = "qaccver", inplace = True, keep = "first")
+    final_table["Rest of Locus Tag Associated"] = locus_associated
+    return final_table
+
+def join_table (script, table_seq, columns_seq_alig, table_ann, range_value):
+    """
+    Function that returns the final table of the hits joined with the annotation with join_hits_loci, as the script does it
+    """
+    annotation_index = script.build_annotation_index(table_ann["Start"], table_ann["End"])
+    table_matches, table_not_matches = script.join_hits_loci(table_seq, columns_seq_alig, table_ann, columns_ann, annotation_index, range_value)
+    return pd.concat([table for table in [table_matches, table_not_matches] if len(table) > 0] or [table_matches], ignore_index = True)
+
+def test_positions_same_pairs_as_cross_join (script, directory_input, directory_output):
+    table_ann = pd.read_csv(os.path.join(directory_input, "Pseudomonas_putida_KT2440_110.csv"))
+    generator = np.random.default_rng(0)
+    # The positions of the example hits, random positions of the genome and the limits of the loci, that are in the locus
+    positions = np.concatenate([pd.read_csv(os.path.join(directory_output, "all_seq_aligned.tsv"), sep = "\t")["sstart"].to_numpy(),
+                                generator.integers(1, int(table_ann["End"].max())+100, 2000),
+                                table_ann["Start"].to_numpy()[:200], table_ann["End"].to_numpy()[:200], table_ann["End"].to_numpy()[:200]+1]).astype(float)
+
+    rows_positions, rows_loci = script.match_positions_to_loci(positions, script.build_annotation_index(table_ann["Start"], table_ann["End"]))
+    rows_positions_cross, rows_loci_cross = cross_join_pairs(positions, positions, table_ann)
+    assert len(rows_positions) > len(np.unique(rows_positions)) # Some positions are in overlapping loci
+    np.testing.assert_array_equal(rows_positions, rows_positions_cross)
+    np.testing.assert_array_equal(rows_loci, rows_loci_cross)
+
+def test_spans_same_pairs_as_cross_join (script, directory_input):
+    table_ann = pd.read_csv(os.path.join(directory_input, "Pseudomonas_putida_KT2440_110.csv"))
+    generator = np.random.default_rng(1)
+    starts = generator.integers(1, int(table_ann["End"].max()), 2000).astype(float)
+    ends = starts+generator.integers(0, 5000, 2000)
+
+    rows_spans, rows_loci = script.match_spans_to_loci(starts, ends, script.build_annotation_index(table_ann["Start"], table_ann["End"]))
+    rows_spans_cross, rows_loci_cross = cross_join_pairs(starts, ends, table_ann)
+    np.testing.assert_array_equal(rows_spans, rows_spans_cross)
+    np.testing.assert_array_equal(rows_loci, rows_loci_cross)
+
+def test_example_table_same_as_cross_join (script, directory_input, directory_output):
+    table_ann = pd.read_csv(os.path.join(directory_input, "Pseudomonas_putida_KT2440_110.csv"))
+    table_seq = pd.read_csv(os.path.join(directory_output, "all_seq_aligned.tsv"), sep = "\t")
+    columns_seq_alig = list(table_seq.columns)
+
+    for range_value in [0.0, 0.1, 0.5]:
+        final_cross = cross_join_table(table_seq, columns_seq_alig, table_ann, range_value)
+        final_table = join_table(script, table_seq, columns_seq_alig, table_ann, range_value)
+        assert final_table.to_csv(index = False) == final_cross.to_csv(index = False)
+
+def test_row_labels_do_not_collide (script, directory_input):
+    # The cross join dropped the hits under the bit score threshold by their row labels, and the labels of the hits without locus (the ones of
+    # the hits table) could be the same as the ones of the hits with locus (the ones of the cross join), so it could remove hits that were kept
+    table_ann = pd.read_csv(os.path.join(directory_input, "Pseudomonas_putida_KT2440_110.csv")).iloc[:3]
+    # With 3 loci the second hit (under the threshold) has the label 1*3+0 in the cross join, the same as the fourth hit (outside the loci)
+    position_locus = int(table_ann["Start"].iloc[0])
+    table_seq = pd.DataFrame({"qaccver":["read_in_locus", "read_in_locus", "read_other_locus", "read_outside"],
+                              "sstart":[position_locus, position_locus, position_locus, 10**7],
+                              "bitscore":[500, 100, 300, 300]})
+    columns_seq_alig = ["qaccver", "sstart", "bitscore"]
+
+    final_cross = cross_join_table(table_seq, columns_seq_alig, table_ann, 0.1)
+    final_table = join_table(script, table_seq, columns_seq_alig, table_ann, 0.1)
+    assert final_cross["qaccver"].tolist() == ["read_in_locus", "read_other_locus"]
+    assert final_table["qaccver"].tolist() == ["read_in_locus", "read_other_locus", "read_outside"]
+    assert final_table["Multiple Allignments"].tolist() == [False, False, False]
+
+def test_loci_without_locus_tag (script, directory_input, directory_output):
+    # The loci without Locus Tag are the only other difference with the cross join, they are written as nan and not as np.float64(nan)
+    table_ann = pd.read_csv(os.path.join(directory_input, "Pseudomonas_putida_KT2440_110.csv")).assign(**{"Locus Tag":np.nan})
+    table_seq = pd.read_csv(os.path.join(directory_output, "all_seq_aligned.tsv"), sep = "\t")
+    columns_seq_alig = list(table_seq.columns)
+
+    final_cross = cross_join_table(table_seq, columns_seq_alig, table_ann, 0.1)
+    final_table = join_table(script, table_seq, columns_seq_alig, table_ann, 0.1)
+    column_loci = "Rest of Locus Tag Associated"
+    assert final_table.drop(columns = column_loci).to_csv(index = False) == final_cross.drop(columns = column_loci).to_csv(index = False)
+    assert final_table[column_loci].astype(str).tolist() == final_cross[column_loci].astype(str).str.replace("np.float64(nan)", "nan").tolist()
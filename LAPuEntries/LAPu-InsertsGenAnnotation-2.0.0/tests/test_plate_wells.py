@@ -0,0 +1,40 @@
+# Tests of the wells of the plates (plate_geometry and find_well_positions)
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import os
+import numpy as np
+import pandas as pd
+
+# Expression of the script for the names of the reads of the sequencing results (the well between underscores)
+regex_names = r"_([a-zA-Z]+)(\d+)(?=_)|_(\d+)(?=_)"
+
+def test_plate_numbering (script):
+    geometry_column = script.plate_geometry(96)
+    geometry_row = script.plate_geometry(96, numbering = "row")
+    assert geometry_column["names"][[0, 1, 8, 95]].tolist() == ["A1", "B1", "A2", "H12"]
+    assert geometry_row["names"][[0, 1, 12, 95]].tolist() == ["A1", "A2", "B1", "H12"]
+    assert geometry_column["number"][1, 0] == 2 and geometry_row["number"][1, 0] == 13
+
+    geometry_1536 = script.plate_geometry(1536)
+    assert geometry_1536["rows"][-1] == "AF" and geometry_1536["columns"][-1] == 48
+    assert sorted(geometry_1536["number"].ravel().tolist()) == list(range(1, 1537))
+
+def test_wells_of_example_reads (script, directory_output):
+    queries = pd.read_csv(os.path.join(directory_output, "table_reads_genes_description.csv"))
+    positions, queries_not_matched, numbers_out_plate = script.find_well_positions(queries["qaccver"], regex_names, script.plate_geometry(96))
+    assert positions["PositionSeqPlate"].tolist() == queries["PositionSeqPlate"].tolist()
+    assert queries_not_matched == [] and numbers_out_plate == []
+
+def test_wells_by_name_and_number (script):
+    queries = ["run_B03_premix", "run_12_premix", "run_97_premix", "run_premix", "first_A01_then_C05_premix"]
+    positions, queries_not_matched, numbers_out_plate = script.find_well_positions(queries, regex_names, script.plate_geometry(96))
+
+    # The numbers are wells of the plate numbered by columns, the last well of a name is taken
+    assert positions["PositionSeqPlate"].tolist()[:2] == ["B03", "D2"]
+    assert positions["PositionSeqPlate"].isna().tolist() == [False, False, True, True, False]
+    assert positions["PositionSeqPlate"].tolist()[4] == "C05"
+    assert positions["Row"].tolist()[:2] == ["B", "D"]
+    np.testing.assert_array_equal(positions["Column"].to_numpy()[[0, 1, 4]], [3, 2, 5])
+    assert queries_not_matched == ["run_premix"]
+    assert numbers_out_plate == ["97"]
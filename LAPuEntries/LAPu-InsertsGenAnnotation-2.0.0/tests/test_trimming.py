@@ -0,0 +1,71 @@
+# Tests of the quality trimming (trim_reads_quality and choose_trimming_thresholds)
+
+# The reference is the output of sickle se in the example of the entry: output/all_reads_merged_quality_trimmed.fastq is the trimming of
+# output/all_reads_merged_quality.fastq with the default thresholds Q 20 and length 20
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Import the neccesary python packages
+import os
+import numpy as np
+import pytest
+from Bio import SeqIO
+
+# Functions definitions
+# ----------------------------------
+# ----------------------------------
+
+def read_fastq_qualities (file_fastq):
+    """
+    Function that returns the reads of a fastq file as a list of id, sequence and Phred qualities
+    """
+    return [(record.id, str(record.seq), np.array(record.letter_annotations["phred_quality"], dtype = np.int64)) for record in SeqIO.parse(file_fastq, "fastq")]
+
+@pytest.fixture(scope = "module")
+def reads_example (directory_output):
+    return read_fastq_qualities(os.path.join(directory_output, "all_reads_merged_quality.fastq"))
+
+def test_same_reads_as_sickle (script, reads_example, directory_output):
+    reads_sickle = read_fastq_qualities(os.path.join(directory_output, "all_reads_merged_quality_trimmed.fastq"))
+    five_prime_cuts, three_prime_cuts = script.trim_reads_quality([qualities for _, _, qualities in reads_example], 20, 20)
+
+    reads_trimmed = [(id_read, sequence[five_prime_cut:three_prime_cut], qualities[five_prime_cut:three_prime_cut])
+                     for (id_read, sequence, qualities), five_prime_cut, three_prime_cut in zip(reads_example, five_prime_cuts, three_prime_cuts)
+                     if five_prime_cut >= 0]
+    assert [(id_read, sequence) for id_read, sequence, _ in reads_trimmed] == [(id_read, sequence) for id_read, sequence, _ in reads_sickle]
+    for (_, _, qualities), (_, _, qualities_sickle) in zip(reads_trimmed, reads_sickle):
+        np.testing.assert_array_equal(qualities, qualities_sickle)
+
+def test_discarded_reads (script):
+    qualities = [np.full(30, 40), np.full(30, 5), np.full(10, 40), np.array([], dtype = np.int64), np.concatenate([np.full(15, 5), np.full(15, 40)])]
+    five_prime_cuts, three_prime_cuts = script.trim_reads_quality(qualities, 20, 12)
+
+    # Good read, read without good windows, read shorter than the length threshold, empty read and read with its 5' end trimmed
+    assert five_prime_cuts.tolist() == [0, -1, -1, -1, 15]
+    assert three_prime_cuts.tolist() == [30, -1, -1, -1, 30]
+
+def test_three_prime_cut (script):
+    # The window of a read of 40 nucleotides is 4, the first bad window after the good ones starts where the mean falls under 20
+    qualities = np.concatenate([np.full(25, 40), np.full(15, 2)])
+    five_prime_cuts, three_prime_cuts = script.trim_reads_quality([qualities], 20, 10)
+    assert (five_prime_cuts[0], three_prime_cuts[0]) == (0, 25)
+
+def test_thresholds_keep_retention (script, reads_example):
+    qualities = [qualities for _, _, qualities in reads_example]
+    for retention in [0.5, 0.8, 1.0]:
+        threshold, length_threshold, fraction_kept = script.choose_trimming_thresholds(qualities, retention)
+        five_prime_cuts, _ = script.trim_reads_quality(qualities, threshold, length_threshold)
+        assert length_threshold >= 20
+        assert fraction_kept == (five_prime_cuts >= 0).sum()/len(qualities)
+        assert fraction_kept >= retention
+
+def test_thresholds_highest_quality_first (script, reads_example):
+    qualities = [qualities for _, _, qualities in reads_example]
+    threshold, _, _ = script.choose_trimming_thresholds(qualities, 0.5)
+    # No higher quality keeps the half of the reads with at least the minimum length
+    for threshold_higher in range(threshold+1, int(script.quality_per_position(qualities)["Percentile 50"].max())+1):
+        five_prime_cuts, _ = script.trim_reads_quality(qualities, threshold_higher, 20)
+        assert (five_prime_cuts >= 0).sum() < np.ceil(0.5*len(qualities))
+
+def test_thresholds_not_found (script):
+    assert script.choose_trimming_thresholds([np.full(30, 40), np.full(30, 40)], 1.0, minimum_length = 31) == None
+    assert script.choose_trimming_thresholds([], 0.5) == None